@@ -1,17 +1,28 @@
+import copy
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import pandas as pd
-from openpyxl import load_workbook
 
-from constants import APP_CONFIG_MAIN_SETTINGS_SHEET, APP_CONFIG_URLS_TO_PROTOCOLS_SHEET, APP_CONFIG_FILE
+if TYPE_CHECKING:
+    from openpyxl import Workbook
+
+from constants import APP_CONFIG_MAIN_SETTINGS_SHEET, APP_CONFIG_URLS_TO_PROTOCOLS_SHEET, APP_CONFIG_FILE, RANKS
 
 
 class ApplicationConfig:
-    def __init__(self, excel_file: str):
+    def __init__(self, excel_file: str, workbook: 'Workbook' = None):
+        # уже открытая книга передается загрузчиком конфигураторов, чтобы не читать файл повторно
         self._excel_file = excel_file
-        self._workbook = load_workbook(self._excel_file, read_only=True, keep_vba=False)
+        if workbook is None:
+            from openpyxl import load_workbook
+            workbook = load_workbook(self._excel_file, read_only=True, keep_vba=False)
+        self._workbook = workbook
+        self._main_settings = None
+        self._all_protocol_urls_df: pd.DataFrame = None
 
         self.rank_to_calculate = None
+        self.ranks_to_calculate = None
         self.protocol_source_type = None
         self.protocols_dir: Path = None
         self.race_of_the_top_protocols_dir = None
@@ -20,6 +31,15 @@ class ApplicationConfig:
         self.rank_color = None
         self.last_race_flag = None
         self.season = None
+        self.incremental_calculation = None
+        self.rank_engine = None
+        self.rank_engine_parity_check = None
+        self.protocols_cache = None
+        self.protocols_workers = None
+        self.download_workers = None
+        self.telemetry = None
+        self.profiling = None
+        self.season_db = None
         self._load_main_settings()
 
         self.protocol_urls_df: pd.DataFrame = None
@@ -34,12 +54,55 @@ class ApplicationConfig:
         self.mapping_group_df: pd.DataFrame = None
         self._load_mapping_group_df()
 
+    def __getstate__(self):
+        # книга Excel не передается в процессы обработки протоколов, все настройки из нее уже загружены
+        state = self.__dict__.copy()
+        state['_workbook'] = None
+        return state
+
+    @property
+    def main_settings(self) -> dict:
+        return self._main_settings
+
+    def for_rank(self, rank_to_calculate: str) -> 'ApplicationConfig':
+        # настройки для другого типа ранга без повторного чтения книги Excel (пакетный режим)
+        application_config = copy.copy(self)
+        application_config.rank_to_calculate = rank_to_calculate
+        application_config._load_rank_settings()
+        application_config._filter_protocol_urls_df()
+        return application_config
+
     def _load_main_settings(self):
         main_settings = dict(value[:2] for value in self._workbook[APP_CONFIG_MAIN_SETTINGS_SHEET].values)
+        self._main_settings = main_settings
 
         self.protocol_source_type = main_settings['Тип источника протоколов']
 
         self.rank_to_calculate = main_settings['Ранг для расчета']
+        self._load_rank_settings()
+        self.last_race_flag = main_settings['Последнее соревнование сезона?']
+        self.season = main_settings['Сезон']
+        self.incremental_calculation = main_settings.get('Инкрементальный расчет', 'да')
+        self.rank_engine = main_settings.get('Движок расчета ранга', 'Decimal')
+        self.rank_engine_parity_check = main_settings.get('Сверка движка расчета ранга с Decimal', 'нет')
+        self.protocols_cache = main_settings.get('Кэш протоколов', 'да')
+        self.protocols_workers = main_settings.get('Кол-во процессов для обработки протоколов', 1)
+        self.download_workers = main_settings.get('Кол-во потоков загрузки протоколов', 4)
+        self.telemetry = main_settings.get('Телеметрия расчета', 'нет')
+        self.profiling = main_settings.get('Профилирование расчета', 'нет')
+        self.season_db = main_settings.get('База данных сезона', 'нет')
+
+        # пакетный режим: несколько типов ранга за один запуск (через запятую или "все")
+        ranks_to_calculate = main_settings.get('Ранги для расчета')
+        if not ranks_to_calculate:
+            self.ranks_to_calculate = [self.rank_to_calculate]
+        elif ranks_to_calculate == 'все':
+            self.ranks_to_calculate = list(RANKS)
+        else:
+            self.ranks_to_calculate = [rank.strip() for rank in ranks_to_calculate.split(',') if rank.strip()]
+
+    def _load_rank_settings(self):
+        main_settings = self._main_settings
         if self.rank_to_calculate == 'Общий летний ранг':
             self.protocols_dir = main_settings['Путь к папке со всеми протоколами для Общего летнего ранга']
             self.previous_year_final_rank_file = main_settings[
@@ -72,12 +135,14 @@ class ApplicationConfig:
             self.rank_color = main_settings['Цвет ранга Гонки сильнейших']
         self.protocols_dir = Path(self.protocols_dir)
         self.rank_dir = Path(self.rank_dir)
-        self.last_race_flag = main_settings['Последнее соревнование сезона?']
-        self.season = main_settings['Сезон']
 
     def _load_protocol_urls_df(self):
         protocol_urls = list(self._workbook[APP_CONFIG_URLS_TO_PROTOCOLS_SHEET].values)
-        all_protocol_urls_df = pd.DataFrame(protocol_urls[1:], columns=protocol_urls[0])
+        self._all_protocol_urls_df = pd.DataFrame(protocol_urls[1:], columns=protocol_urls[0])
+        self._filter_protocol_urls_df()
+
+    def _filter_protocol_urls_df(self):
+        all_protocol_urls_df = self._all_protocol_urls_df
         all_protocol_urls_df = all_protocol_urls_df[(all_protocol_urls_df[self.rank_to_calculate] == 'да') &
                                                     (all_protocol_urls_df['Сезон'] == self.season)]
         self.protocol_urls_df = all_protocol_urls_df[['Ссылка']]
@@ -0,0 +1,166 @@
+import argparse
+import gc
+import logging
+import multiprocessing
+import tempfile
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from app_config import ApplicationConfig
+from constants import APP_CONFIG_FILE, RANK_CONFIG_FILE, VERSION
+from logger import setup_logging
+from main import calculate_current_rank, get_previous_year_final_rank, get_race_numbers
+from output_writer import output_writer
+from prepare_protocols import prepare_protocols
+from rank_engine import RankEngine
+from rank_formula_config import RankFormulaConfig
+from save_current_rank import save_current_rank
+from synthetic_season import generate_season
+
+DEFAULT_SIZES = '500x8,2000x16,5000x24'
+
+
+def parse_sizes(sizes: str) -> list:
+    # размеры сезона: "<кол-во участников>x<кол-во соревнований>" через запятую
+    try:
+        sizes = [tuple(int(value) for value in size.lower().split('x')) for size in sizes.split(',')]
+    except ValueError:
+        sizes = []
+    if not sizes or any(len(size) != 2 for size in sizes):
+        raise argparse.ArgumentTypeError('sizes must look like 500x8,2000x16')
+    return sizes
+
+
+class StageTimer:
+    # время и пик памяти каждого этапа; память отслеживается через tracemalloc только в отдельном прогоне,
+    # чтобы трассировка выделений не искажала замер времени
+    def __init__(self, trace_memory: bool):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    def run(self, stage: str, function, *args):
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = function(*args)
+        # записи Excel, поставленные этапом в очередь, относятся к этому этапу
+        output_writer.flush()
+        seconds = time.perf_counter() - start
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.stages.append((stage, seconds, peak))
+        return result
+
+
+def load_configs(app_config_file: str, rank_config_file: str) -> tuple:
+    return ApplicationConfig(app_config_file), RankFormulaConfig(rank_config_file)
+
+
+def run_stages(app_config_file: str, rank_config_file: str, work_dir: Path, trace_memory: bool) -> tuple:
+    timer = StageTimer(trace_memory)
+    application_config, rank_formula_config = timer.run('Загрузка конфигураторов', load_configs,
+                                                        app_config_file, rank_config_file)
+
+    # расчет идет по синтетическому сезону с нуля: без контрольных точек и кэша протоколов
+    application_config.protocols_dir = work_dir / 'Протоколы'
+    application_config.previous_year_final_rank_file = work_dir / 'Предыдущий год'
+    application_config.rank_dir = work_dir / 'Ранг'
+    application_config.rank_dir.mkdir(exist_ok=True)
+    application_config.incremental_calculation = 'нет'
+    application_config.protocols_cache = 'нет'
+
+    protocols_df, left_races_df, _ = timer.run('Обработка протоколов', prepare_protocols,
+                                               application_config, rank_formula_config)
+
+    rank_engine = RankEngine(application_config.rank_engine, application_config.rank_engine_parity_check == 'да')
+    race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank = get_race_numbers(
+        application_config, rank_formula_config)
+    df_previous_year_final_rank = get_previous_year_final_rank(application_config, update_store=False)
+    current_rank_df = timer.run('calculate_current_rank', calculate_current_rank, application_config,
+                                rank_formula_config, rank_engine, protocols_df, left_races_df,
+                                df_previous_year_final_rank, race_number_to_start_apply_rules,
+                                race_number_to_start_apply_relative_rank)
+
+    participants_number = len(current_rank_df)
+    timer.run('save_current_rank', save_current_rank, application_config, current_rank_df)
+
+    rows = {'Загрузка конфигураторов': None,
+            'Обработка протоколов': len(protocols_df),
+            'calculate_current_rank': len(protocols_df),
+            'save_current_rank': participants_number}
+    return timer.stages, rows
+
+
+def run_benchmark(app_config_file: str, rank_config_file: str, sizes: list, repeat: int, seed: int,
+                  work_dir: Path) -> pd.DataFrame:
+    application_config, rank_formula_config = load_configs(app_config_file, rank_config_file)
+
+    records = []
+    for participants_number, competitions_number in sizes:
+        size = '{}x{}'.format(participants_number, competitions_number)
+        size_dir = work_dir / size
+        size_dir.mkdir(parents=True, exist_ok=True)
+        protocol_rows = generate_season(rank_formula_config, size_dir / 'Протоколы', size_dir / 'Предыдущий год',
+                                        application_config.rank_to_calculate, application_config.season,
+                                        participants_number, competitions_number, seed=seed)
+        logging.info('Синтетический сезон {}: {} строк протоколов'.format(size, protocol_rows))
+
+        # время - лучшее из нескольких прогонов, пик памяти - из отдельного прогона с tracemalloc
+        timings = []
+        for _ in range(repeat):
+            stages, rows = run_stages(app_config_file, rank_config_file, size_dir, False)
+            timings.append(stages)
+        memory_stages, _ = run_stages(app_config_file, rank_config_file, size_dir, True)
+
+        for stage_number, (stage, _, peak) in enumerate(memory_stages):
+            seconds = min(stages[stage_number][1] for stages in timings)
+            records.append({'Дата замера': datetime.now().isoformat(timespec='seconds'),
+                            'Версия': VERSION,
+                            'Движок расчета ранга': application_config.rank_engine,
+                            'Участники': participants_number,
+                            'Соревнования': competitions_number,
+                            'Этап': stage,
+                            'Время, с': round(seconds, 3),
+                            'Строк': rows[stage],
+                            'Строк в секунду': round(rows[stage] / seconds) if rows[stage] else None,
+                            'Пик памяти, МБ': round(peak / 2 ** 20, 1)})
+    return pd.DataFrame(records).astype({'Строк': 'Int64', 'Строк в секунду': 'Int64'})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замер времени и памяти этапов расчета ранга на синтетическом сезоне')
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes(DEFAULT_SIZES),
+                        help='размеры сезона: <участники>x<соревнования> через запятую (по умолчанию {})'.format(
+                            DEFAULT_SIZES))
+    parser.add_argument('--repeat', type=int, default=3, help='кол-во прогонов для замера времени')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--app-config', default=APP_CONFIG_FILE)
+    parser.add_argument('--rank-config', default=RANK_CONFIG_FILE)
+    parser.add_argument('--work-dir', type=Path, help='папка для синтетических протоколов и результатов '
+                                                      '(по умолчанию - временная)')
+    parser.add_argument('--output', type=Path, default=Path('benchmark.csv'),
+                        help='CSV, в который дописываются результаты замеров')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        report_df = run_benchmark(args.app_config, args.rank_config, args.sizes, args.repeat, args.seed,
+                                  args.work_dir or Path(temp_dir))
+
+    logging.info('Результаты замеров:\n' + report_df.drop(columns=['Дата замера', 'Версия']).to_string(index=False))
+    report_df.to_csv(args.output, mode='a', header=not args.output.exists(), index=False, encoding='utf-8-sig')
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    setup_logging()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        main()
@@ -1 +1,2 @@
+python startup_check.py || exit /b 1
 pyinstaller main.py --noconfirm --clean --onefile --name fso_karelia_rank --add-data "logger.yaml;." --icon fso_karelia_rank.ico
\ No newline at end of file
@@ -0,0 +1,81 @@
+import hashlib
+import logging
+import os
+import pickle
+from pathlib import Path
+
+import pandas as pd
+
+from app_config import ApplicationConfig
+from constants import VERSION, CHECKPOINT_VERSION, CHECKPOINTS_DIR
+from fingerprints import get_df_hash
+from rank_formula_config import RankFormulaConfig
+
+
+def get_base_fingerprint(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig,
+                         df_previous_year_final_rank: pd.DataFrame,
+                         race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank) -> str:
+    fingerprint = hashlib.sha256()
+    for value in (VERSION, CHECKPOINT_VERSION,
+                  application_config.rank_to_calculate, application_config.season, application_config.rank_engine,
+                  race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank,
+                  rank_formula_config.race_percentage_for_final_rank,
+                  rank_formula_config.race_percentage_to_reset_final_rank):
+        fingerprint.update(repr(value).encode())
+    for df in (rank_formula_config.penalty_lack_races_df, df_previous_year_final_rank):
+        fingerprint.update(get_df_hash(df).encode())
+    return fingerprint.hexdigest()
+
+
+def get_competition_fingerprint(previous_fingerprint: str, competition: str, protocol_df: pd.DataFrame,
+                                left_race_df: pd.DataFrame, final_rank_flag: bool) -> str:
+    # отпечаток соревнования включает отпечаток предыдущего, поэтому изменение любого
+    # более раннего протокола делает недействительными все последующие контрольные точки
+    fingerprint = hashlib.sha256()
+    for value in (previous_fingerprint, competition, get_df_hash(protocol_df), get_df_hash(left_race_df),
+                  final_rank_flag):
+        fingerprint.update(repr(value).encode())
+    return fingerprint.hexdigest()
+
+
+def get_checkpoints_dir(application_config: ApplicationConfig) -> Path:
+    return application_config.rank_dir / CHECKPOINTS_DIR
+
+
+def save_checkpoint(application_config: ApplicationConfig, fingerprint: str, state: dict):
+    checkpoints_dir = get_checkpoints_dir(application_config)
+    checkpoints_dir.mkdir(exist_ok=True)
+    checkpoint_file = checkpoints_dir / '{}.pkl'.format(fingerprint)
+    tmp_file = checkpoints_dir / '{}.tmp'.format(fingerprint)
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def find_last_checkpoint(application_config: ApplicationConfig, fingerprints: list, output_files: list) -> int:
+    # ищем последнее соревнование, для которого сохранена контрольная точка с тем же отпечатком
+    # и при этом файлы текущего ранга по нему и всем предыдущим соревнованиям на месте
+    checkpoints_dir = get_checkpoints_dir(application_config)
+    last_checkpoint = 0
+    for competition_number, fingerprint in enumerate(fingerprints, start=1):
+        if not output_files[competition_number - 1].exists():
+            break
+        if (checkpoints_dir / '{}.pkl'.format(fingerprint)).exists():
+            last_checkpoint = competition_number
+    return last_checkpoint
+
+
+def load_checkpoint(application_config: ApplicationConfig, fingerprint: str) -> dict:
+    with open(get_checkpoints_dir(application_config) / '{}.pkl'.format(fingerprint), 'rb') as f:
+        return pickle.load(f)
+
+
+def remove_stale_checkpoints(application_config: ApplicationConfig, fingerprints: list):
+    checkpoints_dir = get_checkpoints_dir(application_config)
+    if not checkpoints_dir.is_dir():
+        return
+    actual_files = {'{}.pkl'.format(fingerprint) for fingerprint in fingerprints}
+    for name in os.listdir(checkpoints_dir):
+        if name not in actual_files:
+            os.remove(checkpoints_dir / name)
+            logging.debug('Удалена устаревшая контрольная точка {}'.format(name))
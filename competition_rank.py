@@ -0,0 +1,135 @@
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+from current_rank import get_group_starts
+from participants import PARTICIPANT_ID
+from rank_engine import RankEngine
+
+
+def get_top_result(participants_number: np.ndarray) -> np.ndarray:
+    # кол-во лучших результатов для сравнительного времени
+    return np.select([participants_number > 8, np.isin(participants_number, (7, 8)),
+                      np.isin(participants_number, (5, 6))],
+                     [5, 4, 3], 2)
+
+
+def get_top_relative_rank_results(participants_number: np.ndarray,
+                                  participants_number_for_relative_rank: np.ndarray) -> np.ndarray:
+    # кол-во участников с лучшим текущим рангом для сравнительного ранга соревнований
+    return np.select([participants_number_for_relative_rank > 8, np.isin(participants_number, (7, 8)),
+                      participants_number == 6],
+                     [7, 6, 5], participants_number_for_relative_rank)
+
+
+def sort_by_rank_descending(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    # сортировка по убыванию ранга внутри групп; равные ранги остаются в исходном порядке строк
+    rank_codes, _ = pd.factorize(values, sort=True)
+    return np.lexsort((np.arange(len(values)), -rank_codes, groups))
+
+
+def calculate_competition_rank(protocol_df: pd.DataFrame, current_rank_df: pd.DataFrame, apply_relative_rank: bool,
+                               rank_engine: RankEngine) -> pd.DataFrame:
+    # tсравнит, сравнительный ранг соревнований, N, ранг по группе и ранг сразу для всех возрастных групп соревнования
+    # (результат тот же, что у расчета по каждой группе через groupby(['Файл протокола', 'Возрастная группа']).apply(),
+    # строки возвращаются в порядке протокола)
+    protocol_df = protocol_df[protocol_df['Возрастная группа'].notna()]
+    group_codes, _ = pd.factorize(protocol_df['Возрастная группа'], sort=True)
+    group_order = np.argsort(group_codes, kind='stable')
+
+    # строки каждой возрастной группы идут подряд
+    df = protocol_df.iloc[group_order].copy()
+    groups = group_codes[group_order]
+    starts = get_group_starts(groups)
+
+    # исключаем снятных из кол-ва участников для расчета ранга соревнований
+    participants_number = np.bincount(groups, weights=df['left_race'].isna().to_numpy(),
+                                      minlength=len(starts)).astype(np.int64)
+
+    # учитываем снятых для расчета сравнительго ранга соревнований
+    participants_number_for_relative_rank = np.bincount(groups, minlength=len(starts))
+
+    # сравнительное время: результаты каждой группы по возрастанию (пропуски в конце)
+    results = df['result_in_seconds'].to_numpy(dtype=float)
+    results_order = np.lexsort((results, groups))
+    comparative_times = pd.Series(rank_engine.means_by_top(df['result_in_seconds'].iloc[results_order], starts,
+                                                           get_top_result(participants_number)))
+    # у группы из одного участника без результата сравнительное время - NaN (а не Decimal('NaN')),
+    # как при присвоении значения колонке группы
+    df['tсравнит '] = comparative_times.where(comparative_times.notna(), np.nan).to_numpy()[groups]
+
+    # текущий ранг еще отсутствует или в группе один участник
+    relative_rank = df['Ранг группы'].to_numpy()
+    relative_rank_groups = np.zeros(len(starts), dtype=bool)
+
+    if apply_relative_rank and len(current_rank_df) > 0:
+        df_top = pd.DataFrame({PARTICIPANT_ID: df[PARTICIPANT_ID].reset_index(drop=True), 'row': np.arange(len(df))}) \
+                   .merge(current_rank_df[[PARTICIPANT_ID, 'Текущий ранг']], how='left', on=PARTICIPANT_ID)
+        df_top = df_top[df_top['Текущий ранг'].notna()]
+        top_groups = groups[df_top['row'].to_numpy()]
+
+        # есть текущий ранг и в группе больше одного участника
+        numbers_df = pd.DataFrame({'group': groups, '№ п/п': df['№ п/п'].to_numpy()}).dropna().drop_duplicates()
+        relative_rank_groups = (np.bincount(top_groups, minlength=len(starts)) > 0) & \
+                               (np.bincount(numbers_df['group'], minlength=len(starts)) > 1)
+
+    if relative_rank_groups.any():
+        # участники с лучшим текущим рангом в каждой группе
+        df_top = df_top[relative_rank_groups[top_groups]]
+        df_top = df_top.iloc[sort_by_rank_descending(df_top['Текущий ранг'].to_numpy(),
+                                                     groups[df_top['row'].to_numpy()])]
+        top_groups = groups[df_top['row'].to_numpy()]
+        top_starts = get_group_starts(top_groups)
+        positions = np.arange(len(df_top)) - np.repeat(top_starts, np.diff(np.append(top_starts, len(df_top))))
+        top_relative_rank_results = get_top_relative_rank_results(participants_number,
+                                                                  participants_number_for_relative_rank)
+        df_top = df_top[positions < top_relative_rank_results[top_groups]]
+        top_groups = groups[df_top['row'].to_numpy()]
+
+        means = rank_engine.means(df_top['Текущий ранг'], get_group_starts(top_groups))
+        group_means = np.full(len(starts), np.nan, dtype=means.dtype)
+        group_means[relative_rank_groups] = means
+        relative_rank = np.where(relative_rank_groups[groups], group_means[groups], relative_rank)
+
+        rows = df_top['row'].to_numpy()
+        participants = (df['Фамилия'].iloc[rows].reset_index(drop=True) + ' ' +
+                        df['Имя'].iloc[rows].reset_index(drop=True) + ': ' +
+                        df_top['Текущий ранг'].apply(lambda x: round(Decimal(x), 2)).astype(str)
+                                              .reset_index(drop=True))
+        participants = participants.groupby(top_groups).agg(lambda x: x.str.cat(sep=', '))
+        df['Участники сравнит. ранга соревнований'] = participants.reindex(groups).to_numpy()
+
+    df['Сравнит. ранг соревнований'] = relative_rank
+
+    df['N'] = np.where(participants_number > 1, participants_number, 2)[groups]
+
+    # в группе без результатов ранг по группе - NaN (а не Decimal('NaN')), как при расчете по отдельной группе
+    no_results = np.bincount(groups, weights=~np.isnan(results), minlength=len(starts)) == 0
+    df['Ранг по группе'] = np.where(no_results[groups], np.nan, rank_engine.group_rank(df))
+
+    # строки возвращаются в порядке протокола
+    protocol_order = np.argsort(group_order, kind='stable')
+
+    # если участник в протоколе был сразу в нескольких возрастных группах,
+    # то для него берется лучший ранг из рассчитанных
+    df['Ранг'] = get_best_rank(df.iloc[protocol_order])[group_order]
+    return df.iloc[protocol_order]
+
+
+def get_best_rank(df: pd.DataFrame) -> np.ndarray:
+    # максимальный ранг по группе у каждого участника (равные - первый по порядку строк, как в Series.max()),
+    # у участника без ID ранга нет
+    ranks = df['Ранг по группе'].to_numpy()
+    ids = df[PARTICIPANT_ID].to_numpy(dtype=np.int64, na_value=-1)
+    rank_codes, _ = pd.factorize(ranks, sort=True)
+    order = np.lexsort((np.where(rank_codes >= 0, -rank_codes, 1), ids))
+
+    starts = get_group_starts(ids[order])
+    best_rows = order[starts]
+    best_ranks = np.where(rank_codes[best_rows] >= 0, ranks[best_rows], np.nan)
+
+    result = np.empty(len(df), dtype=best_ranks.dtype)
+    result[order] = np.repeat(best_ranks, np.diff(np.append(starts, len(order))))
+    result[ids == -1] = np.nan
+    return result
@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Optional
+
+from app_config import ApplicationConfig
+from constants import APP_CONFIG_FILE, RANK_CONFIG_FILE, VERSION, CONFIG_SNAPSHOT_VERSION, CONFIG_SNAPSHOT_DIR
+from fingerprints import get_file_hash
+from rank_formula_config import RankFormulaConfig
+from validation import app_config_validation, rank_config_validation
+
+
+def get_snapshot_key(*excel_files: str) -> str:
+    # снимок действителен, пока не изменились файлы конфигураторов (содержимое и время изменения)
+    # и версия формата снимка (ее нужно увеличивать при изменении классов настроек)
+    key = hashlib.sha256()
+    for value in (VERSION, CONFIG_SNAPSHOT_VERSION):
+        key.update(repr(value).encode())
+    for excel_file in excel_files:
+        for value in (Path(excel_file).name, get_file_hash(excel_file), os.stat(excel_file).st_mtime_ns):
+            key.update(repr(value).encode())
+    return key.hexdigest()
+
+
+def get_snapshot_file(key: str) -> Path:
+    return Path(CONFIG_SNAPSHOT_DIR) / '{}.pkl'.format(key)
+
+
+def load_snapshot(key: str) -> Optional[dict]:
+    snapshot_file = get_snapshot_file(key)
+    if not snapshot_file.exists():
+        return None
+    try:
+        with open(snapshot_file, 'rb') as f:
+            return pickle.load(f)
+    except Exception as e:
+        logging.debug('Снимок конфигураторов не прочитан ({}), конфигураторы загружаются заново'.format(e))
+        return None
+
+
+def save_snapshot(key: str, snapshot: dict):
+    # остается только снимок последней версии конфигураторов
+    snapshot_dir = Path(CONFIG_SNAPSHOT_DIR)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    snapshot_file = get_snapshot_file(key)
+    tmp_file = snapshot_dir / '{}.tmp'.format(key)
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, snapshot_file)
+    for name in os.listdir(snapshot_dir):
+        if name != snapshot_file.name:
+            os.remove(snapshot_dir / name)
+
+
+def load_configs(app_config_file: str = APP_CONFIG_FILE,
+                 rank_config_file: str = RANK_CONFIG_FILE) -> tuple[ApplicationConfig, RankFormulaConfig]:
+    # каждая книга открывается один раз и для проверки, и для загрузки настроек;
+    # если конфигураторы не изменились, настройки берутся из снимка без чтения книг
+    app_config_validation.check_app_config_exists(app_config_file)
+    rank_config_validation.check_rank_config_exists(rank_config_file)
+
+    key = get_snapshot_key(app_config_file, rank_config_file)
+    snapshot = load_snapshot(key)
+    if snapshot is not None:
+        app_config_validation.check_protocols_dirs(snapshot['main_settings'])
+        return snapshot['application_config'], snapshot['rank_formula_config']
+
+    from openpyxl import load_workbook
+    app_workbook = load_workbook(app_config_file, read_only=True, keep_vba=False)
+    rank_workbook = load_workbook(rank_config_file, read_only=True, keep_vba=False)
+    try:
+        app_config_validation.check_workbook(app_workbook)
+        rank_config_validation.check_workbook(rank_workbook)
+        application_config = ApplicationConfig(app_config_file, app_workbook)
+        rank_formula_config = RankFormulaConfig(rank_config_file, rank_workbook)
+    finally:
+        app_workbook.close()
+        rank_workbook.close()
+
+    try:
+        save_snapshot(key, {'main_settings': application_config.main_settings,
+                            'application_config': application_config,
+                            'rank_formula_config': rank_formula_config})
+    except OSError as e:
+        logging.debug('Снимок конфигураторов не сохранен: {}'.format(e))
+    return application_config, rank_formula_config
@@ -1,3 +1,6 @@
+import sys
+from pathlib import Path
+
 VERSION = 1
 APP_CONFIG_VERSION = 1
 RANK_CONFIG_VERSION = 1
@@ -15,3 +18,28 @@ RANK_CONFIG_GROUP_RANK_SHEET = 'Ранг группы'
 RANK_CONFIG_PENALTY_LACK_RACES_SHEET = 'Штраф за отсутствие старта'
 RANK_CONFIG_PENALTY_NOT_STARTED_SHEET = 'Штраф за не стартовал'
 RANK_CONFIG_PENALTY_LEFT_RACE_SHEET = 'Штраф за снят'
+
+RANKS = ('Общий летний ранг', 'Общий зимний ранг', 'Лесной ранг', 'Спринт ранг', 'Гонка сильнейших')
+
+RANK_ENGINES = ('Decimal', 'float64', 'int64')
+
+CHECKPOINT_VERSION = 5
+CHECKPOINTS_DIR = 'Контрольные точки'
+
+# папка приложения (в собранной версии - папка исполняемого файла): кэши хранятся в ней, а не в текущей папке,
+# поэтому не зависят от того, откуда запущено приложение
+APP_DIR = Path(sys.executable).resolve().parent if getattr(sys, 'frozen', False) else Path(__file__).resolve().parent
+
+PROTOCOLS_CACHE_VERSION = 3
+PROTOCOLS_CACHE_DIR = APP_DIR / 'cache' / 'protocols'
+
+DOWNLOAD_STATE_FILE = APP_DIR / 'cache' / 'downloads.json'
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_RETRIES = 3
+
+TELEMETRY_DIR = 'logs/telemetry'
+
+CONFIG_SNAPSHOT_VERSION = 3
+CONFIG_SNAPSHOT_DIR = APP_DIR / 'cache' / 'config'
+
+FINAL_RANKS_DIR = 'Итоговые ранги'
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from participants import PARTICIPANT_ID
+from rank_engine import RankEngine
+
+
+def get_group_starts(ids: np.ndarray) -> np.ndarray:
+    # ID отсортированы, поэтому группа участника начинается там, где ID меняется
+    if len(ids) == 0:
+        return np.array([], dtype=np.int64)
+    return np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+
+
+def select_top_races(df: pd.DataFrame, races_number) -> pd.DataFrame:
+    # лучшие ранги соревнований каждого участника за одну сортировку всей таблицы: строки упорядочены по ID,
+    # внутри участника - по убыванию ранга (пропуски в конце, равные ранги в исходном порядке),
+    # как при sort_values(by='Ранг', ascending=False).head(races_number) по группам
+    if len(df) == 0:
+        return df
+
+    ids = df[PARTICIPANT_ID].to_numpy(dtype=np.int64)
+    # ранги (в т.ч. Decimal) сравниваются через коды отсортированных уникальных значений
+    rank_codes, _ = pd.factorize(df['Ранг'], sort=True)
+    order = np.lexsort((np.where(rank_codes >= 0, -rank_codes, 1), ids))
+
+    starts = get_group_starts(ids[order])
+    positions = np.arange(len(order)) - np.repeat(starts, np.diff(np.append(starts, len(order))))
+    return df.iloc[order[positions < races_number]]
+
+
+def get_current_rank(df: pd.DataFrame, rank_engine: RankEngine) -> pd.DataFrame:
+    # текущий ранг по всем строкам участника (лучшие ранги соревнований и итоговый ранг прошлого сезона);
+    # остается одна строка на участника - с последним соревнованием, вошедшим в расчет, строки упорядочены по ID
+    df = df.iloc[np.argsort(df[PARTICIPANT_ID].to_numpy(dtype=np.int64), kind='stable')].reset_index(drop=True)
+    if len(df) == 0:
+        df['Текущий ранг'] = np.nan
+        return df
+
+    ids = df[PARTICIPANT_ID].to_numpy(dtype=np.int64)
+    starts = get_group_starts(ids)
+
+    # штраф зависит только от кол-ва соревнований участника, поэтому одинаков во всех его строках
+    # (у строки прошлого сезона штрафа нет, и у участника только с такой строкой штраф - пропуск)
+    penalties = df.groupby(ids, sort=True)['Штраф за отсутствующие старты'].first()
+    penalties = penalties.where(penalties.notna(), np.nan).to_numpy(dtype=object)
+    current_ranks = rank_engine.current_ranks(df['Ранг'], starts, penalties)
+
+    # последнее по дате соревнование участника, строка прошлого сезона (без даты) - только если других нет
+    dates = pd.to_datetime(df['Дата соревнования'])
+    no_date = dates.isna().to_numpy()
+    date_values = np.where(no_date, 0, dates.to_numpy(dtype='datetime64[ns]').view(np.int64))
+    order = np.lexsort((-date_values, no_date, ids))
+
+    df = df.iloc[order[starts]].reset_index(drop=True)
+    df['Текущий ранг'] = current_ranks
+    return df
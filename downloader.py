@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app_config import ApplicationConfig
+from constants import DOWNLOAD_STATE_FILE, DOWNLOAD_TIMEOUT, DOWNLOAD_RETRIES
+from errors import DownloadError
+from fingerprints import get_file_hash
+
+
+def create_session(workers: int) -> requests.Session:
+    session = requests.Session()
+    retry = Retry(total=DOWNLOAD_RETRIES, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def load_download_state() -> dict:
+    state_file = Path(DOWNLOAD_STATE_FILE)
+    if not state_file.exists():
+        return {}
+    with state_file.open(encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_download_state(state: dict):
+    state_file = Path(DOWNLOAD_STATE_FILE)
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = state_file.with_suffix('.tmp')
+    with tmp_file.open('w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, state_file)
+
+
+def download_protocol(session: requests.Session, url: str, protocol_files: list, validators: dict) -> tuple[str, dict]:
+    # если файлы уже загружены, сервер может ответить 304 без передачи содержимого
+    headers = {}
+    if all(protocol_file.exists() for protocol_file in protocol_files):
+        if validators.get('ETag'):
+            headers['If-None-Match'] = validators['ETag']
+        if validators.get('Last-Modified'):
+            headers['If-Modified-Since'] = validators['Last-Modified']
+
+    response = session.get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+    if response.status_code == 304:
+        return 'не изменился', validators
+    response.raise_for_status()
+
+    validators = {header: response.headers[header] for header in ('ETag', 'Last-Modified')
+                  if header in response.headers}
+
+    # urllib3 1.x не сверяет длину содержимого с Content-Length, и оборванная передача выглядит как полный ответ
+    content = response.content
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None and 'Content-Encoding' not in response.headers and \
+            len(content) != int(content_length):
+        raise requests.RequestException('incomplete transfer ({} of {} bytes)'.format(len(content), content_length))
+
+    # файл с тем же содержимым не перезаписываем, чтобы не сбрасывать кэш протоколов
+    content_hash = hashlib.sha256(content).hexdigest()
+    status = 'не изменился'
+    for protocol_file in protocol_files:
+        if protocol_file.exists() and get_file_hash(protocol_file) == content_hash:
+            continue
+
+        # сохраняем исходные байты (с исходной кодировкой) через временный файл, чтобы не оставить недописанный протокол
+        tmp_file = protocol_file.with_name(protocol_file.name + '.tmp')
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_file, protocol_file)
+        finally:
+            if tmp_file.exists():
+                os.remove(tmp_file)
+        status = 'загружен'
+    return status, validators
+
+
+def get_protocol_files(application_configs: list) -> dict:
+    # протокол, отмеченный для нескольких типов ранга, загружается один раз и сохраняется в папку каждого из них
+    protocol_files = {}
+    for application_config in application_configs:
+        for url in application_config.protocol_urls_df['Ссылка']:
+            protocol_file = application_config.protocols_dir / url.split('/')[-1]
+            if protocol_file not in protocol_files.setdefault(url, []):
+                protocol_files[url].append(protocol_file)
+    return protocol_files
+
+
+def download_protocols(application_config: ApplicationConfig, application_configs: Optional[list] = None):
+    logging.info('--Загрузка протоколов')
+    protocol_files = get_protocol_files(application_configs or [application_config])
+    workers = max(1, min(application_config.download_workers, len(protocol_files)))
+    download_state = load_download_state()
+
+    errors = []
+    with create_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for url, files in protocol_files.items():
+            futures[url] = executor.submit(download_protocol, session, url, files, download_state.get(url, {}))
+
+        for url, future in futures.items():
+            try:
+                status, validators = future.result()
+            except requests.RequestException as e:
+                logging.error('{}: {}'.format(url, e))
+                errors.append(url)
+                continue
+            download_state[url] = validators
+            logging.info('{}: {}'.format(url.split('/')[-1], status))
+
+    save_download_state(download_state)
+    if errors:
+        raise DownloadError('Could not download: {}.'.format(', '.join(errors)))
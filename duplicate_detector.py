@@ -0,0 +1,158 @@
+import logging
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+
+from app_config import ApplicationConfig
+from output_writer import output_writer
+from participants import PARTICIPANT_FIELDS
+
+# минимальное сходство ФИО по триграммам (коэффициент Дайса) и максимальное расстояние Левенштейна для кандидата
+MIN_SIMILARITY = 0.6
+MAX_EDIT_DISTANCE = 2
+# частые триграммы (окончания -ОВ, -ИН, начала имен) почти не различают участников, а пар по ним - квадратичное
+# число, поэтому кандидаты ищутся только по более редким триграммам
+MAX_TRIGRAM_FREQUENCY = 200
+
+DETAILS_COLUMNS = ['Фамилия', 'Имя', 'Г.р.', 'Пол', 'Стартов', 'Фамилия верная', 'Имя верное', 'Г.р. верный',
+                   'Стартов верного', 'Сходство', 'Причина']
+
+
+def normalize_name(name: str) -> str:
+    return re.sub('\\s+', ' ', str(name).upper().replace('Ё', 'Е')).strip()
+
+
+def get_trigrams(text: str) -> set:
+    text = ' {} '.format(text)
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def get_edit_distance(a: str, b: str, limit: int) -> int:
+    # расстояние Левенштейна с отсечением: если строки различаются больше чем на limit, возвращается limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+def get_identities(protocols_df: pd.DataFrame, df_previous_year_final_rank: pd.DataFrame) -> pd.DataFrame:
+    # участники сезона (с кол-вом стартов) и участники итогового ранга прошлого сезона
+    season = protocols_df[PARTICIPANT_FIELDS].astype({'Фамилия': object, 'Имя': object, 'Г.р.': np.int64,
+                                                      'Пол': object})
+    season = season.groupby(PARTICIPANT_FIELDS, sort=False).size().rename('Стартов').reset_index()
+    previous = df_previous_year_final_rank[PARTICIPANT_FIELDS].astype({'Фамилия': object, 'Имя': object,
+                                                                       'Г.р.': np.int64, 'Пол': object})
+    previous = previous.drop_duplicates().assign(**{'Ранг прошлого сезона': True})
+    identities = season.merge(previous, how='outer', on=PARTICIPANT_FIELDS)
+    identities['Стартов'] = identities['Стартов'].fillna(0).astype(np.int64)
+    identities['Ранг прошлого сезона'] = identities['Ранг прошлого сезона'].fillna(False).astype(bool)
+    identities['ФИО'] = (identities['Фамилия'].map(normalize_name) + ' ' + identities['Имя'].map(normalize_name))
+    return identities
+
+
+def get_candidate_pairs(identities: pd.DataFrame) -> dict:
+    # пары участников одного пола с похожими ФИО: индекс триграмм строится один раз, для каждого участника
+    # сходство считается только с участниками, у которых есть общие триграммы
+    pairs = {}
+    names = identities['ФИО'].to_list()
+    trigrams = [get_trigrams(name) for name in names]
+    for _, sex_identities in identities.groupby('Пол', sort=False):
+        index = defaultdict(list)
+        for i in sex_identities.index:
+            for trigram in trigrams[i]:
+                index[trigram].append(i)
+        for i in sex_identities.index:
+            shared = Counter()
+            for trigram in trigrams[i]:
+                postings = index[trigram]
+                if len(postings) <= MAX_TRIGRAM_FREQUENCY:
+                    shared.update(j for j in postings if j > i)
+            for j, count in shared.items():
+                similarity = 2 * count / (len(trigrams[i]) + len(trigrams[j]))
+                if similarity < MIN_SIMILARITY:
+                    continue
+                if names[i] == names[j]:
+                    reason = 'Совпадают ФИО'
+                elif sorted(names[i].split(' ')) == sorted(names[j].split(' ')):
+                    reason = 'Переставлены фамилия и имя'
+                elif get_edit_distance(names[i], names[j], MAX_EDIT_DISTANCE) <= MAX_EDIT_DISTANCE:
+                    reason = 'Опечатка в ФИО'
+                else:
+                    continue
+                pairs[(i, j)] = (round(similarity, 2), reason)
+        # одинаковые ФИО находятся и без индекса (в том числе через частые триграммы)
+        for _, same_name in sex_identities.groupby('ФИО', sort=False):
+            for position, i in enumerate(same_name.index):
+                for j in same_name.index[position + 1:]:
+                    pairs[(i, j)] = (1.0, 'Совпадают ФИО')
+    return pairs
+
+
+def get_weight(identity: pd.Series) -> tuple:
+    # верным считается вариант ФИО из ранга прошлого сезона (так участник получает прошлогодний ранг), затем -
+    # вариант с большим кол-вом стартов и с годом рождения (год рождения берется у любого из вариантов, где он есть)
+    return identity['Ранг прошлого сезона'], identity['Стартов'], identity['Г.р.'] != 0
+
+
+def detect_duplicates(identities: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # кандидаты в маппинг ФИО и маппинг года рождения (строки в формате листов конфигуратора приложения)
+    name_rows = []
+    yob_rows = {}
+    for (i, j), (similarity, reason) in get_candidate_pairs(identities).items():
+        a, b = identities.loc[i], identities.loc[j]
+        # разные годы рождения при похожих ФИО - скорее всего разные участники (например, однофамильцы)
+        if a['Г.р.'] != b['Г.р.'] and a['Г.р.'] != 0 and b['Г.р.'] != 0:
+            continue
+        if a['Фамилия'] == b['Фамилия'] and a['Имя'] == b['Имя']:
+            # то же ФИО без года рождения - кандидат в маппинг года рождения
+            wrong, right = (a, b) if a['Г.р.'] == 0 else (b, a)
+            reason = 'Нет года рождения'
+        else:
+            wrong, right = (a, b) if get_weight(a) < get_weight(b) else (b, a)
+        # маппинги применяются к протоколам, поэтому исправлять имеет смысл только участника сезона
+        if wrong['Стартов'] == 0:
+            continue
+        right_yob = right['Г.р.'] if right['Г.р.'] != 0 else wrong['Г.р.']
+        if reason == 'Нет года рождения':
+            yob_rows.setdefault((wrong['Фамилия'], wrong['Имя']), set()).add(right_yob)
+        name_rows.append([wrong['Фамилия'], wrong['Имя'], wrong['Г.р.'], wrong['Пол'], wrong['Стартов'],
+                          right['Фамилия'], right['Имя'], right_yob, right['Стартов'], similarity, reason])
+
+    details = pd.DataFrame(name_rows, columns=DETAILS_COLUMNS)
+    # при нескольких возможных годах рождения выбрать год автоматически нельзя - кандидат остается только в деталях
+    yob = pd.DataFrame([[last_name, first_name, min(years)] for (last_name, first_name), years in yob_rows.items()
+                        if len(years) == 1], columns=['Фамилия', 'Имя', 'Г.р.'])
+    return details.sort_values(by=['Фамилия', 'Имя', 'Г.р.'], kind='mergesort', ignore_index=True), \
+        yob.sort_values(by=['Фамилия', 'Имя'], kind='mergesort', ignore_index=True)
+
+
+def save_duplicate_candidates(application_config: ApplicationConfig, protocols_df: pd.DataFrame,
+                              df_previous_year_final_rank: pd.DataFrame):
+    if len(protocols_df) == 0:
+        return
+
+    identities = get_identities(protocols_df, df_previous_year_final_rank)
+    details, yob = detect_duplicates(identities)
+    logging.info('--Возможные дубли участников: {} (из {} участников)'.format(len(details), len(identities)))
+
+    # файлы кандидатов повторяют колонки листов маппингов, чтобы строки можно было скопировать в конфигуратор
+    name_mapping = details[details['Причина'] != 'Нет года рождения']
+    name_mapping = name_mapping[['Фамилия', 'Имя', 'Г.р.', 'Фамилия верная', 'Имя верное', 'Г.р. верный']]
+    output_writer.write(
+        application_config.rank_dir / 'Кандидаты в маппинг ФИО_{}.xlsx'.format(application_config.season),
+        name_mapping.reindex(columns=application_config.mapping_correct_participant_data.columns), index=False)
+    output_writer.write(
+        application_config.rank_dir / 'Кандидаты в маппинг года рождения_{}.xlsx'.format(application_config.season),
+        yob.reindex(columns=application_config.mapping_yob_df.columns), index=False)
+    output_writer.write(
+        application_config.rank_dir / 'Возможные дубли участников_{}.xlsx'.format(application_config.season),
+        details, index=False)
@@ -12,3 +12,39 @@ class RankConfigValidationError(Error):
     def __str__(self):
         msg = super().__str__()
         return f'Rank config validation failed. {msg}'
+
+
+class ProtocolParsingError(Error):
+    def __str__(self):
+        msg = super().__str__()
+        return f'Protocol parsing failed. {msg}'
+
+
+class DownloadError(Error):
+    def __str__(self):
+        msg = super().__str__()
+        return f'Protocol download failed. {msg}'
+
+
+class BatchCalculationError(Error):
+    def __str__(self):
+        msg = super().__str__()
+        return f'Batch rank calculation failed. {msg}'
+
+
+class OutputWriteError(Error):
+    def __str__(self):
+        msg = super().__str__()
+        return f'Output write failed. {msg}'
+
+
+class SweepConfigError(Error):
+    def __str__(self):
+        msg = super().__str__()
+        return f'Rank formula sweep configuration is invalid. {msg}'
+
+
+class RankServiceError(Error):
+    def __str__(self):
+        msg = super().__str__()
+        return f'Rank service request is invalid. {msg}'
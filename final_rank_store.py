@@ -0,0 +1,71 @@
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app_config import ApplicationConfig
+from constants import FINAL_RANKS_DIR
+from participants import PARTICIPANT_FIELDS
+
+# хранилище итоговых рангов всех сезонов в папке результатов ранга: папка на тип ранга (в пакетном расчете каждый
+# процесс пишет только в свою папку) и файл на сезон, поэтому итоговый ранг сезона читается без чтения остальных
+# сезонов; источник - хэш файла итогового ранга, из которого импортирован сезон (пусто - сезон рассчитан)
+FINAL_RANK = 'Итоговый ранг'
+SOURCE = 'Источник'
+
+
+def get_store_file(application_config: ApplicationConfig, season: int, suffix: str) -> Path:
+    return Path(application_config.rank_dir) / FINAL_RANKS_DIR / application_config.rank_to_calculate / \
+        '{}{}'.format(season, suffix)
+
+
+def get_final_rank(application_config: ApplicationConfig, season: int,
+                   source: Optional[str] = None) -> Optional[pd.DataFrame]:
+    # итоговый ранг сезона (участник и ранг) или None, если сезона нет в хранилище или он импортирован
+    # не из той версии файла итогового ранга, хэш которой передан в source
+    parquet_file = get_store_file(application_config, season, '.parquet')
+    pickle_file = get_store_file(application_config, season, '.pkl')
+    if parquet_file.exists():
+        df = pd.read_parquet(parquet_file)
+    elif pickle_file.exists():
+        df = pd.read_pickle(pickle_file)
+    else:
+        return None
+    if source is not None and (df[SOURCE] != source).any():
+        return None
+    return df.drop(columns=SOURCE)
+
+
+def save_final_rank(application_config: ApplicationConfig, season: int, final_rank_df: pd.DataFrame,
+                    source: str = ''):
+    # итоговый ранг сезона заменяет ранее сохраненный (например, при повторном расчете последнего соревнования)
+    # ранг хранится так же, как в файле итогового ранга - с точностью до сотых
+    final_rank_df = final_rank_df[PARTICIPANT_FIELDS + [FINAL_RANK]].dropna()
+    final_rank_df[FINAL_RANK] = final_rank_df[FINAL_RANK].map(lambda x: round(x, 2))
+    final_rank_df = final_rank_df.astype({'Фамилия': str, 'Имя': str, 'Г.р.': np.int64, 'Пол': str, FINAL_RANK: float})
+    final_rank_df = final_rank_df.drop_duplicates(subset=PARTICIPANT_FIELDS).reset_index(drop=True)
+    final_rank_df[SOURCE] = source
+
+    parquet_file = get_store_file(application_config, season, '.parquet')
+    pickle_file = get_store_file(application_config, season, '.pkl')
+    tmp_file = get_store_file(application_config, season, '.tmp')
+    parquet_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        final_rank_df.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, parquet_file)
+        stale_file = pickle_file
+    except ImportError as e:
+        # без pyarrow хранилище сохраняется в формате pickle
+        logging.debug('Хранилище итоговых рангов сохранено в формате pickle: {}'.format(e))
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(final_rank_df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, pickle_file)
+        stale_file = parquet_file
+    if stale_file.exists():
+        os.remove(stale_file)
+    logging.info('--Итоговый ранг сезона {} ({}) сохранен в хранилище итоговых рангов'.format(
+        season, application_config.rank_to_calculate))
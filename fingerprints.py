@@ -0,0 +1,18 @@
+import hashlib
+
+import pandas as pd
+
+
+def get_df_hash(df: pd.DataFrame) -> str:
+    df_hash = hashlib.sha256()
+    df_hash.update(str(list(df.columns)).encode())
+    df_hash.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return df_hash.hexdigest()
+
+
+def get_file_hash(file) -> str:
+    file_hash = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
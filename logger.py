@@ -1,4 +1,5 @@
 import logging.config
+import logging.handlers
 import sys
 from pathlib import Path
 
@@ -12,10 +13,30 @@ else:
     bundle_dir = Path(__file__).resolve().parent
 
 
+def load_logging_config() -> dict:
+    config_file = bundle_dir / 'logger.yaml'
+    with config_file.open() as stream:
+        return yaml.safe_load(stream)
+
+
 def setup_logging():
     logs_dir = Path('./logs')
     logs_dir.mkdir(exist_ok=True)
-    config_file = bundle_dir / 'logger.yaml'
-    with config_file.open() as stream:
-        config = yaml.safe_load(stream)
+    logging.config.dictConfig(load_logging_config())
+
+
+def setup_process_logging(queue):
+    # процессы пакетного расчета передают записи лога через очередь в основной процесс: файл лога открыт
+    # только в нем, поэтому записи не теряются при ротации; уровни логгеров те же, что в logger.yaml
+    config = load_logging_config()
+    config['handlers'] = {}
+    config['loggers']['root']['handlers'] = []
     logging.config.dictConfig(config)
+    logging.getLogger().addHandler(logging.handlers.QueueHandler(queue))
+
+
+def start_log_listener(queue) -> logging.handlers.QueueListener:
+    # записи из очереди пишутся обработчиками основного процесса (консоль и файл лога)
+    listener = logging.handlers.QueueListener(queue, *logging.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -1,9 +1,13 @@
+import argparse
 import logging
 import math
+import multiprocessing
 import os
 import re
 import warnings
+from concurrent.futures import ProcessPoolExecutor
 from decimal import *
+from typing import Optional
 
 getcontext().prec = 28
 
@@ -11,24 +15,154 @@ import numpy as np
 import pandas as pd
 
 from app_config import ApplicationConfig
-from constants import APP_CONFIG_FILE, RANK_CONFIG_FILE, VERSION
-from errors import Error
-from logger import setup_logging
+from competition_rank import calculate_competition_rank
+from config_loader import load_configs
+from current_rank import select_top_races, get_current_rank
+from duplicate_detector import save_duplicate_candidates
+from checkpoints import get_base_fingerprint, get_competition_fingerprint, find_last_checkpoint, load_checkpoint, \
+    save_checkpoint, remove_stale_checkpoints
+from constants import TELEMETRY_DIR, VERSION
+from errors import Error, BatchCalculationError
+from final_rank_store import get_final_rank, save_final_rank
+from fingerprints import get_file_hash
+from logger import setup_logging, setup_process_logging, start_log_listener
+from output_writer import output_writer
+from rank_engine import RankEngine, get_decimal
 from rank_formula_config import RankFormulaConfig
-from validation.app_config_validation import check_app_config
-from validation.rank_config_validation import check_rank_config
-from prepare_protocols import prepare_protocols, download_protocols
+from rank_history import get_rank_history_part, save_rank_history
+from prepare_protocols import prepare_protocols, prepare_protocols_batch
+from participants import ParticipantRegistry, PARTICIPANT_ID
+from season_db import SeasonDatabase
+from season_store import SeasonStore, SeasonTable
 from save_current_rank import save_current_rank, transform_and_save_not_started_and_left_race
+from telemetry import telemetry
 
 
-def get_decimal(s):
-    return Decimal(s)
+def main(args: argparse.Namespace):
+    config_load = telemetry.measure('config_load')
+    with config_load:
+        application_config, rank_formula_config = load_configs()
 
+    # телеметрия включается в конфигураторе или из командной строки (профилирование включает и телеметрию)
+    if args.telemetry or args.profile:
+        application_config.telemetry = 'да'
+    if args.profile:
+        application_config.profiling = 'да'
 
-def main():
-    application_config = ApplicationConfig(APP_CONFIG_FILE)
-    rank_formula_config = RankFormulaConfig(RANK_CONFIG_FILE)
+    logging.info('Сезон: ' + str(application_config.season))
+
+    batch = application_config.ranks_to_calculate != [application_config.rank_to_calculate]
+    name = 'Пакетный расчет' if batch else application_config.rank_to_calculate
+    if application_config.telemetry == 'да':
+        telemetry.start(application_config.profiling == 'да', rank=name)
+        telemetry.add(config_load.record)
+
+    try:
+        if batch:
+            calculate_ranks(application_config, rank_formula_config)
+            return
+
+        logging.info(application_config.rank_to_calculate)
+
+        if application_config.protocol_source_type == 'Ссылка':
+            # requests импортируется только при загрузке протоколов по ссылкам
+            from downloader import download_protocols
+            with telemetry.stage('download_protocols'):
+                download_protocols(application_config)
+        with telemetry.stage('prepare_protocols') as span:
+            protocols = prepare_protocols(application_config, rank_formula_config)
+            span.rows = len(protocols[0])
+        calculate_rank(application_config, rank_formula_config, protocols)
+    finally:
+        telemetry.stop(name)
+
+
+def calculate_ranks(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig):
+    # пакетный режим: конфигураторы читаются один раз, общие протоколы загружаются и разбираются один раз,
+    # затем независимые расчеты рангов идут параллельно в отдельных процессах
+    application_configs = [application_config.for_rank(rank) for rank in application_config.ranks_to_calculate]
+    logging.info('Пакетный расчет: ' + ', '.join(application_config.ranks_to_calculate))
+
+    if application_config.protocol_source_type == 'Ссылка':
+        from downloader import download_protocols
+        with telemetry.stage('download_protocols'):
+            download_protocols(application_config, application_configs)
+    with telemetry.stage('prepare_protocols') as span:
+        protocols = prepare_protocols_batch(application_configs, rank_formula_config)
+        span.rows = sum(len(rank_protocols[0]) for rank_protocols in protocols.values())
+    with telemetry.stage('excel_flush'):
+        output_writer.flush()
+
+    errors = []
+    log_queue = multiprocessing.Queue()
+    log_listener = start_log_listener(log_queue)
+    try:
+        with ProcessPoolExecutor(max_workers=min(len(application_configs), os.cpu_count()),
+                                 initializer=setup_process_logging, initargs=(log_queue,)) as executor:
+            futures = {config.rank_to_calculate: executor.submit(calculate_rank_process, config, rank_formula_config,
+                                                                 protocols[config.rank_to_calculate])
+                       for config in application_configs}
+            for rank, future in futures.items():
+                try:
+                    future.result()
+                    logging.info('{}: рассчитан'.format(rank))
+                except Exception as e:
+                    logging.error('{}: {}'.format(rank, e))
+                    errors.append(rank)
+    finally:
+        log_listener.stop()
+
+    if errors:
+        raise BatchCalculationError('Ranks were not calculated: {}.'.format(', '.join(errors)))
+
+
+def calculate_rank_process(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig,
+                           protocols: tuple):
+    # в пакетном режиме у процесса расчета каждого ранга своя трассировка
+    if application_config.telemetry == 'да':
+        telemetry.start(application_config.profiling == 'да', rank=application_config.rank_to_calculate)
+    try:
+        calculate_rank(application_config, rank_formula_config, protocols)
+    finally:
+        telemetry.stop(application_config.rank_to_calculate)
+
+
+def calculate_rank(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig,
+                   protocols: tuple) -> pd.DataFrame:
+    rank_engine = RankEngine(application_config.rank_engine, application_config.rank_engine_parity_check == 'да')
+    race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank = get_race_numbers(
+        application_config, rank_formula_config)
+
+    protocols_df, left_races_df, df_not_started = protocols
+    with telemetry.stage('previous_year_final_rank') as span:
+        df_previous_year_final_rank = get_previous_year_final_rank(application_config)
+        span.rows = len(df_previous_year_final_rank)
+    with telemetry.stage('duplicate_participants') as span:
+        span.rows = len(protocols_df)
+        save_duplicate_candidates(application_config, protocols_df, df_previous_year_final_rank)
+    with telemetry.stage('calculate_current_rank') as span:
+        current_rank_df = calculate_current_rank(application_config, rank_formula_config, rank_engine,
+                                                 protocols_df, left_races_df, df_previous_year_final_rank,
+                                                 race_number_to_start_apply_rules,
+                                                 race_number_to_start_apply_relative_rank)
+        span.rows = len(protocols_df)
+    rank_engine.log_parity_report()
+    if application_config.last_race_flag == 'да':
+        # итоговый ранг сезона сохраняется до save_current_rank, которая переименовывает колонки таблицы
+        save_final_rank(application_config, application_config.season,
+                        current_rank_df[current_rank_df['Текущий ранг'].notna()])
+    with telemetry.stage('save_current_rank') as span:
+        span.rows = len(current_rank_df)
+        save_current_rank(application_config, current_rank_df.copy())
+    with telemetry.stage('save_not_started_and_left_race') as span:
+        span.rows = len(left_races_df) + len(df_not_started)
+        transform_and_save_not_started_and_left_race(application_config, left_races_df, df_not_started)
+    with telemetry.stage('excel_flush'):
+        output_writer.flush()
+    return current_rank_df
 
+
+def get_race_numbers(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig) -> tuple:
     if application_config.rank_to_calculate == 'Лесной ранг':
         race_number_to_start_apply_rules = rank_formula_config.race_number_to_start_apply_rules_forest_rank
         race_number_to_start_apply_relative_rank = rank_formula_config.race_number_to_start_apply_relative_rank_forest
@@ -38,62 +172,92 @@ def main():
     else:
         race_number_to_start_apply_rules = rank_formula_config.race_number_to_start_apply_rules
         race_number_to_start_apply_relative_rank = rank_formula_config.race_number_to_start_apply_relative_rank
+    return race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank
+
+
+def get_previous_year_final_rank(application_config: ApplicationConfig, update_store: bool = True):
+    # итоговый ранг прошлого сезона берется из хранилища итоговых рангов, если он импортирован из той же версии
+    # файла итогового ранга прошлого года (или файла нет); иначе файл читается и сезон в хранилище заменяется;
+    # update_store = False - хранилище только читается (например, при сравнении вариантов формулы ранга и в бенчмарке)
+    season = application_config.season - 1
+    previous_year_final_rank_file = get_previous_year_final_rank_file(application_config)
+    source = get_file_hash(previous_year_final_rank_file) if previous_year_final_rank_file is not None else None
+    final_rank_df = get_final_rank(application_config, season, source)
+    if final_rank_df is None and previous_year_final_rank_file is not None:
+        final_rank_df = read_previous_year_final_rank_file(previous_year_final_rank_file)
+        if update_store:
+            save_final_rank(application_config, season, final_rank_df, source)
+
+    if final_rank_df is None:
+        return pd.DataFrame.from_dict(
+            {'Фамилия': [], 'Имя': [], 'Г.р.': [], 'Пол': [], 'Ранг': [], 'Флаг финального ранга прошлого сезона': []})
 
-    logging.info('Сезон: ' + str(application_config.season))
-    logging.info(application_config.rank_to_calculate)
+    participant_fields = ['Фамилия', 'Имя', 'Г.р.', 'Пол']
+    df_previous_year_final_rank = final_rank_df.rename(columns={'Итоговый ранг': 'Ранг'})
+    df_previous_year_final_rank = df_previous_year_final_rank.astype(
+        {'Фамилия': 'string', 'Имя': 'string', 'Пол': 'string', 'Г.р.': 'int'})
+    df_previous_year_final_rank = df_previous_year_final_rank[participant_fields + ['Ранг']]
+    df_previous_year_final_rank = df_previous_year_final_rank[df_previous_year_final_rank['Ранг'] > 0]
+    df_previous_year_final_rank['Флаг финального ранга прошлого сезона'] = True
+    df_previous_year_final_rank['Ранг'] = df_previous_year_final_rank['Ранг'].apply(get_decimal)
+    logging.info('--Прошлогодний ранг (сезон {}) идет в учет'.format(season))
+    return df_previous_year_final_rank
 
-    if application_config.protocol_source_type == 'Ссылка':
-        download_protocols(application_config)
-    df_previous_year_final_rank = get_previous_year_final_rank(application_config)
-    protocols_df, left_races_df, df_not_started = prepare_protocols(application_config, rank_formula_config)
-    current_rank_df = calculate_current_rank(application_config, rank_formula_config, protocols_df, left_races_df,
-                                             df_previous_year_final_rank,
-                                             race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank)
-    save_current_rank(application_config, current_rank_df)
-    transform_and_save_not_started_and_left_race(application_config, left_races_df, df_not_started)
-
-
-def get_previous_year_final_rank(application_config: ApplicationConfig):
-    df_previous_year_final_rank = pd.DataFrame.from_dict(
-        {'Фамилия': [], 'Имя': [], 'Г.р.': [], 'Пол': [], 'Ранг': [], 'Флаг финального ранга прошлого сезона': []})
+
+def get_previous_year_final_rank_file(application_config: ApplicationConfig) -> Optional[str]:
+    previous_year_final_rank_file = None
     for name in os.listdir(application_config.previous_year_final_rank_file):
-        previous_year_final_rank_file = os.path.join(application_config.previous_year_final_rank_file, name)
-        if os.path.isfile(previous_year_final_rank_file) and (
-                int(name.replace('.xlsx', '').split('_')[-1]) == application_config.season - 1):
-            participant_fields = ['Фамилия', 'Имя', 'Г.р.', 'Пол']
-            df_previous_year_final_rank = pd.read_excel(previous_year_final_rank_file)
-            for col in df_previous_year_final_rank.columns:
-                if re.match('Итоговый ранг сезона [0-9]{4}', col):
-                    previous_year_final_rank_column = col
-            df_previous_year_final_rank = df_previous_year_final_rank[
-                df_previous_year_final_rank[previous_year_final_rank_column] > 0]
-            df_previous_year_final_rank['Фамилия'] = df_previous_year_final_rank['Участник'].map(
-                lambda x: str(x).split(' ')[0])
-            df_previous_year_final_rank['Имя'] = df_previous_year_final_rank['Участник'].map(
-                lambda x: str(x).split(' ')[1:])
-            df_previous_year_final_rank['Имя'] = df_previous_year_final_rank['Имя'].str.join(' ')
-            df_previous_year_final_rank.rename(columns={previous_year_final_rank_column: 'Ранг'}, inplace=True)
-            df_previous_year_final_rank = df_previous_year_final_rank.astype(
-                {'Фамилия': 'string', 'Имя': 'string', 'Пол': 'string', 'Г.р.': 'int'})
-            df_previous_year_final_rank = df_previous_year_final_rank[participant_fields + ['Ранг']]
-            df_previous_year_final_rank = df_previous_year_final_rank[df_previous_year_final_rank['Ранг'] > 0]
-            df_previous_year_final_rank['Флаг финального ранга прошлого сезона'] = True
-            df_previous_year_final_rank['Ранг'] = df_previous_year_final_rank['Ранг'].apply(get_decimal)
-            logging.info('--Прошлогодний ранг (сезон {}) идет в учет'.format(application_config.season - 1))
+        file = os.path.join(application_config.previous_year_final_rank_file, name)
+        if os.path.isfile(file) and int(name.replace('.xlsx', '').split('_')[-1]) == application_config.season - 1:
+            previous_year_final_rank_file = file
+    return previous_year_final_rank_file
+
+
+def read_previous_year_final_rank_file(previous_year_final_rank_file: str) -> pd.DataFrame:
+    df_previous_year_final_rank = pd.read_excel(previous_year_final_rank_file)
+    for col in df_previous_year_final_rank.columns:
+        if re.match('Итоговый ранг сезона [0-9]{4}', col):
+            previous_year_final_rank_column = col
+    df_previous_year_final_rank = df_previous_year_final_rank[
+        df_previous_year_final_rank[previous_year_final_rank_column] > 0]
+    df_previous_year_final_rank['Фамилия'] = df_previous_year_final_rank['Участник'].map(
+        lambda x: str(x).split(' ')[0])
+    df_previous_year_final_rank['Имя'] = df_previous_year_final_rank['Участник'].map(
+        lambda x: str(x).split(' ')[1:])
+    df_previous_year_final_rank['Имя'] = df_previous_year_final_rank['Имя'].str.join(' ')
+    df_previous_year_final_rank.rename(columns={previous_year_final_rank_column: 'Итоговый ранг'},
+                                       inplace=True)
+    df_previous_year_final_rank = df_previous_year_final_rank[
+        ['Фамилия', 'Имя', 'Г.р.', 'Пол', 'Итоговый ранг']]
     return df_previous_year_final_rank
 
 
+def get_current_rank_file(application_config: ApplicationConfig, competition: str):
+    return application_config.rank_dir / 'Текущий ранг_{}_{}.xlsx'.format(competition, application_config.season)
+
+
+def get_rows_with_ids(df: pd.DataFrame) -> pd.DataFrame:
+    return df[df[PARTICIPANT_ID].notna()].astype({PARTICIPANT_ID: np.int64})
+
+
 def calculate_current_rank(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig,
-                           protocols_df: pd.DataFrame, left_races_df: pd.DataFrame,
+                           rank_engine: RankEngine, protocols_df: pd.DataFrame, left_races_df: pd.DataFrame,
                            df_previous_year_final_rank: pd.DataFrame,
-                           race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank) -> pd.DataFrame:
-    protocols_rank_df = pd.DataFrame.from_dict(
-        {'Кол-во прошедших соревнований': [], 'Участники сравнит. ранга соревнований': []})
+                           race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank,
+                           write_results: bool = True) -> pd.DataFrame:
+    # таблицы протоколов с рангами накапливаются по соревнованиям и объединяются только при необходимости;
+    # write_results = False - без записи текущего ранга после каждого соревнования и файла протоколов
+    # (например, при сравнении вариантов формулы ранга)
+    protocols_rank_df = SeasonTable()
     current_rank_df = pd.DataFrame.from_dict(
-        {'Фамилия': [], 'Имя': [], 'Г.р.': [], 'Пол': [], 'Текущий ранг': [], 'Итоговый ранг': []})
-    protocols_rank_df_final = pd.DataFrame.from_dict(
-        {'Кол-во прошедших соревнований': [], 'Участники сравнит. ранга соревнований': []})
-    participant_fields = ['Фамилия', 'Имя', 'Г.р.', 'Пол']
+        {PARTICIPANT_ID: pd.array([], dtype='Int64'), 'Текущий ранг': [], 'Итоговый ранг': []})
+    protocols_rank_df_final = SeasonStore(pd.DataFrame.from_dict(
+        {'Кол-во прошедших соревнований': [], 'Участники сравнит. ранга соревнований': []}))
+    # история текущего ранга участников после каждого соревнования
+    rank_history = SeasonStore()
+    participant_key = [PARTICIPANT_ID]
+    season_db = SeasonDatabase(application_config) if application_config.season_db == 'да' and write_results \
+        else None
 
     logging.info('--Расчет ранга')
 
@@ -102,124 +266,105 @@ def calculate_current_rank(application_config: ApplicationConfig, rank_formula_c
     # дополняем общий файл рангов соревнований новым расчетным значением
     # рассчитываем текущий ранг - как он изменился после соревнования
     competitions_cnt = 1
-    competitions_total = protocols_df.sort_values(by='Дата соревнования')['Файл протокола'].nunique()
-    for competition in protocols_df.sort_values(by='Дата соревнования')['Файл протокола'].unique():
+    competitions = protocols_df.sort_values(by='Дата соревнования')['Файл протокола'].unique()
+    competitions_total = len(competitions)
+
+    # инкрементальный расчет: состояние после каждого соревнования сохраняется в контрольную точку,
+    # и если протоколы и настройки до некоторого соревнования не изменились, расчет продолжается с него
+    fingerprints = []
+    if application_config.incremental_calculation == 'да':
+        fingerprint = get_base_fingerprint(application_config, rank_formula_config, df_previous_year_final_rank,
+                                           race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank)
+        for competition_number, competition in enumerate(competitions, start=1):
+            fingerprint = get_competition_fingerprint(
+                fingerprint, competition,
+                protocols_df[protocols_df['Файл протокола'] == competition],
+                left_races_df[left_races_df['Файл протокола'] == competition],
+                application_config.last_race_flag == 'да' and competition_number == competitions_total)
+            fingerprints.append(fingerprint)
+
+        last_checkpoint = find_last_checkpoint(application_config, fingerprints,
+                                               [get_current_rank_file(application_config, competition)
+                                                for competition in competitions])
+        # ранги соревнований до контрольной точки должны быть и в базе сезона (например, если база только что включена)
+        if season_db is not None:
+            last_checkpoint = min(last_checkpoint, season_db.get_saved_competitions_count(competitions, fingerprints))
+        if last_checkpoint > 0:
+            checkpoint = load_checkpoint(application_config, fingerprints[last_checkpoint - 1])
+            current_rank_df = checkpoint['current_rank_df']
+            protocols_rank_df = checkpoint['protocols_rank_df']
+            protocols_rank_df_final = checkpoint['protocols_rank_df_final']
+            rank_history = checkpoint['rank_history']
+            competitions_cnt = checkpoint['competitions_cnt'] + 1
+            logging.info('Соревнования 1-{} без изменений, расчет продолжается из контрольной точки'
+                         .format(last_checkpoint))
+        remove_stale_checkpoints(application_config, fingerprints)
+
+    # участникам один раз присваиваются целочисленные ID, по которым идут все соединения и группировки в цикле;
+    # фамилия, имя, год рождения и пол возвращаются по ID только при сохранении текущего ранга
+    left_races_df = left_races_df.copy()
+    left_races_df['Г.р.'] = left_races_df['Г.р.'].fillna(0)
+    participant_registry = ParticipantRegistry(protocols_df, left_races_df, df_previous_year_final_rank)
+    protocols_df = participant_registry.add_ids(protocols_df)
+    left_races_df = participant_registry.add_ids(left_races_df)
+    df_previous_year_final_rank = participant_registry.add_ids(df_previous_year_final_rank)[
+        [PARTICIPANT_ID, 'Ранг', 'Флаг финального ранга прошлого сезона']]
+
+    # ID из контрольной точки переводятся в ID текущего реестра (в сезоне могли появиться новые участники)
+    if competitions_cnt > 1:
+        current_rank_df = participant_registry.remap(current_rank_df, checkpoint['participants_df'])
+        protocols_rank_df = SeasonTable(get_rows_with_ids(
+            participant_registry.remap(protocols_rank_df.table(), checkpoint['participants_df'])))
+        protocols_rank_df_final = SeasonStore(
+            participant_registry.remap(protocols_rank_df_final.finalize(), checkpoint['participants_df']))
+        rank_history = SeasonStore(participant_registry.remap(rank_history.finalize(), checkpoint['participants_df']))
+
+    # кол-во соревнований у каждого участника (по ID) накапливается вместе с таблицей рангов соревнований
+    races_counts = np.zeros(len(participant_registry), dtype=np.int64)
+    if len(protocols_rank_df) > 0:
+        np.add.at(races_counts, protocols_rank_df.table().drop_duplicates(subset=[PARTICIPANT_ID, 'Файл протокола'])
+                  [PARTICIPANT_ID].to_numpy(), 1)
+
+    for competition in competitions[competitions_cnt - 1:]:
         logging.info(str(competitions_cnt) + '. ' + competition)
+        laps = telemetry.laps(competition=competition, number=competitions_cnt)
         protocol_df = protocols_df[protocols_df['Файл протокола'] == competition].copy()
 
         # дополняем протоколы снятыми учасниками (они нужны для расчета сравнительного ранга соревнований)
         left_race_df = left_races_df[left_races_df['Файл протокола'] == competition].copy()
         left_race_df['left_race'] = 'yes'
-        left_race_df['Г.р.'] = left_race_df['Г.р.'].fillna(0)
         left_race_df = left_race_df[
             ['Дата соревнования', 'Соревнование', 'Файл протокола', 'Уровень старта', 'Коэффициент уровня старта',
              'Вид старта', 'Коэффициент вида старта', 'Возрастная группа', '№ п/п', 'Номер', 'Фамилия', 'Имя', 'Г.р.',
-             'Пол', 'Разр.', 'Команда', 'Ранг группы', 'left_race']]
+             'Пол', 'Разр.', 'Команда', 'Ранг группы', 'left_race', PARTICIPANT_ID]]
         protocol_df = pd.concat([protocol_df, left_race_df])
 
-        # расчет ранга соревнований отдельно для каждой возрастной группы
-        def calculate_competition_rank(df, competitions_cnt):
-
-            # исключаем снятных из кол-ва участников для расчета ранга соревнований
-            participants_number = len(df[df['left_race'].isna()])
-
-            # учитываем снятых для расчета сравнительго ранга соревнований
-            participants_number_for_relative_rank = len(df)
-
-            if participants_number > 8:
-                top_result = 5
-            elif participants_number in (7, 8):
-                top_result = 4
-            elif participants_number in (5, 6):
-                top_result = 3
-            else:
-                top_result = 2
-
-            if participants_number_for_relative_rank > 8:
-                top_relative_rank_results = 7
-            elif participants_number in (7, 8):
-                top_relative_rank_results = 6
-            elif participants_number == 6:
-                top_relative_rank_results = 5
-            else:
-                top_relative_rank_results = participants_number_for_relative_rank
-
-            def get_mean_by_top(s, top, asc):
-                if len(s) == 1:
-                    return s.iloc[0]
-
-                s = s.sort_values(axis=0, ascending=asc)
-                winner = s.iloc[0]
-
-                while top > 1:
-                    mean = np.nanmean(s.head(top).values)
-                    if mean / winner <= 1.15:
-                        return mean
-                    top -= 1
-
-                return Decimal(winner) * Decimal(1.15)
-
-            df['tсравнит '] = get_mean_by_top(df['result_in_seconds'].apply(get_decimal), top_result, asc=True)
-
-            # если расчет ранга осуществляется для первого соревнования в сезоне,
-            # то берем итоговый ранг прошлого сезона в качестве текущего ранга для расчета сравнительного в 1ом соревновании
-            if competitions_cnt == 1 and len(df_previous_year_final_rank) > 0:
-                df_top = df.merge(df_previous_year_final_rank,
-                                  how='left',
-                                  on=participant_fields,
-                                  suffixes=(None, '_config'))
-                df_top.rename(columns={'Ранг': 'Текущий ранг'}, inplace=True)
-            else:
-                df_top = df.merge(current_rank_df,
-                                  how='left',
-                                  on=participant_fields,
-                                  suffixes=(None, '_config'))
-            # есть текущий ранг и в группе больше одного участника и номер соревнования уже позволяет использовать текущий ранг спортсменов
-            if (df_top['Текущий ранг'].count() > 0
-                    and df[ '№ п/п'].dropna().nunique() > 1
-                    and competitions_cnt > race_number_to_start_apply_relative_rank):
-                df_top.dropna(subset=['Текущий ранг'], inplace=True)
-                df_top = df_top.sort_values(by='Текущий ранг', axis=0, ascending=False).head(top_relative_rank_results)
-                df_top['Участники сравнит. ранга соревнований'] = (df_top['Фамилия'] + ' ' + df_top['Имя'] + ': ' +
-                                                                   df_top['Текущий ранг'].apply(
-                                                                       lambda x: round(x, 2)).astype(str))
-
-                df['Сравнит. ранг соревнований'] = np.nanmean(df_top['Текущий ранг'].apply(get_decimal).values)
-                df['Участники сравнит. ранга соревнований'] = df_top['Участники сравнит. ранга соревнований'].str.cat(
-                    sep=', ')
-
-            # текущий ранг еще отсутствует или в группе один участник
-            else:
-                df['Сравнит. ранг соревнований'] = df['Ранг группы']
-
-            df['N'] = participants_number if participants_number > 1 else 2
-
-            df['Ранг по группе'] = (df['Коэффициент уровня старта'].apply(get_decimal)
-                                    * (df['tсравнит '].apply(get_decimal) / df['result_in_seconds'].apply(get_decimal))
-                                    * df['Сравнит. ранг соревнований'].apply(get_decimal)
-                                    * (Decimal(1) - df['Коэффициент вида старта'].apply(get_decimal)
-                                       * (df['Место'].apply(get_decimal) - 1) / (df['N'].apply(get_decimal) - 1)
-                                       )
-                                    )
-
-            return df
-
-        protocol_df = protocol_df.groupby(by=['Файл протокола', 'Возрастная группа'], as_index=False) \
-                                 .apply(calculate_competition_rank, competitions_cnt)
-
-        # если участник в протоколе был сразу в нескольких возрастных группах,
-        # то для него берется лучший ранг из рассчитанных
-        protocol_df['Ранг'] = protocol_df.groupby(by=['Файл протокола'] + participant_fields, as_index=False) \
-                                          ['Ранг по группе'].transform(lambda x: x.max())
+        # если расчет ранга осуществляется для первого соревнования в сезоне,
+        # то берем итоговый ранг прошлого сезона в качестве текущего ранга для расчета сравнительного в 1ом соревновании
+        if competitions_cnt == 1 and len(df_previous_year_final_rank) > 0:
+            relative_rank_df = df_previous_year_final_rank.rename(columns={'Ранг': 'Текущий ранг'})
+        else:
+            relative_rank_df = current_rank_df
+
+        # расчет ранга соревнований для всех возрастных групп сразу;
+        # номер соревнования должен позволять использовать текущий ранг спортсменов
+        protocol_df = calculate_competition_rank(protocol_df, relative_rank_df,
+                                                 competitions_cnt > race_number_to_start_apply_relative_rank,
+                                                 rank_engine)
+        laps.lap('group_rank', len(protocol_df))
 
         # дополняем таблицу протоколов соревнованием с рассчитанным рангом
-        protocols_rank_df = protocols_rank_df.append(protocol_df)
+        # дубликаты убираем, так как у участника может быть несколько рангов по разным возрастным группам,
+        # но ранг соревнования одинаковый для них проставлен (максимальный);
+        # участники без ID в расчет текущего ранга не входят, поэтому в таблицу не добавляются,
+        # и при добавлении копируются только строки нового соревнования
+        protocol_rank_df = get_rows_with_ids(
+            protocol_df[participant_key + ['Файл протокола', 'Ранг', 'Дата соревнования']].drop_duplicates())
+        protocols_rank_df.append(protocol_rank_df)
+        races_counts[protocol_rank_df[PARTICIPANT_ID].unique()] += 1
 
         # для расчета текущего ранга берем таблицу с протоколами и рангами по каждому соревнованию
-        # дубликаты убираем, так как у участника может быть несколько рангов по разным возрастным группам,
-        # но ранг соревнования одинаковый для них проставлен (максимальный)
-        current_rank_df = protocols_rank_df[participant_fields + ['Файл протокола', 'Ранг', 'Дата соревнования']] \
-                                            .drop_duplicates()
+        current_rank_df = protocols_rank_df.table()
 
         # если кол-во стартов еще не превысило, указанное в конфигураторе для начала применения
         # правила штрафов и 50% лучших соревнований, то для расчета текущего ранга берутся все старты
@@ -232,10 +377,7 @@ def calculate_current_rank(application_config: ApplicationConfig, rank_formula_c
         current_rank_df['Кол-во прошедших соревнований'] = competitions_cnt
 
         # кол-во соревнований у каждого участника
-        races_per_participant_df = current_rank_df.groupby(by=participant_fields, as_index=False) \
-                                                  .agg({'Файл протокола': 'nunique'})
-        races_per_participant_df.rename(columns={'Файл протокола': 'Кол-во соревнований у участника'}, inplace=True)
-        current_rank_df = current_rank_df.merge(races_per_participant_df, how='left', on=participant_fields)
+        current_rank_df['Кол-во соревнований у участника'] = races_counts[current_rank_df[PARTICIPANT_ID].to_numpy()]
 
         # если кол-во стартов еще не превысило, указанное в конфигураторе для начала применения
         # правила штрафов и 50% лучших соревнований, то долю/кол-во отсутствующих стартов считают = 0
@@ -243,20 +385,9 @@ def calculate_current_rank(application_config: ApplicationConfig, rank_formula_c
             current_rank_df['Доля отсутствующих стартов'] = 0
             current_rank_df['% интервал отсутствующих стартов'] = 0
         else:
-            current_rank_df['Доля отсутствующих стартов'] = (1 -
-                                                             current_rank_df['Кол-во соревнований у участника'] \
-                                                                .apply(get_decimal)
-                                                             / current_rank_df['Кол-во cоревнований для текущего ранга'] \
-                                                                .apply(get_decimal)
-                                                             )
-
-            def get_floor_for_decimal(s):
-                return np.where(s > 0, np.floor(s * 100) / 100, 0)
-            current_rank_df['Доля отсутствующих стартов'] = get_floor_for_decimal(current_rank_df['Доля отсутствующих стартов'])
-            current_rank_df['% интервал отсутствующих стартов'] = np.floor(100 *
-                    (1 -
-                     current_rank_df['Кол-во соревнований у участника'].apply(get_decimal) /
-                     current_rank_df['Кол-во cоревнований для текущего ранга'].apply(get_decimal)))
+            current_rank_df['Доля отсутствующих стартов'], current_rank_df['% интервал отсутствующих стартов'] = \
+                rank_engine.lack_races_share(current_rank_df['Кол-во соревнований у участника'],
+                                             current_rank_df['Кол-во cоревнований для текущего ранга'])
 
         def define_lack_races(s):
             return np.where(s >= 80.0, '80% и более',
@@ -283,27 +414,22 @@ def calculate_current_rank(application_config: ApplicationConfig, rank_formula_c
                                '% интервал отсутствующих стартов',
                                'Штраф за отсутствующие старты']
 
-        # расчет топ рангов соревнований
-        def define_top_races_for_current_rank(df):
-            races_number = df['Кол-во cоревнований для текущего ранга'].max()
-            df = df.sort_values(by='Ранг', ascending=False).head(races_number)
-            return df
-
-        # расчет текущего ранга: среднее лучших рангов соревнований (с учетом прошлогоднего итогового ранга),
-        # скорректированное на штраф за отсутствующие старты
-        def define_current_rank(df):
-            penalty_lack_races = df['Штраф за отсутствующие старты'].max()
-            df['Текущий ранг'] = Decimal(np.nanmean(df['Ранг'].values)) * Decimal(penalty_lack_races)
-            return df
-
         # получаем топ рангов соревнований для каждого участника
-        current_rank_df = current_rank_df.groupby(by=participant_fields, as_index=False) \
-                                         .apply(define_top_races_for_current_rank)
+        current_rank_df = select_top_races(current_rank_df,
+                                           current_rank_df['Кол-во cоревнований для текущего ранга'].max())
 
-        # добавляем финальный ранг прошлого сезона, если он есть, и рассчитываем текущий ранг для каждого участника
+        # добавляем финальный ранг прошлого сезона, если он есть
         if len(df_previous_year_final_rank) > 0:
-            current_rank_df = current_rank_df.append(df_previous_year_final_rank)
-        current_rank_df = current_rank_df.groupby(by=participant_fields, as_index=False).apply(define_current_rank)
+            current_rank_df = pd.concat([current_rank_df,
+                                         df_previous_year_final_rank[df_previous_year_final_rank[PARTICIPANT_ID].notna()]])
+
+        # дата текущего соревнования
+        current_race_date = current_rank_df[current_rank_df['Дата соревнования'].notna()]['Дата соревнования'].max()
+
+        # текущий ранг каждого участника: среднее лучших рангов соревнований (с учетом прошлогоднего итогового ранга),
+        # скорректированное на штраф за отсутствующие старты; остается только строка по каждому участнику
+        # (с датой последнего соревнования, вошедшего в расчет ранга)
+        current_rank_df = get_current_rank(current_rank_df, rank_engine)
 
         # если расчет по последнему соревнованию в сезоне, то применяем правила обнуления
         if application_config.last_race_flag == 'да' and competitions_cnt == competitions_total:
@@ -315,48 +441,60 @@ def calculate_current_rank(application_config: ApplicationConfig, rank_formula_c
             current_rank_df['Итоговый ранг'] = np.nan
 
         # добавляем дату текущего соревнования
-        current_rank_df['Дата текущего соревнования'] = current_rank_df[current_rank_df['Дата соревнования'].notna()] \
-                                                                        ['Дата соревнования'].max()
-
-        # оставляем только строку по каждому участнику (с датой последнего соревнования, вошедшего в расчет ранга)
-        def left_current_rank_only(df):
-            df = df.sort_values(by='Дата соревнования', ascending=False).head(1)
-            return df
-
-        current_rank_df = current_rank_df.groupby(by=participant_fields, as_index=False).apply(left_current_rank_only)
+        current_rank_df['Дата текущего соревнования'] = current_race_date
+        laps.lap('aggregation', len(current_rank_df))
 
         # добавляем текущий ранг к протоколу текущего соревнования
         # соединяем по участнику и соревнованию, по итогам которого расчитан последний текущий ранг
         # считаем, что в один день может быть только одно соревнование
         protocol_df = protocol_df.merge(current_rank_df,
                                         how='left',
-                                        left_on=participant_fields + ['Дата соревнования'],
-                                        right_on=participant_fields + ['Дата текущего соревнования'],
+                                        left_on=participant_key + ['Дата соревнования'],
+                                        right_on=participant_key + ['Дата текущего соревнования'],
                                         suffixes=(None, '_config'))
+        laps.lap('merge', len(protocol_df))
 
         # сохраняем текущий ранг в файл
-        current_rank_df = current_rank_df[participant_fields + ['Текущий ранг', 'Итоговый ранг'] +
+        current_rank_df = current_rank_df[participant_key + ['Текущий ранг', 'Итоговый ранг'] +
                                           current_rank_fields + ['Дата текущего соревнования']]
         current_rank_df.sort_values(by='Текущий ранг', ascending=False, inplace=True)
         current_rank_df.reset_index(drop=True, inplace=True)
         current_rank_df.index += 1
-        current_rank_df.to_excel(
-            application_config.rank_dir / 'Текущий ранг_{}_{}.xlsx'.format(competition, application_config.season))
-
-        # добавляем протокол соревнования к общей таблице протоколов
-        protocols_rank_df_final = protocols_rank_df_final.append(protocol_df)
-
-        # считаем кол-во прошедших соревнований только для текущего
+        rank_history.append(get_rank_history_part(current_rank_df, competitions_cnt))
+        if write_results:
+            current_rank_file_df = participant_registry.add_fields(current_rank_df)
+            # с базой сезона файл текущего ранга - представление ранга, сохраненного в базе
+            if season_db is not None:
+                season_db.save_competition_rank(competition, competitions_cnt,
+                                                fingerprints[competitions_cnt - 1] if fingerprints else None,
+                                                protocol_df, current_rank_file_df)
+                current_rank_file_df = season_db.get_current_rank(competition)
+            output_writer.write(get_current_rank_file(application_config, competition), current_rank_file_df)
+        laps.lap('excel_write', len(current_rank_df))
+
+        # кол-во прошедших соревнований для протокола текущего соревнования
         # (для предыдущих соревнований это число уже посчитано в прошлых итерациях)
-        protocols_rank_df_final['Кол-во прошедших соревнований'] = np.where(
-            protocols_rank_df_final['Файл протокола'] == competition,
-            protocols_rank_df_final['Файл протокола'].nunique(),
-            protocols_rank_df_final['Кол-во прошедших соревнований'])
+        protocol_df['Кол-во прошедших соревнований'] = competitions_cnt
 
-        protocols_rank_df_final.sort_values(by=['Дата соревнования', 'Возрастная группа', 'Место'], inplace=True)
+        # добавляем протокол соревнования к общей таблице протоколов
+        protocols_rank_df_final.append(protocol_df)
+
+        if fingerprints:
+            save_checkpoint(application_config, fingerprints[competitions_cnt - 1],
+                            {'current_rank_df': current_rank_df,
+                             'protocols_rank_df': protocols_rank_df,
+                             'protocols_rank_df_final': protocols_rank_df_final,
+                             'rank_history': rank_history,
+                             'participants_df': participant_registry.participants_df,
+                             'competitions_cnt': competitions_cnt})
+            laps.lap('checkpoint')
         competitions_cnt += 1
     # ------------------------------------------------------------------------------------------------------------------
 
+    # сортировка устойчивая (по нескольким полям), поэтому однократная сортировка в конце дает тот же порядок строк,
+    # что и сортировка после каждого соревнования
+    protocols_rank_df_final = protocols_rank_df_final.finalize() \
+                                                     .sort_values(by=['Дата соревнования', 'Возрастная группа', 'Место'])
     protocols_rank_df_final = protocols_rank_df_final[
         ['Дата соревнования', 'Соревнование', 'Файл протокола', 'Уровень старта', 'Коэффициент уровня старта',
          'Вид старта', 'Коэффициент вида старта', 'Возрастная группа', '№ п/п', 'Номер', 'Фамилия', 'Имя',
@@ -365,22 +503,31 @@ def calculate_current_rank(application_config: ApplicationConfig, rank_formula_c
          'Ранг', 'Кол-во соревнований у участника', 'Доля отсутствующих стартов', 'Штраф за отсутствующие старты',
          'Текущий ранг', 'Дата текущего соревнования', 'Итоговый ранг', 'Кол-во прошедших соревнований',
          'Кол-во cоревнований для текущего ранга']]
-    protocols_rank_df_final.to_excel(
-        application_config.rank_dir / 'Протоколы {}_{}.xlsx'.format(application_config.rank_to_calculate,
-                                                                    application_config.season), index=False)
+    if write_results:
+        output_writer.write(
+            application_config.rank_dir / 'Протоколы {}_{}.xlsx'.format(application_config.rank_to_calculate,
+                                                                        application_config.season),
+            protocols_rank_df_final, index=False)
+        if len(rank_history) > 0:
+            save_rank_history(application_config, participant_registry, rank_history.finalize())
 
-    return current_rank_df
+    return participant_registry.add_fields(current_rank_df)
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--telemetry', action='store_true',
+                        help='сохранить время, процессорное время, кол-во строк и пик памяти этапов в {}'.format(
+                            TELEMETRY_DIR))
+    parser.add_argument('--profile', action='store_true', help='дополнительно сохранить дамп cProfile')
+    args = parser.parse_args()
     setup_logging()
     logging.info(f'Rank calculator version {VERSION}\nAlex, Inc. No rights are reserved.\n')
     try:
         with warnings.catch_warnings():
             warnings.simplefilter('ignore')
-            check_app_config()
-            check_rank_config()
-            main()
+            main(args)
     except Error as e:
         logging.error(e)
     except Exception as e:
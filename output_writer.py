@@ -0,0 +1,183 @@
+import atexit
+import logging
+import math
+import os
+import threading
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from errors import OutputWriteError
+from telemetry import telemetry
+
+
+@lru_cache(maxsize=None)
+def get_header_style() -> tuple:
+    # оформление заголовков и индекса то же, что у pd.DataFrame.to_excel;
+    # openpyxl импортируется только при первой записи, а не при запуске программы
+    from openpyxl.styles import Alignment, Border, Font, Side
+    side = Side(style='thin')
+    return (Font(bold=True), Border(left=side, right=side, top=side, bottom=side),
+            Alignment(horizontal='center', vertical='top'))
+
+
+@lru_cache(maxsize=None)
+def get_cell_style(fill: str, font_color: str) -> tuple:
+    # заливка и цвет шрифта ячейки так же, как их записывает pd.io.formats.style.Styler.to_excel
+    from openpyxl.styles import Font, PatternFill
+    return (PatternFill(fill_type='solid', start_color=fill) if fill else None,
+            Font(color=font_color) if font_color else None)
+
+
+def get_cell_value(value):
+    # значения приводятся так же, как в pd.DataFrame.to_excel: пропуски - пустые ячейки, бесконечность - 'inf',
+    # числа и даты пишутся как есть, остальное (в т.ч. Decimal и время) - строкой
+    if value is None or value is pd.NaT or value is pd.NA or isinstance(value, Decimal) and value.is_nan():
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool) or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if math.isinf(value):
+            return 'inf' if value > 0 else '-inf'
+        return value
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, (datetime, date)):
+        return value
+    if isinstance(value, timedelta):
+        return value.total_seconds() / 86400
+    return str(value)
+
+
+def get_header_cell(worksheet, value):
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(worksheet, get_cell_value(value))
+    cell.font, cell.border, cell.alignment = get_header_style()
+    return cell
+
+
+def get_styled_cell(worksheet, value, style: tuple):
+    from openpyxl.cell import WriteOnlyCell
+    cell = WriteOnlyCell(worksheet, get_cell_value(value))
+    fill, font = get_cell_style(*style)
+    if fill is not None:
+        cell.fill = fill
+    if font is not None:
+        cell.font = font
+    return cell
+
+
+def save_excel(file: Path, df: pd.DataFrame, index: bool = True, styles: pd.DataFrame = None):
+    # книга в режиме write_only пишется построчно, не держа в памяти все ячейки листа;
+    # styles - таблица той же формы, что и df, с парами (заливка, цвет шрифта) или None для ячеек без оформления
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+
+    header = [get_header_cell(worksheet, column) for column in df.columns]
+    if index:
+        header.insert(0, get_header_cell(worksheet, df.index.name) if df.index.name is not None else None)
+    worksheet.append(header)
+    style_rows = styles.itertuples(index=False, name=None) if styles is not None else None
+    for row in df.itertuples(index=index, name=None):
+        values = [get_cell_value(value) for value in row]
+        if style_rows is not None:
+            for column, style in enumerate(next(style_rows), start=1 if index else 0):
+                if style is not None:
+                    values[column] = get_styled_cell(worksheet, row[column], style)
+        if index:
+            values[0] = get_header_cell(worksheet, row[0])
+        worksheet.append(values)
+
+    # сохраняем через временный файл, чтобы прерванная запись не оставила поврежденный файл
+    tmp_file = file.with_name(file.name + '.tmp')
+    try:
+        workbook.save(tmp_file)
+        os.replace(tmp_file, file)
+    finally:
+        if tmp_file.exists():
+            os.remove(tmp_file)
+
+
+class OutputWriter:
+    def __init__(self):
+        self._jobs = {}
+        self._active_file = None
+        self._errors = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def write(self, file: Path, df: pd.DataFrame, index: bool = True, styles: pd.DataFrame = None):
+        # таблица копируется, так как после постановки в очередь вызывающий код может ее изменить;
+        # если запись в тот же файл еще ждет в очереди, она заменяется новой - пишется только последняя версия
+        file = Path(file)
+        df = df.copy()
+        styles = styles.copy() if styles is not None else None
+        with self._condition:
+            self._jobs.pop(file, None)
+            self._jobs[file] = (df, index, styles)
+            self._start()
+            self._condition.notify_all()
+
+    def flush(self):
+        with self._condition:
+            if self._jobs:
+                self._start()
+            while self._jobs or self._active_file is not None:
+                self._condition.wait()
+            errors, self._errors = self._errors, {}
+        if errors:
+            raise OutputWriteError('Could not write: {}.'.format(
+                ', '.join('{} ({})'.format(file.name, error) for file, error in errors.items())))
+
+    def _start(self):
+        # после fork поток записи в дочернем процессе не существует, поэтому он перезапускается при необходимости
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='output-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._jobs:
+                    self._condition.wait()
+                file = next(iter(self._jobs))
+                df, index, styles = self._jobs.pop(file)
+                self._active_file = file
+
+            error = None
+            try:
+                with telemetry.stage('excel_save', file=file.name) as span:
+                    span.rows = len(df)
+                    save_excel(file, df, index, styles)
+            except Exception as e:
+                error = e
+
+            with self._condition:
+                if error is None:
+                    self._errors.pop(file, None)
+                else:
+                    self._errors[file] = error
+                self._active_file = None
+                self._condition.notify_all()
+
+
+output_writer = OutputWriter()
+
+
+def flush_at_exit():
+    try:
+        output_writer.flush()
+    except OutputWriteError as e:
+        logging.error(e)
+
+
+atexit.register(flush_at_exit)
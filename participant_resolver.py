@@ -0,0 +1,97 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from app_config import ApplicationConfig
+
+
+class MappingIndex:
+    # хэш-индекс листа маппинга: ключ -> номер строки листа (при повторе ключа действует первая строка)
+    # и счетчик строк протоколов, исправленных каждой строкой листа
+    def __init__(self, sheet: str, mapping_df: pd.DataFrame, keys: list, corrections: dict):
+        self.sheet = sheet
+        self.mapping_df = mapping_df.reset_index(drop=True)
+        self.keys = keys
+        self.corrections = corrections
+        self._rows = {}
+        # повторы ключа с другим исправлением: номер строки листа -> номер действующей (первой) строки
+        self.conflicts = {}
+        values = [tuple(None if pd.isna(value) else value for value in row)
+                  for row in self.mapping_df[list(corrections)].itertuples(index=False)]
+        for row, key in enumerate(zip(*(self.mapping_df[column] for column in keys))):
+            first_row = self._rows.setdefault(key, row)
+            if values[row] != values[first_row]:
+                self.conflicts[row] = first_row
+                logging.warning('{}: строка {} повторяет ключ строки {} с другим исправлением и не применяется'
+                                .format(sheet, row + 2, first_row + 2))
+        self.used = np.zeros(len(self.mapping_df), dtype=np.int64)
+
+    def lookup(self, df: pd.DataFrame, mask: np.ndarray) -> np.ndarray:
+        # номер строки листа для каждой строки протоколов (-1 - ключа нет в листе или строку исправлять не нужно)
+        rows = np.fromiter((self._rows.get(key, -1) for key in zip(*(df[column] for column in self.keys))),
+                           dtype=np.int64, count=len(df))
+        rows[~mask] = -1
+        np.add.at(self.used, rows[rows >= 0], 1)
+        return rows
+
+    def get_values(self, rows: np.ndarray, column: str, index: pd.Index) -> pd.Series:
+        # значения колонки листа по найденным строкам с тем же приведением типов, что и при левом merge
+        values = self.mapping_df[column].reindex(rows)
+        values.index = index
+        return values
+
+    def _join_columns(self, columns: list) -> list:
+        # построчно, так как agg по строкам пустого листа (только заголовок) возвращает таблицу, а не колонку
+        return [' '.join(map(str, row)) for row in self.mapping_df[columns].itertuples(index=False)]
+
+    def get_usage(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'Лист': self.sheet,
+            'Строка листа': np.arange(len(self.mapping_df), dtype=np.int64) + 2,
+            'Ключ': self._join_columns(self.keys),
+            'Исправление': self._join_columns(list(self.corrections)),
+            'Кол-во строк протоколов': self.used,
+            'Конфликт': ['Ключ уже задан в строке {} с другим исправлением'.format(self.conflicts[row] + 2)
+                         if row in self.conflicts else '' for row in range(len(self.mapping_df))],
+        }, columns=['Лист', 'Строка листа', 'Ключ', 'Исправление', 'Кол-во строк протоколов', 'Конфликт'])
+
+
+class ParticipantResolver:
+    # исправления данных участников по листам маппингов конфигуратора приложения: индексы строятся один раз,
+    # а исправления применяются одним проходом по всем протоколам сезона в том же порядке, что и раньше
+    # для каждой таблицы протокола: возрастная группа, год рождения по ФИО, ФИО и год рождения
+    def __init__(self, application_config: ApplicationConfig):
+        self.group = MappingIndex('Маппинг. Возрастная группа', application_config.mapping_group_df,
+                                  ['Возрастная группа'], {'Возрастная группа верная': 'Возрастная группа'})
+        self.yob = MappingIndex('Маппинг. Год рождения', application_config.mapping_yob_df,
+                                ['Фамилия', 'Имя'], {'Г.р.': 'Г.р.'})
+        self.participant = MappingIndex('Маппинг. ФИО', application_config.mapping_correct_participant_data,
+                                        ['Фамилия', 'Имя', 'Г.р.'],
+                                        {'Фамилия верная': 'Фамилия', 'Имя верное': 'Имя', 'Г.р. верный': 'Г.р.'})
+
+    def resolve(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.copy()
+        all_rows = np.ones(len(df), dtype=bool)
+
+        rows = self.group.lookup(df, all_rows)
+        df['Возрастная группа'] = self.group.get_values(rows, 'Возрастная группа верная', df.index) \
+            .fillna(df['Возрастная группа'])
+
+        # год рождения из маппинга подставляется только участникам без года рождения
+        yob = df['Г.р.'].replace(0, np.nan)
+        rows = self.yob.lookup(df, yob.isna().to_numpy())
+        df['Г.р.'] = yob.fillna(self.yob.get_values(rows, 'Г.р.', df.index)).replace(np.nan, 0)
+
+        rows = self.participant.lookup(df, all_rows)
+        for column, target in self.participant.corrections.items():
+            df[target] = self.participant.get_values(rows, column, df.index).fillna(df[target])
+        return df
+
+    def get_usage(self) -> pd.DataFrame:
+        # строки листов маппингов с кол-вом исправленных строк протоколов: неиспользованные строки можно удалить
+        mappings = (self.group, self.yob, self.participant)
+        for mapping in mappings:
+            logging.info('{}: использовано строк {} из {}'.format(
+                mapping.sheet, (mapping.used > 0).sum(), len(mapping.used)))
+        return pd.concat([mapping.get_usage() for mapping in mappings], ignore_index=True)
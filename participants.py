@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+PARTICIPANT_FIELDS = ['Фамилия', 'Имя', 'Г.р.', 'Пол']
+PARTICIPANT_ID = 'ID участника'
+
+
+class ParticipantRegistry:
+    # каждому участнику (фамилия, имя, год рождения, пол) один раз присваивается целочисленный ID,
+    # и все соединения в расчете ранга идут по нему, а не по четырем строковым полям
+    def __init__(self, *dfs: pd.DataFrame):
+        participants_df = pd.concat([self._get_fields(df) for df in dfs], ignore_index=True)
+        participants_df = participants_df.dropna().drop_duplicates()
+
+        # ID назначаются в порядке сортировки полей участника, поэтому группировка по ID
+        # дает тот же порядок групп, что и группировка по самим полям; из-за этого ID действуют только в одном
+        # запуске (новый участник сезона сдвигает ID следующих за ним), и состояние из контрольной точки
+        # переводится в ID текущего запуска через remap
+        participants_df = participants_df.sort_values(by=PARTICIPANT_FIELDS, kind='mergesort', ignore_index=True)
+        participants_df.index.name = PARTICIPANT_ID
+        self.participants_df = participants_df
+
+    def __len__(self):
+        return len(self.participants_df)
+
+    @staticmethod
+    def _get_fields(df: pd.DataFrame) -> pd.DataFrame:
+        fields_df = df[PARTICIPANT_FIELDS].astype({'Фамилия': object, 'Имя': object, 'Пол': object})
+        fields_df['Г.р.'] = fields_df['Г.р.'].astype(float)
+        return fields_df
+
+    def get_ids(self, df: pd.DataFrame) -> pd.Series:
+        # участник без фамилии, имени или пола не получает ID (как и строки с пропусками при группировке по полям)
+        ids = self._get_fields(df).merge(self.participants_df.reset_index(), how='left', on=PARTICIPANT_FIELDS)
+        return pd.Series(ids[PARTICIPANT_ID].to_numpy(), index=df.index, dtype='Int64')
+
+    def add_ids(self, df: pd.DataFrame) -> pd.DataFrame:
+        df = df.copy()
+        df[PARTICIPANT_ID] = self.get_ids(df)
+        return df
+
+    def add_fields(self, df: pd.DataFrame) -> pd.DataFrame:
+        # поля участника возвращаются по ID только для сохранения результатов
+        fields_df = self.participants_df.reindex(df[PARTICIPANT_ID].to_numpy(dtype=np.int64))
+        fields_df.index = df.index
+        fields_df['Г.р.'] = fields_df['Г.р.'].astype(np.int64)
+        return pd.concat([fields_df, df.drop(columns=PARTICIPANT_ID)], axis=1)
+
+    def remap(self, df: pd.DataFrame, participants_df: pd.DataFrame) -> pd.DataFrame:
+        # перевод ID из другого реестра (например, сохраненного в контрольной точке) в ID этого реестра
+        ids = self.get_ids(participants_df)
+        df = df.copy()
+        df[PARTICIPANT_ID] = df[PARTICIPANT_ID].map(ids).astype('Int64')
+        return df
@@ -1,206 +1,296 @@
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import partial
+from typing import Optional, Iterator
 import re
 import pandas as pd
 from pandas import DataFrame
-from bs4 import BeautifulSoup
 import logging
 from logger import setup_logging
 import numpy as np
-import requests
 
 from app_config import ApplicationConfig
 from rank_formula_config import RankFormulaConfig
-from constants import APP_CONFIG_FILE, RANK_CONFIG_FILE
+from config_loader import load_configs
+from output_writer import output_writer
+from season_db import SeasonDatabase
+from season_store import SeasonStore
+from participant_resolver import ParticipantResolver
+from protocols_cache import get_mapping_fingerprint, get_protocol_key, is_protocol_cached, load_protocol, \
+    save_protocol
+
+
+def parse_protocol(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig,
+                   name: str) -> Optional[DataFrame]:
+    # lxml импортируется только при разборе протоколов, которых нет в кэше
+    from protocol_parser import read_protocol_html
+
+    header1, headers2, dfs = read_protocol_html(application_config.protocols_dir / name)
+    competition = ''.join(re.split('\\n', header1)[0]).replace('Протокол результатов', '').strip()
+
+    date_string = re.findall('[0-9]{2}\.[0-9]{2}\.[0-9]{4}', header1)
+    if len(date_string) > 0:
+        date_string = datetime.strptime(date_string[0], '%d.%m.%Y')
+    elif len(re.findall('[0-9]{8}_', name)) > 0:
+        date_string = datetime.strptime(re.findall('[0-9]{8}_', name)[0].replace('_', ''), '%Y%m%d')
+    else:
+        date_string = os.path.getctime(os.path.join(application_config.protocols_dir, name))
+    competition_date = date_string.date()
+
+    # определяем сезон протокола (для зимнего ранга декабрь относится к следующему году)
+    if application_config.rank_to_calculate == 'Общий зимний ранг' and competition_date.month == 12:
+        competition_year = competition_date.year + 1
+    else:
+        competition_year = competition_date.year
+
+    # обрабатываем только протоколы, относящиеся к сезону, заданному в конфигураторе
+    if competition_year != application_config.season:
+        return None
+
+    # уровень старта одинаков для всех групп протокола и определяется по заголовку один раз
+    race_level = rank_formula_config.race_level_classifier.classify(header1)
+
+    # одна итерация - одна возрастная группа ---------------------------------------------------------------------------
+    # маппинги участников здесь не применяются: они применяются один раз ко всем протоколам сезона
+    # (resolve_protocols), поэтому разобранный протокол и кэш протоколов от маппингов не зависят
+    for tbl in range(len(dfs)):
+
+        # Трансформация колонок протокола ------------------------------------------------------------------------------
+        if 'Фамилия, Имя' in dfs[tbl].columns:
+            dfs[tbl]['Фамилия'] = dfs[tbl]['Фамилия, Имя'].map(lambda x: str(x).split(' ')[0])
+            dfs[tbl]['Имя'] = dfs[tbl]['Фамилия, Имя'].map(lambda x: str(x).split(' ')[1:])
+            dfs[tbl]['Имя'] = dfs[tbl]['Имя'].str.join(' ')
+            dfs[tbl].drop(labels='Фамилия, Имя', axis=1, inplace=True)
+
+        if 'Г.р' in dfs[tbl].columns:
+            dfs[tbl].rename(columns={'Г.р': 'Г.р.'}, inplace=True)
+
+        dfs[tbl] = dfs[tbl].astype({'Фамилия': 'string', 'Имя': 'string'})
+        dfs[tbl]['Пол'] = headers2[tbl].upper()[:1]
+        dfs[tbl]['Возрастная группа'] = headers2[tbl].upper()
+
+        dfs[tbl]['Соревнование'] = competition
+        dfs[tbl]['Дата соревнования'] = competition_date
+        dfs[tbl]['Уровень старта'] = race_level
+        dfs[tbl]['Файл протокола'] = name
+        dfs[tbl]['Фамилия'] = dfs[tbl]['Фамилия'].str.upper()
+        dfs[tbl]['Имя'] = dfs[tbl]['Имя'].str.upper()
+
+        # ФИО и год рождения - в конце таблицы, как после исправления по маппингам
+        dfs[tbl] = dfs[tbl][[column for column in dfs[tbl].columns if column not in ('Фамилия', 'Имя', 'Г.р.')] +
+                            ['Фамилия', 'Имя', 'Г.р.']]
+
+        dfs[tbl]['Результат'].replace('п\.п\. .*', 'cнят', inplace=True, regex=True)
+        dfs[tbl]['Результат'].replace('cнят (запр.)', 'cнят', inplace=True, regex=False)
+
+        dfs[tbl]['Вид старта'] = np.where(
+            dfs[tbl]['Соревнование'].str.find('общий старт') > 0,
+            'общий старт', 'раздельный старт')
+        dfs[tbl] = dfs[tbl].merge(rank_formula_config.race_type_df,
+                                  how='left',
+                                  on='Вид старта',
+                                  suffixes=(None, '_map'))
+
+        dfs[tbl] = dfs[tbl].merge(rank_formula_config.race_level_df,
+                                  how='left',
+                                  on='Уровень старта',
+                                  suffixes=(None, '_map'))
+        dfs[tbl]['Коэффициент уровня старта'] = 1 + dfs[tbl]['Коэффициент уровня старта'].fillna(0)
+        # --------------------------------------------------------------------------------------------------------------
+
+    # номера строк внутри групп сохраняются: по ним (как и раньше) нумеруются не стартовавшие и снятые
+    return pd.concat(dfs)
+
+
+def resolve_protocols(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig,
+                      df: DataFrame, write_results: bool = True) -> tuple[DataFrame, DataFrame, DataFrame]:
+    # исправления участников по маппингам и отбор результатов - один проход по всем протоколам сезона
+    resolver = ParticipantResolver(application_config)
+    df = resolver.resolve(df)
+    if write_results:
+        output_writer.write(
+            application_config.rank_dir / 'Использование маппингов_{}.xlsx'.format(application_config.season),
+            resolver.get_usage(), index=False)
+
+    # оставляем для расчета ранга только группы МЖ12 и старше
+    group_rank = rank_formula_config.group_rank_df.drop_duplicates(subset='Возрастная группа') \
+        .set_index('Возрастная группа')['Ранг группы']
+    df = df[df['Возрастная группа'].isin(rank_formula_config.group_rank_df['Возрастная группа'].to_list())].copy()
+    df['Ранг группы'] = df['Возрастная группа'].map(group_rank)
+
+    # таблицы со снятыми и не стартовавшими
+    df_not_started = df[df['Результат'] == 'н/с']
+    df_left_race = df[df['Результат'] == 'cнят']
+
+    # фильтруем снятых, не стартовавших или без имени или фамилии или вместо места поставлен прочерк
+    df = df[~((df['Результат'] == 'cнят') | (df['Результат'] == 'н/с') | (
+        df['Фамилия'].isna()) | (df['Имя'].isna()) | (df['Место'] == '-'))].copy()
+
+    df['Место'] = df['Место'].astype(int)
+
+    df['Результат'] = pd.to_datetime(df['Результат'])
+    df['result_in_seconds'] = (
+            df['Результат'].dt.hour * 60 * 60 +
+            df['Результат'].dt.minute * 60 +
+            df['Результат'].dt.second)
+    df['Результат'] = df['Результат'].dt.time
+    return df.reset_index(drop=True), df_not_started, df_left_race
+
+
+def read_protocol(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig, name: str,
+                  mapping_fingerprint: Optional[str]) -> Optional[DataFrame]:
+    if mapping_fingerprint is None:
+        return parse_protocol(application_config, rank_formula_config, name)
+
+    # повторно разбираем только новые или измененные протоколы, а также все протоколы при изменении таблиц
+    # формулы ранга, от которых зависит разобранный протокол (изменение маппингов участников кэш не сбрасывает)
+    key = get_protocol_key(application_config.protocols_dir / name, mapping_fingerprint)
+    if is_protocol_cached(key):
+        return load_protocol(key)
+    return save_protocol(key, parse_protocol(application_config, rank_formula_config, name))
+
+
+def read_protocol_task(rank_formula_config: RankFormulaConfig,
+                       task: tuple) -> Optional[DataFrame]:
+    application_config, name, mapping_fingerprint = task
+    return read_protocol(application_config, rank_formula_config, name, mapping_fingerprint)
+
+
+def read_protocol_tasks(rank_formula_config: RankFormulaConfig, tasks: list, workers: int) -> Iterator:
+    read = partial(read_protocol_task, rank_formula_config)
+
+    # протоколы разбираются параллельно в нескольких процессах, но результаты возвращаются в порядке файлов,
+    # поэтому итоговая таблица совпадает с последовательной обработкой (0 - по числу ядер процессора)
+    workers = workers or os.cpu_count()
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            yield from executor.map(read, tasks)
+    else:
+        yield from map(read, tasks)
+
+
+def read_protocols(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig, names: list,
+                   mapping_fingerprint: Optional[str]) -> Iterator:
+    tasks = [(application_config, name, mapping_fingerprint) for name in names]
+    yield from read_protocol_tasks(rank_formula_config, tasks, application_config.protocols_workers)
+
+
+def get_protocol_names(application_config: ApplicationConfig) -> list:
+    return [name for name in os.listdir(application_config.protocols_dir)
+            if os.path.isfile(os.path.join(application_config.protocols_dir, name))]
+
 
+def collect_protocols(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig, names: list,
+                      protocols: Iterator, write_results: bool = True) -> tuple[DataFrame, DataFrame, DataFrame]:
+    # write_results = False - без записи сводных файлов и базы сезона (например, при сравнении вариантов формулы ранга)
+    season_protocols = SeasonStore()
+    unknown_race_levels = []
 
-def download_protocols(application_config: ApplicationConfig):
-    for url in application_config.protocol_urls_df['Ссылка']:
-        name = url.split('/')[-1]
-        with open(application_config.protocols_dir / name, 'w') as f:
-            f.write(requests.get(url).text)
+    # одна итерация - один протокол  -----------------------------------------------------------------------------------
+    for name, protocol_df in zip(names, protocols):
+        # обрабатываем только протоколы, относящиеся к сезону, заданному в конфигураторе
+        if protocol_df is not None:
+            logging.info(name)
+
+            # протоколы, заголовок которых не подошел ни к одному шаблону уровня старта, идут в расчет
+            # с коэффициентом уровня старта 1 и попадают в отдельный отчет
+            if len(protocol_df) > 0 and protocol_df['Уровень старта'].isna().all():
+                logging.warning('{}: уровень старта не определен, коэффициент уровня старта - 1'.format(name))
+                unknown_race_levels.append(protocol_df[['Дата соревнования', 'Соревнование', 'Файл протокола']]
+                                           .iloc[:1])
+
+            # дополнем таблицу протоколов разобранным экземпляром
+            season_protocols.append(protocol_df)
+
+    season_protocols = season_protocols.finalize()
+    if len(season_protocols.columns) > 0:
+        dfs_union, df_not_started, df_left_race = \
+            resolve_protocols(application_config, rank_formula_config, season_protocols, write_results)
+    else:
+        dfs_union, df_left_race, df_not_started = pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    # сводные файлы пишутся один раз после обработки всех протоколов
+    if len(dfs_union.columns) > 0 and write_results:
+        if application_config.season_db == 'да':
+            SeasonDatabase(application_config).save_protocols(dfs_union, df_not_started, df_left_race)
+        output_writer.write(
+            application_config.rank_dir / 'Протоколы_не_стартовали_{}.xlsx'.format(application_config.season),
+            df_not_started, index=False)
+        output_writer.write(
+            application_config.rank_dir / 'Протоколы_сняты_{}.xlsx'.format(application_config.season),
+            df_left_race, index=False)
+        output_writer.write(
+            application_config.rank_dir / 'Участники без года рождения_{}.xlsx'.format(application_config.season),
+            dfs_union[dfs_union['Г.р.'] == 0][[
+                'Дата соревнования', 'Соревнование', 'Фамилия', 'Имя', 'Г.р.', 'Возрастная группа']],
+            index=False)
+        output_writer.write(
+            application_config.rank_dir / 'Протоколы без уровня старта_{}.xlsx'.format(application_config.season),
+            pd.concat(unknown_race_levels) if unknown_race_levels else
+            pd.DataFrame(columns=['Дата соревнования', 'Соревнование', 'Файл протокола']),
+            index=False)
+    return dfs_union, df_left_race, df_not_started
 
 
-def prepare_protocols(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig) -> tuple[
-    DataFrame, DataFrame, DataFrame]:
-    dfs_union = pd.DataFrame()
-    df_not_started = pd.DataFrame()
-    df_left_race = pd.DataFrame()
+def prepare_protocols(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig,
+                      write_results: bool = True) -> tuple[DataFrame, DataFrame, DataFrame]:
+    mapping_fingerprint = None
+    if application_config.protocols_cache == 'да':
+        mapping_fingerprint = get_mapping_fingerprint(application_config, rank_formula_config)
 
     logging.info('--Обработка протоколов')
 
-    # одна итерация - один протокол  -----------------------------------------------------------------------------------
-    for name in os.listdir(application_config.protocols_dir):
-        if os.path.isfile(os.path.join(application_config.protocols_dir, name)):
-            dfs = pd.read_html(application_config.protocols_dir / name)
-
-            soup = BeautifulSoup(open(application_config.protocols_dir / name, 'r'), 'lxml')
-
-            heading2 = ['h2']
-            heading1 = ['h1']
-
-            header1 = str(soup.find_all(heading1)[0].text.strip())
-            competition = ''.join(re.split('\\n', header1)[0]).replace('Протокол результатов', '').strip()
-
-            date_string = re.findall('[0-9]{2}\.[0-9]{2}\.[0-9]{4}', header1)
-            if len(date_string) > 0:
-                date_string = datetime.strptime(date_string[0], '%d.%m.%Y')
-            elif len(re.findall('[0-9]{8}_', name)) > 0:
-                date_string = datetime.strptime(re.findall('[0-9]{8}_', name)[0].replace('_', ''), '%Y%m%d')
-            else:
-                date_string = os.path.getctime(os.path.join(application_config.protocols_dir, name))
-            competition_date = date_string.date()
-
-            # определяем сезон протокола (для зимнего ранга декабрь относится к следующему году)
-            if application_config.rank_to_calculate == 'Общий зимний ранг' and competition_date.month == 12:
-                competition_year = competition_date.year + 1
-            else:
-                competition_year = competition_date.year
-
-            # обрабатываем только протоколы, относящиеся к сезону, заданному в конфигураторе
-            if competition_year == application_config.season:
-                logging.info(name)
-                # одна итерация - одна возрастная группа -------------------------------------------------------------------
-                for tbl in range(len(dfs)):
-
-                    # Трансформация колонок протокола ----------------------------------------------------------------------
-                    if 'Фамилия, Имя' in dfs[tbl].columns:
-                        dfs[tbl]['Фамилия'] = dfs[tbl]['Фамилия, Имя'].map(lambda x: str(x).split(' ')[0])
-                        dfs[tbl]['Имя'] = dfs[tbl]['Фамилия, Имя'].map(lambda x: str(x).split(' ')[1:])
-                        dfs[tbl]['Имя'] = dfs[tbl]['Имя'].str.join(' ')
-                        dfs[tbl].drop(labels='Фамилия, Имя', axis=1, inplace=True)
-
-                    if 'Г.р' in dfs[tbl].columns:
-                        dfs[tbl].rename(columns={'Г.р': 'Г.р.'}, inplace=True)
-
-                    dfs[tbl] = dfs[tbl].astype({'Фамилия': 'string', 'Имя': 'string'})
-                    dfs[tbl]['Возрастная группа'] = str(soup.find_all(heading2)[tbl].text.strip()).upper()
-                    dfs[tbl]['Пол'] = str(soup.find_all(heading2)[tbl].text.strip()).upper()[:1]
-
-                    dfs[tbl] = dfs[tbl].merge(application_config.mapping_group_df,
-                                              how='left',
-                                              on='Возрастная группа',
-                                              suffixes=(None, '_config'))
-                    dfs[tbl]['Возрастная группа верная'].fillna(dfs[tbl]['Возрастная группа'], inplace=True)
-                    dfs[tbl].drop(labels='Возрастная группа', axis=1, inplace=True)
-                    dfs[tbl].rename(columns={'Возрастная группа верная': 'Возрастная группа'}, inplace=True)
-
-                    dfs[tbl]['Соревнование'] = competition
-                    dfs[tbl]['Дата соревнования'] = competition_date
-                    dfs[tbl]['Уровень старта'] = header1
-                    dfs[tbl]['Файл протокола'] = name
-                    dfs[tbl]['Фамилия'] = dfs[tbl]['Фамилия'].str.upper()
-                    dfs[tbl]['Имя'] = dfs[tbl]['Имя'].str.upper()
-
-                    dfs[tbl] = dfs[tbl].merge(application_config.mapping_yob_df,
-                                              how='left',
-                                              on=['Фамилия', 'Имя'],
-                                              suffixes=(None, '_map'))
-                    dfs[tbl]['Г.р.'].replace(0, np.nan, inplace=True)
-                    dfs[tbl]['Г.р.'] = dfs[tbl]['Г.р.'].fillna(dfs[tbl]['Г.р._map'])
-                    dfs[tbl].drop(labels='Г.р._map', axis=1, inplace=True)
-                    dfs[tbl]['Г.р.'].replace(np.nan, 0, inplace=True)
-
-                    dfs[tbl] = dfs[tbl].merge(application_config.mapping_correct_participant_data,
-                                              how='left',
-                                              on=['Фамилия', 'Имя', 'Г.р.'],
-                                              suffixes=(None, '_map'))
-                    dfs[tbl]['Фамилия верная'].fillna(dfs[tbl]['Фамилия'], inplace=True)
-                    dfs[tbl].drop(labels='Фамилия', axis=1, inplace=True)
-                    dfs[tbl].rename(columns={'Фамилия верная': 'Фамилия'}, inplace=True)
-
-                    dfs[tbl]['Имя верное'].fillna(dfs[tbl]['Имя'], inplace=True)
-                    dfs[tbl].drop(labels='Имя', axis=1, inplace=True)
-                    dfs[tbl].rename(columns={'Имя верное': 'Имя'}, inplace=True)
-
-                    dfs[tbl]['Г.р. верный'].fillna(dfs[tbl]['Г.р.'], inplace=True)
-                    dfs[tbl].drop(labels='Г.р.', axis=1, inplace=True)
-                    dfs[tbl].rename(columns={'Г.р. верный': 'Г.р.'}, inplace=True)
-
-                    dfs[tbl]['Результат'].replace('п\.п\. .*', 'cнят', inplace=True, regex=True)
-                    dfs[tbl]['Результат'].replace('cнят (запр.)', 'cнят', inplace=True, regex=False)
-
-                    dfs[tbl]['Вид старта'] = np.where(
-                        dfs[tbl]['Соревнование'].str.find('общий старт') > 0,
-                        'общий старт', 'раздельный старт')
-                    dfs[tbl] = dfs[tbl].merge(rank_formula_config.race_type_df,
-                                              how='left',
-                                              on='Вид старта',
-                                              suffixes=(None, '_map'))
-
-                    def race_level_mapping(s):
-                        s = s.lower()
-                        if re.search('.*((чемпионат)|(первенство))+.*петрозаводск.*', s) is not None:
-                            return 'Чемпионат и первенство г.Петрозаводска'
-                        if re.search('.*((чемпионат)|(первенство))+.*карелия.*', s) is not None:
-                            return 'Чемпионат и первенство Республики Карелия'
-                        if re.search('.*онежск.*весн.*', s) is not None:
-                            return 'Онежская весна'
-                        if re.search('.*всероссийские.*соревнования.*', s) is not None:
-                            return 'Всероссийские соревнования'
-                        if re.search('.*клубн.*куб.*карели.*', s) is not None or re.search('.*ккк.*', s) is not None:
-                            return 'Клубный кубок Карелии (ККК)'
-
-                    dfs[tbl]['Уровень старта'] = dfs[tbl]['Уровень старта'].apply(race_level_mapping)
-                    dfs[tbl] = dfs[tbl].merge(rank_formula_config.race_level_df,
-                                              how='left',
-                                              on='Уровень старта',
-                                              suffixes=(None, '_map'))
-                    dfs[tbl]['Коэффициент уровня старта'] = 1 + dfs[tbl]['Коэффициент уровня старта'].fillna(0)
-                    dfs[tbl] = dfs[tbl].merge(rank_formula_config.group_rank_df,
-                                              how='left',
-                                              on='Возрастная группа',
-                                              suffixes=(None, '_config'))
-
-                    # оставляем для расчета ранга только группы МЖ12 и старше
-                    dfs[tbl] = dfs[tbl][
-                        dfs[tbl]['Возрастная группа'].isin(
-                            rank_formula_config.group_rank_df['Возрастная группа'].to_list())]
-
-                    # дополняем таблицы со снятыми и не стартовавшими
-                    df_not_started = df_not_started.append(dfs[tbl][dfs[tbl]['Результат'] == 'н/с'])
-                    df_left_race = df_left_race.append(dfs[tbl][dfs[tbl]['Результат'] == 'cнят'])
-
-                    # фильтруем снятых, не стартовавших или без имени или фамилии или вместо места поставлен прочерк
-                    dfs[tbl] = dfs[tbl][~((dfs[tbl]['Результат'] == 'cнят') | (dfs[tbl]['Результат'] == 'н/с') | (
-                        dfs[tbl]['Фамилия'].isna()) | (dfs[tbl]['Имя'].isna()) | (dfs[tbl]['Место'] == '-'))]
-
-                    dfs[tbl]['Место'] = dfs[tbl]['Место'].astype(int)
-
-                    dfs[tbl]['Результат'] = pd.to_datetime(dfs[tbl]['Результат'])
-                    dfs[tbl]['result_in_seconds'] = (
-                            dfs[tbl]['Результат'].dt.hour * 60 * 60 +
-                            dfs[tbl]['Результат'].dt.minute * 60 +
-                            dfs[tbl]['Результат'].dt.second)
-                    dfs[tbl]['Результат'] = dfs[tbl]['Результат'].dt.time
-                    # ------------------------------------------------------------------------------------------------------
-
-                # дополнем таблицу протоколов обработанным экземпляром
-                dfs_union = dfs_union.append(pd.concat(dfs))
-                dfs_union.reset_index(inplace=True, drop=True)
-
-                df_not_started.to_excel(
-                    application_config.rank_dir / 'Протоколы_не_стартовали_{}.xlsx'.format(competition_year),
-                    index=False)
-                df_left_race.to_excel(application_config.rank_dir / 'Протоколы_сняты_{}.xlsx'.format(competition_year),
-                                      index=False)
-                dfs_union[dfs_union['Г.р.'] == 0][[
-                    'Дата соревнования', 'Соревнование', 'Фамилия', 'Имя', 'Г.р.', 'Возрастная группа']].to_excel(
-                    application_config.rank_dir / 'Участники без года рождения_{}.xlsx'.format(competition_year),
-                    index=False)
-    return dfs_union, df_left_race, df_not_started
+    names = get_protocol_names(application_config)
+    return collect_protocols(application_config, rank_formula_config, names,
+                             read_protocols(application_config, rank_formula_config, names, mapping_fingerprint),
+                             write_results)
+
+
+def prepare_protocols_batch(application_configs: list, rank_formula_config: RankFormulaConfig) -> dict:
+    # пакетный режим: одинаковые протоколы (то же имя, содержимое и сезон) из папок разных типов ранга
+    # разбираются один раз, а результат используется для каждого ранга, в который протокол включен
+    logging.info('--Обработка протоколов')
+
+    tasks = {}
+    protocol_keys = {}
+    for application_config in application_configs:
+        mapping_fingerprint = get_mapping_fingerprint(application_config, rank_formula_config)
+        protocol_keys[application_config.rank_to_calculate] = []
+        for name in get_protocol_names(application_config):
+            key = get_protocol_key(application_config.protocols_dir / name, mapping_fingerprint)
+            protocol_keys[application_config.rank_to_calculate].append((name, key))
+            if key not in tasks:
+                tasks[key] = (application_config, name,
+                              mapping_fingerprint if application_config.protocols_cache == 'да' else None)
+
+    protocols = dict(zip(tasks.keys(), read_protocol_tasks(rank_formula_config, list(tasks.values()),
+                                                           application_configs[0].protocols_workers)))
+    logging.info('Разобрано протоколов: {} (всего в папках рангов: {})'.format(
+        len(tasks), sum(len(keys) for keys in protocol_keys.values())))
+
+    prepared_protocols = {}
+    for application_config in application_configs:
+        logging.info(application_config.rank_to_calculate)
+        keys = protocol_keys[application_config.rank_to_calculate]
+        prepared_protocols[application_config.rank_to_calculate] = collect_protocols(
+            application_config, rank_formula_config, [name for name, _ in keys], (protocols[key] for _, key in keys))
+    return prepared_protocols
 
 
 def download_prepare_protocols():
-    application_config = ApplicationConfig(APP_CONFIG_FILE)
-    rank_formula_config = RankFormulaConfig(RANK_CONFIG_FILE)
+    application_config, rank_formula_config = load_configs()
 
     if application_config.protocol_source_type == 'Ссылка':
+        from downloader import download_protocols
         download_protocols(application_config)
 
     prepare_protocols(application_config, rank_formula_config)
+    output_writer.flush()
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     setup_logging()
     download_prepare_protocols()
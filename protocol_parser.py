@@ -0,0 +1,146 @@
+import re
+from pathlib import Path
+from typing import Optional
+
+from lxml import etree
+from pandas import DataFrame
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+
+from errors import ProtocolParsingError
+
+# правила обработки текста ячеек и типов колонок те же, что в pd.read_html
+WHITESPACE_RE = re.compile(r'[\r\n]+|\s{2,}')
+TABLE_TEXT_RE = re.compile('.+')
+TEXT_PARSER_KWARGS = {'index_col': None, 'skiprows': 0, 'parse_dates': False, 'thousands': ',', 'decimal': '.',
+                      'converters': None, 'na_values': None, 'keep_default_na': True}
+
+
+def get_text(elem) -> str:
+    return ''.join(elem.itertext())
+
+
+def get_cells(row) -> list:
+    return row.xpath('./td|./th')
+
+
+def get_rows_texts(rows) -> list:
+    # ячейки с rowspan и colspan копируются в соседние ячейки
+    all_texts = []
+    remainder = []
+
+    for row in rows:
+        texts = []
+        next_remainder = []
+
+        index = 0
+        for cell in get_cells(row):
+            while remainder and remainder[0][0] <= index:
+                prev_index, prev_text, prev_rowspan = remainder.pop(0)
+                texts.append(prev_text)
+                if prev_rowspan > 1:
+                    next_remainder.append((prev_index, prev_text, prev_rowspan - 1))
+                index += 1
+
+            text = WHITESPACE_RE.sub(' ', get_text(cell).strip())
+            rowspan = int(cell.get('rowspan') or 1)
+            colspan = int(cell.get('colspan') or 1)
+
+            for _ in range(colspan):
+                texts.append(text)
+                if rowspan > 1:
+                    next_remainder.append((index, text, rowspan - 1))
+                index += 1
+
+        for prev_index, prev_text, prev_rowspan in remainder:
+            texts.append(prev_text)
+            if prev_rowspan > 1:
+                next_remainder.append((prev_index, prev_text, prev_rowspan - 1))
+
+        all_texts.append(texts)
+        remainder = next_remainder
+
+    while remainder:
+        next_remainder = []
+        texts = []
+        for prev_index, prev_text, prev_rowspan in remainder:
+            texts.append(prev_text)
+            if prev_rowspan > 1:
+                next_remainder.append((prev_index, prev_text, prev_rowspan - 1))
+        all_texts.append(texts)
+        remainder = next_remainder
+
+    return all_texts
+
+
+def table_to_df(table) -> Optional[DataFrame]:
+    if not any(TABLE_TEXT_RE.search(elem.text or '') for elem in table.iterdescendants()):
+        return None
+
+    header_rows = []
+    for thead in table.xpath('.//thead'):
+        header_rows.extend(thead.xpath('./tr'))
+        if get_cells(thead):
+            header_rows.append(thead)
+    body_rows = table.xpath('.//tbody//tr') + table.xpath('./tr')
+    footer_rows = table.xpath('.//tfoot//tr')
+
+    # таблица без <thead>: заголовок - верхние строки, состоящие только из <th>
+    if not header_rows:
+        while body_rows and all(cell.tag == 'th' for cell in get_cells(body_rows[0])):
+            header_rows.append(body_rows.pop(0))
+
+    head = get_rows_texts(header_rows)
+    body = get_rows_texts(body_rows)
+    foot = get_rows_texts(footer_rows)
+
+    header = None
+    if head:
+        body = head + body
+        if len(head) == 1:
+            header = 0
+        else:
+            header = [i for i, row in enumerate(head) if any(text for text in row)]
+    body += foot
+
+    if body:
+        max_len = max(len(row) for row in body)
+        for row in body:
+            row += [''] * (max_len - len(row))
+
+    try:
+        return TextParser(body, header=header, **TEXT_PARSER_KWARGS).read()
+    except EmptyDataError:
+        return None
+
+
+def read_protocol_html(protocol_file: Path) -> tuple[str, list, list]:
+    # один проход по файлу: заголовок соревнования (h1), заголовки групп (h2) и таблицы результатов
+    header1 = None
+    headers2 = []
+    tables = []
+    # пустой или недописанный файл (например, протокол еще копируется) - ошибка разбора протокола, а не lxml
+    try:
+        for _, elem in etree.iterparse(str(protocol_file), events=('end',), tag=('h1', 'h2', 'table'), html=True):
+            if elem.tag == 'h1':
+                if header1 is None:
+                    header1 = get_text(elem).strip()
+            elif elem.tag == 'h2':
+                headers2.append(get_text(elem).strip())
+            else:
+                tables.append(table_to_df(elem))
+            elem.clear(keep_tail=True)
+    except etree.LxmlError as e:
+        raise ProtocolParsingError(f'"{protocol_file.name}" could not be read: {e}.')
+
+    if header1 is None:
+        raise ProtocolParsingError(f'Header (h1) was not found in "{protocol_file.name}".')
+    if len(headers2) != len(tables):
+        raise ProtocolParsingError(f'"{protocol_file.name}" contains {len(headers2)} group headers (h2) '
+                                   f'but {len(tables)} tables.')
+
+    # пустые таблицы пропускаются вместе с заголовками их групп
+    groups = [(header2, df) for header2, df in zip(headers2, tables) if df is not None]
+    if not groups:
+        raise ProtocolParsingError(f'No tables were found in "{protocol_file.name}".')
+    return header1, [header2 for header2, _ in groups], [df for _, df in groups]
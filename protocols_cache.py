@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+from pandas import DataFrame
+
+from app_config import ApplicationConfig
+from constants import VERSION, PROTOCOLS_CACHE_VERSION, PROTOCOLS_CACHE_DIR
+from fingerprints import get_df_hash, get_file_hash
+from rank_formula_config import RankFormulaConfig
+
+
+def get_mapping_fingerprint(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig) -> str:
+    # все, что кроме самого файла влияет на разобранный протокол: сезон и таблицы формулы ранга
+    # (маппинги участников и ранги групп применяются ко всем протоколам сезона после кэша)
+    fingerprint = hashlib.sha256()
+    for value in (VERSION, PROTOCOLS_CACHE_VERSION, application_config.season,
+                  application_config.rank_to_calculate == 'Общий зимний ранг',
+                  rank_formula_config.race_level_classifier.rules):
+        fingerprint.update(repr(value).encode())
+    for df in (rank_formula_config.race_type_df, rank_formula_config.race_level_df):
+        fingerprint.update(get_df_hash(df).encode())
+    return fingerprint.hexdigest()
+
+
+def get_protocol_key(protocol_file: Path, mapping_fingerprint: str) -> str:
+    key = hashlib.sha256()
+    for value in (protocol_file.name, get_file_hash(protocol_file), mapping_fingerprint):
+        key.update(value.encode())
+    return key.hexdigest()
+
+
+def get_cache_file(key: str, suffix: str) -> Path:
+    return Path(PROTOCOLS_CACHE_DIR) / key[:2] / '{}{}'.format(key, suffix)
+
+
+def is_protocol_cached(key: str) -> bool:
+    return get_cache_file(key, '.skip').exists() or get_cache_file(key, '.parquet').exists() or \
+        get_cache_file(key, '.pkl').exists()
+
+
+def load_protocol(key: str) -> Optional[DataFrame]:
+    if get_cache_file(key, '.skip').exists():
+        return None
+    parquet_file = get_cache_file(key, '.parquet')
+    if parquet_file.exists():
+        return pd.read_parquet(parquet_file)
+    return pd.read_pickle(get_cache_file(key, '.pkl'))
+
+
+def save_protocol(key: str, protocol: Optional[DataFrame]):
+    get_cache_file(key, '').parent.mkdir(parents=True, exist_ok=True)
+
+    # протокол не относится к сезону - запоминаем только это
+    if protocol is None:
+        get_cache_file(key, '.skip').touch()
+        return None
+
+    tmp_file = get_cache_file(key, '.tmp')
+    try:
+        protocol.to_parquet(tmp_file)
+        os.replace(tmp_file, get_cache_file(key, '.parquet'))
+    except (ImportError, ValueError, TypeError, NotImplementedError) as e:
+        # колонки со смешанными типами в parquet не сохраняются, для них используем pickle
+        logging.debug('Протокол {} сохранен в кэш в формате pickle: {}'.format(key, e))
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(protocol, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, get_cache_file(key, '.pkl'))
+
+    # возвращаем протокол в том виде, в котором он будет прочитан из кэша при следующих запусках,
+    # чтобы результаты расчета не зависели от того, был ли протокол в кэше
+    return load_protocol(key)
@@ -0,0 +1,53 @@
+import logging
+import re
+from typing import Optional
+
+import pandas as pd
+
+# колонка листа "Коэффициент уровня старта" с регулярным выражением для заголовка протокола
+RACE_LEVEL_PATTERN_COLUMN = 'Шаблон названия'
+
+# шаблоны уровней старта для конфигураторов без колонки шаблонов (или с пустой ячейкой шаблона);
+# порядок словаря - порядок их проверки, как в прежнем встроенном определении уровня
+DEFAULT_RACE_LEVEL_PATTERNS = {
+    'Чемпионат и первенство г.Петрозаводска': '.*((чемпионат)|(первенство))+.*петрозаводск.*',
+    'Чемпионат и первенство Республики Карелия': '.*((чемпионат)|(первенство))+.*карелия.*',
+    'Онежская весна': '.*онежск.*весн.*',
+    'Всероссийские соревнования': '.*всероссийские.*соревнования.*',
+    'Клубный кубок Карелии (ККК)': '.*клубн.*куб.*карели.*|.*ккк.*',
+}
+
+
+def get_race_level_rules(race_level_df: pd.DataFrame) -> list:
+    # правила: уровень старта и шаблон. Шаблоны из листа проверяются первыми в порядке строк листа, затем
+    # шаблоны по умолчанию для строк без шаблона - в порядке DEFAULT_RACE_LEVEL_PATTERNS, независимо от порядка строк
+    patterns = race_level_df[RACE_LEVEL_PATTERN_COLUMN] if RACE_LEVEL_PATTERN_COLUMN in race_level_df.columns \
+        else pd.Series(None, index=race_level_df.index, dtype=object)
+    rules = []
+    default_levels = set()
+    for level, pattern in zip(race_level_df['Уровень старта'], patterns):
+        if pattern is None or pd.isna(pattern) or not str(pattern).strip():
+            default_levels.add(level)
+        else:
+            rules.append((level, str(pattern).strip()))
+    rules.extend((level, pattern) for level, pattern in DEFAULT_RACE_LEVEL_PATTERNS.items() if level in default_levels)
+    return rules
+
+
+class RaceLevelClassifier:
+    # уровень старта по заголовку протокола: шаблоны компилируются один раз при загрузке конфигуратора,
+    # побеждает первое совпадение по порядку правил, результат запоминается для каждого заголовка
+    def __init__(self, rules: list):
+        self.rules = rules
+        self._patterns = [(level, re.compile(pattern, re.IGNORECASE)) for level, pattern in rules]
+        self._levels = {}
+
+    def classify(self, header: str) -> Optional[str]:
+        if header not in self._levels:
+            text = header.lower()
+            levels = list(dict.fromkeys(level for level, pattern in self._patterns if pattern.search(text)))
+            if len(levels) > 1:
+                logging.warning('Протокол "{}" подходит к нескольким уровням старта: {}. Выбран уровень "{}"'.format(
+                    header, ', '.join(levels), levels[0]))
+            self._levels[header] = levels[0] if levels else None
+        return self._levels[header]
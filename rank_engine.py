@@ -0,0 +1,297 @@
+import logging
+from decimal import *
+
+import numpy as np
+import pandas as pd
+
+# кол-во знаков после запятой в целочисленном движке
+INT_SCALE = 10 ** 6
+
+
+def get_decimal(s):
+    return Decimal(s)
+
+
+def get_float_values(s) -> np.ndarray:
+    return pd.Series(s).to_numpy(dtype=float)
+
+
+def divide_rounded(a, b):
+    # целочисленное деление с округлением до ближайшего (для неотрицательных значений)
+    return (2 * a + b) // (2 * b)
+
+
+def get_rounded(x):
+    return round(Decimal(x), 2)
+
+
+class RankEngine:
+    def __init__(self, engine: str = 'Decimal', parity_check: bool = False):
+        self.engine = engine
+        self.parity_check = parity_check and engine != 'Decimal'
+        self.deviations = {}
+
+    # сравнение с расчетом на Decimal при округлении до 2 знаков, как в файлах ранга ------------------------------------
+    def _check_parity(self, formula, values, decimal_values):
+        values = np.atleast_1d(np.asarray(values, dtype=object))
+        decimal_values = np.atleast_1d(np.asarray(decimal_values, dtype=object))
+        deviation = self.deviations.get(formula, Decimal(0))
+        for value, decimal_value in zip(values, decimal_values):
+            if pd.isna(value) or pd.isna(decimal_value):
+                continue
+            deviation = max(deviation, abs(get_rounded(value) - get_rounded(decimal_value)))
+        self.deviations[formula] = deviation
+
+    def log_parity_report(self):
+        if not self.parity_check:
+            return
+        logging.info('--Отклонение движка {} от расчета на Decimal (после округления до 2 знаков)'.format(self.engine))
+        for formula, deviation in self.deviations.items():
+            logging.info('{}: {}'.format(formula, deviation))
+
+    # ранг по группе ---------------------------------------------------------------------------------------------------
+    def group_rank(self, df: pd.DataFrame):
+        if self.engine == 'Decimal':
+            return self._group_rank_decimal(df)
+        if self.engine == 'float64':
+            group_rank = self._group_rank_float(df)
+        else:
+            group_rank = self._group_rank_int(df)
+        if self.parity_check:
+            self._check_parity('Ранг по группе', group_rank, self._group_rank_decimal(df))
+        return group_rank
+
+    @staticmethod
+    def _group_rank_decimal(df: pd.DataFrame):
+        return (df['Коэффициент уровня старта'].apply(get_decimal)
+                * (df['tсравнит '].apply(get_decimal) / df['result_in_seconds'].apply(get_decimal))
+                * df['Сравнит. ранг соревнований'].apply(get_decimal)
+                * (Decimal(1) - df['Коэффициент вида старта'].apply(get_decimal)
+                   * (df['Место'].apply(get_decimal) - 1) / (df['N'].apply(get_decimal) - 1)
+                   )
+                )
+
+    @staticmethod
+    def _group_rank_float(df: pd.DataFrame):
+        return (get_float_values(df['Коэффициент уровня старта'])
+                * (get_float_values(df['tсравнит ']) / get_float_values(df['result_in_seconds']))
+                * get_float_values(df['Сравнит. ранг соревнований'])
+                * (1 - get_float_values(df['Коэффициент вида старта'])
+                   * (get_float_values(df['Место']) - 1) / (get_float_values(df['N']) - 1)
+                   )
+                )
+
+    @staticmethod
+    def _group_rank_int(df: pd.DataFrame):
+        columns = ['Коэффициент уровня старта', 'tсравнит ', 'result_in_seconds', 'Сравнит. ранг соревнований',
+                   'Коэффициент вида старта', 'Место', 'N']
+        values = {col: get_float_values(df[col]) for col in columns}
+        mask = np.logical_and.reduce([~np.isnan(values[col]) for col in columns])
+        values = {col: value[mask] for col, value in values.items()}
+
+        level = np.rint(values['Коэффициент уровня старта'] * INT_SCALE).astype(np.int64)
+        comparative_time = np.rint(values['tсравнит '] * INT_SCALE).astype(np.int64)
+        result = np.rint(values['result_in_seconds']).astype(np.int64)
+        relative_rank = np.rint(values['Сравнит. ранг соревнований'] * INT_SCALE).astype(np.int64)
+        race_type = np.rint(values['Коэффициент вида старта'] * INT_SCALE).astype(np.int64)
+        place = np.rint(values['Место']).astype(np.int64) - 1
+        n = np.rint(values['N']).astype(np.int64) - 1
+
+        group_rank = divide_rounded(level * divide_rounded(comparative_time, result), INT_SCALE)
+        group_rank = divide_rounded(group_rank * relative_rank, INT_SCALE)
+        group_rank = divide_rounded(group_rank * (INT_SCALE - divide_rounded(race_type * place, n)), INT_SCALE)
+
+        group_rank_values = np.full(len(df), np.nan)
+        group_rank_values[mask] = group_rank / INT_SCALE
+        return group_rank_values
+
+    # сравнительное время: среднее лучших результатов, не превышающее результат победителя более чем на 15% -------------
+    # результаты групп идут подряд и отсортированы по возрастанию (пропуски в конце), starts - начала групп,
+    # tops - кол-во лучших результатов по каждой группе
+    def means_by_top(self, s: pd.Series, starts: np.ndarray, tops: np.ndarray):
+        if self.engine == 'Decimal':
+            return self._means_by_top_decimal(s.apply(get_decimal).to_numpy(dtype=object), starts, tops)
+        if self.engine == 'float64':
+            means = self._means_by_top_float(get_float_values(s), starts, tops)
+        else:
+            means = self._means_by_top_int(get_float_values(s), starts, tops)
+        if self.parity_check:
+            self._check_parity('tсравнит', means,
+                               self._means_by_top_decimal(s.apply(get_decimal).to_numpy(dtype=object), starts, tops))
+        return means
+
+    @staticmethod
+    def _get_heads(starts: np.ndarray, sizes: np.ndarray, top: int):
+        # позиции первых top значений каждой группы и начала этих отрезков
+        head_sizes = np.minimum(sizes, top)
+        head_starts = np.append(0, np.cumsum(head_sizes)[:-1])
+        return np.repeat(starts - head_starts, head_sizes) + np.arange(head_sizes.sum()), head_starts
+
+    @classmethod
+    def _means_by_top_decimal(cls, values: np.ndarray, starts: np.ndarray, tops: np.ndarray):
+        sizes = np.diff(np.append(starts, len(values)))
+        winners = values[starts]
+        means = np.empty(len(starts), dtype=object)
+        found = sizes == 1
+        means[found] = winners[found]
+
+        # кол-во лучших результатов уменьшается, пока среднее превышает результат победителя более чем на 15%
+        for top in range(tops.max(initial=0), 1, -1):
+            groups = np.flatnonzero(~found & (tops >= top))
+            if len(groups) == 0:
+                continue
+            heads, head_starts = cls._get_heads(starts[groups], sizes[groups], top)
+            top_means = cls._get_means_decimal(values[heads], head_starts)
+            passed = np.array([mean / winner <= 1.15 for mean, winner in zip(top_means, winners[groups])], dtype=bool)
+            means[groups[passed]] = top_means[passed]
+            found[groups[passed]] = True
+
+        for group in np.flatnonzero(~found):
+            means[group] = Decimal(winners[group]) * Decimal(1.15)
+        return means
+
+    @classmethod
+    def _means_by_top_float(cls, values: np.ndarray, starts: np.ndarray, tops: np.ndarray):
+        sizes = np.diff(np.append(starts, len(values)))
+        winners = values[starts]
+        means = np.full(len(starts), np.nan)
+        found = sizes == 1
+        means[found] = winners[found]
+
+        for top in range(tops.max(initial=0), 1, -1):
+            groups = np.flatnonzero(~found & (tops >= top))
+            if len(groups) == 0:
+                continue
+            heads, head_starts = cls._get_heads(starts[groups], sizes[groups], top)
+            counts, sums = cls._get_group_sums(values[heads], head_starts)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                top_means = sums / counts
+            # то же точное сравнение, что и в целочисленном движке: время в целых секундах, поэтому суммы
+            # точны, а ровно 115% не проходит (как и в исходной формуле)
+            passed = sums * 100 < counts * winners[groups] * 115
+            means[groups[passed]] = top_means[passed]
+            found[groups[passed]] = True
+
+        means[~found] = winners[~found] * 1.15
+        return means
+
+    @classmethod
+    def _means_by_top_int(cls, values: np.ndarray, starts: np.ndarray, tops: np.ndarray):
+        sizes = np.diff(np.append(starts, len(values)))
+        means = np.full(len(starts), np.nan)
+        found = sizes == 1
+        means[found] = values[starts][found]
+        winners = np.rint(np.where(found, 0, values[starts]) * INT_SCALE).astype(np.int64)
+
+        for top in range(tops.max(initial=0), 1, -1):
+            groups = np.flatnonzero(~found & (tops >= top))
+            if len(groups) == 0:
+                continue
+            heads, head_starts = cls._get_heads(starts[groups], sizes[groups], top)
+            counts, sums = cls._get_group_sums_int(values[heads], head_starts)
+            top_means = divide_rounded(sums, counts)
+            # 1.15 в исходной формуле - число с плавающей точкой, чуть меньшее 1.15,
+            # поэтому точное равенство 115% не проходит
+            passed = top_means * 100 < winners[groups] * 115
+            means[groups[passed]] = top_means[passed] / INT_SCALE
+            found[groups[passed]] = True
+
+        means[~found] = divide_rounded(winners[~found] * 115, 100) / INT_SCALE
+        return means
+
+    # среднее текущих рангов сильнейших участников группы, starts - начала групп --------------------------------------
+    def means(self, s: pd.Series, starts: np.ndarray):
+        if self.engine == 'Decimal':
+            return self._get_means_decimal(s.apply(get_decimal).to_numpy(dtype=object), starts)
+        if self.engine == 'float64':
+            counts, sums = self._get_group_sums(get_float_values(s), starts)
+            means = sums / counts
+        else:
+            counts, sums = self._get_group_sums_int(get_float_values(s), starts)
+            means = divide_rounded(sums, counts) / INT_SCALE
+        if self.parity_check:
+            self._check_parity('Сравнит. ранг соревнований', means,
+                               self._get_means_decimal(s.apply(get_decimal).to_numpy(dtype=object), starts))
+        return means
+
+    # доля отсутствующих стартов и % интервал отсутствующих стартов ---------------------------------------------------
+    def lack_races_share(self, races: pd.Series, races_for_rank: pd.Series):
+        if self.engine == 'Decimal':
+            return self._lack_races_share_decimal(races, races_for_rank)
+
+        # кол-во соревнований - целые числа, поэтому долю считаем точно в целочисленной арифметике
+        races_values = races.to_numpy(dtype=np.int64)
+        races_for_rank_values = races_for_rank.to_numpy(dtype=np.int64)
+        lack_races = races_for_rank_values - races_values
+        lack_races_interval = np.floor_divide(100 * lack_races, races_for_rank_values)
+        lack_races_share = np.where(lack_races > 0, lack_races_interval / 100, 0)
+        if self.parity_check:
+            decimal_share, decimal_interval = self._lack_races_share_decimal(races, races_for_rank)
+            self._check_parity('Доля отсутствующих стартов', lack_races_share, decimal_share)
+            self._check_parity('% интервал отсутствующих стартов', lack_races_interval, decimal_interval)
+        return lack_races_share, lack_races_interval
+
+    @staticmethod
+    def _lack_races_share_decimal(races: pd.Series, races_for_rank: pd.Series):
+        lack_races_share = 1 - races.apply(get_decimal) / races_for_rank.apply(get_decimal)
+        lack_races_share = np.where(lack_races_share > 0, np.floor(lack_races_share * 100) / 100, 0)
+        lack_races_interval = np.floor(100 * (1 - races.apply(get_decimal) / races_for_rank.apply(get_decimal)))
+        return lack_races_share, lack_races_interval
+
+    # текущий ранг: среднее рангов соревнований, скорректированное на штраф -------------------------------------------
+    # ранги участников идут подряд, starts - начала групп участников, penalties_lack_races - штраф по каждой группе
+    def current_ranks(self, ranks: pd.Series, starts: np.ndarray, penalties_lack_races: np.ndarray):
+        if self.engine == 'Decimal':
+            return self._current_ranks_decimal(ranks, starts, penalties_lack_races)
+
+        penalties = get_float_values(penalties_lack_races)
+        if self.engine == 'float64':
+            counts, sums = self._get_group_sums(get_float_values(ranks), starts)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                current_ranks = sums / counts * penalties
+        else:
+            counts, sums = self._get_group_sums_int(get_float_values(ranks), starts)
+            mask = (counts > 0) & ~np.isnan(penalties)
+            penalties = np.rint(penalties[mask] * INT_SCALE).astype(np.int64)
+            current_ranks = np.full(len(starts), np.nan)
+            current_ranks[mask] = divide_rounded(divide_rounded(sums[mask], counts[mask]) * penalties,
+                                                 INT_SCALE) / INT_SCALE
+        if self.parity_check:
+            self._check_parity('Текущий ранг', current_ranks,
+                               self._current_ranks_decimal(ranks.apply(get_decimal), starts, penalties_lack_races))
+        return current_ranks
+
+    @classmethod
+    def _current_ranks_decimal(cls, ranks: pd.Series, starts: np.ndarray, penalties_lack_races: np.ndarray):
+        means = cls._get_means_decimal(ranks.to_numpy(dtype=object), starts)
+        return np.array([Decimal(mean) * Decimal(penalty) for mean, penalty in zip(means, penalties_lack_races)],
+                        dtype=object)
+
+    # суммы по группам -------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _get_group_sums(values: np.ndarray, starts: np.ndarray):
+        # суммы по группам в том же порядке сложения, что и у np.nanmean по каждой группе (пропуски заменяются 0)
+        mask = np.not_equal(values, values, dtype=bool)
+        counts = np.add.reduceat((~mask).astype(np.int64), starts)
+        values = np.where(mask, 0, values)
+        if values.dtype == object:
+            # объекты (Decimal) складываются последовательно, начиная с первого элемента группы
+            sums = np.add.reduceat(values, starts)
+        else:
+            # np.sum складывает числа с плавающей точкой попарно, начиная с 0, а reduceat - начиная с первого
+            # элемента группы, поэтому перед каждой группой вставляется 0
+            sums = np.add.reduceat(np.insert(values, starts, 0), starts + np.arange(len(starts)))
+        return counts, sums
+
+    @classmethod
+    def _get_group_sums_int(cls, values: np.ndarray, starts: np.ndarray):
+        # значения в целочисленном движке, суммы целых чисел в float64 точны
+        counts, sums = cls._get_group_sums(np.rint(values * INT_SCALE), starts)
+        return counts, sums.astype(np.int64)
+
+    @classmethod
+    def _get_means_decimal(cls, values: np.ndarray, starts: np.ndarray):
+        # как np.nanmean по каждой группе: сумма делится на кол-во значений без пропусков
+        counts, sums = cls._get_group_sums(values, starts)
+        return np.array([total / int(count) if count > 0 else np.nan for count, total in zip(counts, sums)],
+                        dtype=object)
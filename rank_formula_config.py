@@ -1,10 +1,14 @@
 from decimal import *
+from typing import TYPE_CHECKING
 
 import pandas as pd
-from openpyxl import load_workbook
+
+if TYPE_CHECKING:
+    from openpyxl import Workbook
 
 # getcontext().prec = 28
 
+from race_level import RACE_LEVEL_PATTERN_COLUMN, RaceLevelClassifier, get_race_level_rules
 from constants import RANK_CONFIG_MAIN_SETTINGS_SHEET, RANK_CONFIG_RACE_TYPE_SHEET, RANK_CONFIG_RACE_LEVEL_SHEET, \
     RANK_CONFIG_GROUP_RANK_SHEET, RANK_CONFIG_PENALTY_LACK_RACES_SHEET, RANK_CONFIG_PENALTY_NOT_STARTED_SHEET, \
     RANK_CONFIG_PENALTY_LEFT_RACE_SHEET, RANK_CONFIG_FILE
@@ -15,9 +19,13 @@ def get_decimals(s):
 
 
 class RankFormulaConfig:
-    def __init__(self, excel_file: str):
+    def __init__(self, excel_file: str, workbook: 'Workbook' = None):
+        # уже открытая книга передается загрузчиком конфигураторов, чтобы не читать файл повторно
         self._excel_file = excel_file
-        self._workbook = load_workbook(self._excel_file, read_only=True, keep_vba=False)
+        if workbook is None:
+            from openpyxl import load_workbook
+            workbook = load_workbook(self._excel_file, read_only=True, keep_vba=False)
+        self._workbook = workbook
 
         self.race_percentage_for_final_rank = None
         self.race_number_to_start_apply_rules = None
@@ -32,6 +40,7 @@ class RankFormulaConfig:
         self.race_type_df: pd.DataFrame = None
         self._load_race_type_df()
         self.race_level_df: pd.DataFrame = None
+        self.race_level_classifier: RaceLevelClassifier = None
         self._load_race_level_df()
         self.group_rank_df: pd.DataFrame = None
         self._load_group_rank_df()
@@ -42,6 +51,12 @@ class RankFormulaConfig:
         self.penalty_left_race_df: pd.DataFrame = None
         self._load_penalty_left_race_df()
 
+    def __getstate__(self):
+        # книга Excel не передается в процессы обработки протоколов, все настройки из нее уже загружены
+        state = self.__dict__.copy()
+        state['_workbook'] = None
+        return state
+
     def _load_main_settings(self):
         main_settings = list(self._workbook[RANK_CONFIG_MAIN_SETTINGS_SHEET].values)
         self.race_percentage_for_final_rank = main_settings[1][1]
@@ -65,6 +80,9 @@ class RankFormulaConfig:
     def _load_race_level_df(self):
         race_levels = list(self._workbook[RANK_CONFIG_RACE_LEVEL_SHEET].values)
         self.race_level_df = pd.DataFrame(race_levels[1:], columns=race_levels[0])
+        # шаблоны уровней старта компилируются один раз, в таблице коэффициентов остаются только коэффициенты
+        self.race_level_classifier = RaceLevelClassifier(get_race_level_rules(self.race_level_df))
+        self.race_level_df = self.race_level_df.drop(columns=RACE_LEVEL_PATTERN_COLUMN, errors='ignore')
         self.race_level_df['Коэффициент уровня старта'] = self.race_level_df[
                                                                           'Коэффициент уровня старта'] * 100
         self.race_level_df['Коэффициент уровня старта'] = (self.race_level_df[
@@ -0,0 +1,139 @@
+import argparse
+import logging
+import os
+import pickle
+import re
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app_config import ApplicationConfig
+from config_loader import load_configs
+from logger import setup_logging
+from participants import PARTICIPANT_FIELDS, PARTICIPANT_ID, ParticipantRegistry
+from rank_engine import get_float_values
+
+# история текущего ранга участников: строка на участника и соревнование, после которого рассчитан ранг
+COMPETITION_NUMBER = 'Номер соревнования'
+
+
+def get_rank_history_file(application_config: ApplicationConfig, suffix: str = '.parquet') -> Path:
+    return application_config.rank_dir / 'История рангов {}_{}{}'.format(application_config.rank_to_calculate,
+                                                                         application_config.season, suffix)
+
+
+def get_rank_history_part(current_rank_df: pd.DataFrame, competition_number: int) -> pd.DataFrame:
+    # часть истории по текущему рангу после соревнования: только ID участника и числа в компактных типах
+    return pd.DataFrame({
+        PARTICIPANT_ID: current_rank_df[PARTICIPANT_ID].to_numpy(dtype=np.int64),
+        COMPETITION_NUMBER: np.full(len(current_rank_df), competition_number, dtype=np.int16),
+        'Дата текущего соревнования': current_rank_df['Дата текущего соревнования'].to_numpy(),
+        'Текущий ранг': get_float_values(current_rank_df['Текущий ранг']).astype(np.float32),
+        'Кол-во соревнований у участника': current_rank_df['Кол-во соревнований у участника'].to_numpy(np.int16),
+        'Кол-во cоревнований для текущего ранга':
+            current_rank_df['Кол-во cоревнований для текущего ранга'].to_numpy(np.int16),
+        'Штраф за отсутствующие старты':
+            get_float_values(current_rank_df['Штраф за отсутствующие старты']).astype(np.float32),
+    })
+
+
+def save_rank_history(application_config: ApplicationConfig, participant_registry: ParticipantRegistry,
+                      rank_history_df: pd.DataFrame):
+    # вся история сезона - один файл parquet (без pyarrow - pickle), поля участника добавляются только здесь
+    rank_history_df = rank_history_df[rank_history_df['Текущий ранг'].notna()]
+    rank_history_df = participant_registry.add_fields(rank_history_df.reset_index(drop=True))
+    rank_history_df['Дата текущего соревнования'] = pd.to_datetime(rank_history_df['Дата текущего соревнования'])
+
+    parquet_file = get_rank_history_file(application_config)
+    tmp_file = get_rank_history_file(application_config, '.tmp')
+    try:
+        rank_history_df.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, parquet_file)
+    except ImportError as e:
+        logging.debug('История рангов сохранена в формате pickle: {}'.format(e))
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(rank_history_df, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, get_rank_history_file(application_config, '.pkl'))
+
+
+def load_rank_history(file: Path) -> pd.DataFrame:
+    if file.suffix == '.pkl':
+        return pd.read_pickle(file)
+    return pd.read_parquet(file)
+
+
+def get_sparkline_name(participant: tuple, file_format: str) -> str:
+    name = '_'.join(str(value) for value in participant)
+    return '{}.{}'.format(re.sub(r'[\\/:*?"<>|\s]+', '_', name), file_format)
+
+
+def render_sparklines(rank_history_df: pd.DataFrame, output_dir: Path, top: Optional[int] = None,
+                      size: tuple = (1.6, 0.4), file_format: str = 'png') -> pd.DataFrame:
+    # спарклайны текущего ранга участников по соревнованиям сезона: одна фигура перерисовывается для всех
+    # участников, поэтому пакетная отрисовка не создает фигуру на каждый файл
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+
+    # участники в порядке текущего ранга после последнего соревнования (top - только первые top участников)
+    last_ranks = rank_history_df.sort_values(by=COMPETITION_NUMBER, kind='mergesort') \
+        .groupby(PARTICIPANT_FIELDS, sort=False)['Текущий ранг'].last().sort_values(ascending=False, kind='mergesort')
+    if top is not None:
+        last_ranks = last_ranks.iloc[:top]
+    histories = dict(list(rank_history_df.groupby(PARTICIPANT_FIELDS, sort=False)))
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    figure = plt.figure(figsize=size, dpi=100)
+    axes = figure.add_axes([0.02, 0.1, 0.96, 0.8])
+    axes.axis('off')
+    axes.set_xlim(rank_history_df[COMPETITION_NUMBER].min() - 0.5, rank_history_df[COMPETITION_NUMBER].max() + 0.5)
+    line, = axes.plot([], [], linewidth=1.2, color='#1F77B4')
+    last_point, = axes.plot([], [], 'o', markersize=2.5, color='#D62728')
+
+    index = []
+    for participant, rank in last_ranks.items():
+        history = histories[participant].sort_values(by=COMPETITION_NUMBER, kind='mergesort')
+        x = history[COMPETITION_NUMBER].to_numpy()
+        y = history['Текущий ранг'].to_numpy(dtype=float)
+        line.set_data(x, y)
+        last_point.set_data(x[-1:], y[-1:])
+        margin = max((y.max() - y.min()) * 0.1, 0.5)
+        axes.set_ylim(y.min() - margin, y.max() + margin)
+        name = get_sparkline_name(participant, file_format)
+        figure.savefig(output_dir / name, format=file_format, transparent=True)
+        index.append(list(participant) + [round(float(rank), 2), name])
+    plt.close(figure)
+
+    index_df = pd.DataFrame(index, columns=PARTICIPANT_FIELDS + ['Текущий ранг', 'Файл'])
+    index_df.to_csv(output_dir / 'index.csv', index=False, encoding='utf-8')
+    return index_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Спарклайны текущего ранга участников по истории рангов сезона')
+    parser.add_argument('history', type=Path, nargs='?',
+                        help='файл истории рангов (по умолчанию - файл сезона из конфигуратора приложения)')
+    parser.add_argument('--output', type=Path, help='папка для спарклайнов (по умолчанию - рядом с файлом истории)')
+    parser.add_argument('--top', type=int, help='только первые N участников по текущему рангу')
+    parser.add_argument('--size', default='1.6x0.4', help='размер спарклайна в дюймах, ШxВ (по умолчанию 1.6x0.4)')
+    parser.add_argument('--format', default='png', choices=['png', 'svg'], help='формат файлов')
+    args = parser.parse_args()
+
+    history_file = args.history
+    if history_file is None:
+        application_config, _ = load_configs()
+        history_file = get_rank_history_file(application_config)
+        if not history_file.exists():
+            history_file = get_rank_history_file(application_config, '.pkl')
+    output_dir = args.output or history_file.parent / 'Спарклайны {}'.format(history_file.stem)
+    size = tuple(float(value) for value in args.size.lower().split('x'))
+
+    index_df = render_sparklines(load_rank_history(history_file), output_dir, args.top, size, args.format)
+    logging.info('Спарклайнов: {} ({})'.format(len(index_df), output_dir))
+
+
+if __name__ == '__main__':
+    setup_logging()
+    main()
@@ -0,0 +1,299 @@
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import warnings
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pandas as pd
+
+from config_loader import load_configs
+from constants import APP_CONFIG_FILE, RANK_CONFIG_FILE
+from duplicate_detector import normalize_name
+from errors import Error, RankServiceError
+from logger import setup_logging
+from main import calculate_rank
+from participants import PARTICIPANT_FIELDS
+from prepare_protocols import collect_protocols, get_protocol_names, read_protocol
+from protocols_cache import get_mapping_fingerprint, get_protocol_key
+from rank_history import COMPETITION_NUMBER, get_rank_history_file, load_rank_history
+
+DEFAULT_PORT = 8765
+
+CONFIG_FILES = (APP_CONFIG_FILE, RANK_CONFIG_FILE)
+
+# колонки текущего ранга в ответах сервиса (как в файле текущего ранга)
+RANK_COLUMNS = PARTICIPANT_FIELDS + ['Текущий ранг', 'Итоговый ранг', 'Кол-во прошедших соревнований',
+                                     'Кол-во cоревнований для текущего ранга', 'Кол-во соревнований у участника',
+                                     'Штраф за отсутствующие старты', 'Дата текущего соревнования']
+
+
+def get_json_value(value):
+    if value is None or value is pd.NaT or value is pd.NA:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value
+    value = float(value)
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else round(value, 2)
+
+
+def get_json(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def get_file_state(file) -> tuple:
+    # файл считается измененным, если изменились время изменения или размер (без чтения содержимого)
+    try:
+        stat = os.stat(file)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class RankState:
+    # текущий ранг после последнего расчета с заранее подготовленными ответами: запросы ранга только отдают готовые
+    # байты, а поиск участника - поиск по словарю
+    def __init__(self, current_rank_df: pd.DataFrame, rank_history_df: pd.DataFrame):
+        current_rank_df = current_rank_df[current_rank_df['Текущий ранг'].notna()]
+        places_by_sex = current_rank_df.groupby('Пол', sort=False).cumcount() + 1
+        records = []
+        for place, place_by_sex, row in zip(range(1, len(current_rank_df) + 1), places_by_sex,
+                                            current_rank_df[RANK_COLUMNS].itertuples(index=False)):
+            record = {'Место': place, 'Место среди М/Ж': int(place_by_sex)}
+            record.update((column, get_json_value(value)) for column, value in zip(RANK_COLUMNS, row))
+            records.append(record)
+
+        self.rank = get_json(records)
+        self.rank_by_sex = {sex: get_json([record for record in records if record['Пол'] == sex])
+                            for sex in current_rank_df['Пол'].unique()}
+
+        histories = {}
+        for participant, history in rank_history_df.groupby(PARTICIPANT_FIELDS, sort=False):
+            histories[participant] = [
+                {'Номер соревнования': int(number), 'Дата текущего соревнования': get_json_value(current_date),
+                 'Текущий ранг': get_json_value(rank)}
+                for number, current_date, rank in history.sort_values(by=COMPETITION_NUMBER, kind='mergesort')[
+                    [COMPETITION_NUMBER, 'Дата текущего соревнования', 'Текущий ранг']].itertuples(index=False)]
+        self.athletes = {}
+        for record in records:
+            participant = tuple(record[field] for field in PARTICIPANT_FIELDS)
+            key = (normalize_name(record['Фамилия']), normalize_name(record['Имя']))
+            self.athletes.setdefault(key, []).append(dict(record, **{'История': histories.get(participant, [])}))
+        self.participants = len(records)
+
+
+class RankService:
+    # сервис держит в памяти конфигураторы, разобранные протоколы (по ключу файла протокола) и текущий ранг;
+    # пересчет разбирает только новые или измененные протоколы и продолжает расчет из контрольной точки
+    def __init__(self):
+        self._protocols = {}
+        self._lock = threading.Lock()
+        self._load_configs()
+        self.state = RankState(pd.DataFrame(columns=RANK_COLUMNS), pd.DataFrame(columns=PARTICIPANT_FIELDS))
+
+    def _load_configs(self):
+        # разобранные протоколы остаются в памяти: ключ протокола не зависит от маппингов участников, поэтому
+        # заново разбираются только протоколы, на которые влияют измененные настройки
+        config_state = [get_file_state(config_file) for config_file in CONFIG_FILES]
+        self.application_config, self.rank_formula_config = load_configs()
+        self.application_config.incremental_calculation = 'да'
+        self._config_state = config_state
+
+    def reload_configs(self) -> dict:
+        with self._lock:
+            self._load_configs()
+        logging.info('Конфигураторы перечитаны')
+        return {'Ранг': self.application_config.rank_to_calculate, 'Сезон': self.application_config.season}
+
+    def _read_protocols(self, names: list) -> list:
+        mapping_fingerprint = get_mapping_fingerprint(self.application_config, self.rank_formula_config)
+        cache_fingerprint = mapping_fingerprint if self.application_config.protocols_cache == 'да' else None
+        protocols = {}
+        keys = []
+        for name in names:
+            key = get_protocol_key(self.application_config.protocols_dir / name, mapping_fingerprint)
+            if key not in protocols:
+                protocols[key] = self._protocols[key] if key in self._protocols else read_protocol(
+                    self.application_config, self.rank_formula_config, name, cache_fingerprint)
+            keys.append(key)
+        # удаленные и измененные протоколы больше не держим в памяти
+        self._protocols = protocols
+        return [protocols[key] for key in keys]
+
+    def recompute(self) -> dict:
+        with self._lock:
+            start = time.perf_counter()
+            # конфигураторы, сохраненные после последней загрузки, перечитываются перед пересчетом
+            if [get_file_state(config_file) for config_file in CONFIG_FILES] != self._config_state:
+                logging.info('--Конфигураторы изменены')
+                self._load_configs()
+            logging.info('--Обработка протоколов')
+            names = get_protocol_names(self.application_config)
+            protocols = collect_protocols(self.application_config, self.rank_formula_config, names,
+                                          self._read_protocols(names))
+            if len(protocols[0].columns) == 0:
+                raise RankServiceError('There are no protocols of season {} in "{}".'.format(
+                    self.application_config.season, self.application_config.protocols_dir))
+            current_rank_df = calculate_rank(self.application_config, self.rank_formula_config, protocols)
+
+            history_file = get_rank_history_file(self.application_config)
+            if not history_file.exists():
+                history_file = get_rank_history_file(self.application_config, '.pkl')
+            rank_history_df = load_rank_history(history_file) if history_file.exists() else \
+                pd.DataFrame(columns=PARTICIPANT_FIELDS)
+            self.state = RankState(current_rank_df, rank_history_df)
+            seconds = time.perf_counter() - start
+            logging.info('Пересчет ранга: {:.2f} с'.format(seconds))
+            return {'Соревнований': int(protocols[0]['Файл протокола'].nunique()),
+                    'Участников': self.state.participants, 'Время расчета, с': round(seconds, 3)}
+
+    def add_protocol(self, name: str, write):
+        # протокол записывается во временный файл и переименовывается, чтобы пересчет не прочитал его частично
+        if not name or Path(name).name != name or name.startswith('.'):
+            raise RankServiceError('Invalid protocol file name "{}".'.format(name))
+        protocol_file = self.application_config.protocols_dir / name
+        tmp_file = self.application_config.protocols_dir / '.{}.tmp'.format(name)
+        with self._lock:
+            write(tmp_file)
+            os.replace(tmp_file, protocol_file)
+        logging.info('Добавлен протокол {}'.format(name))
+        return {'Протокол': name}
+
+    def get_athlete(self, query: dict) -> bytes:
+        last_name, first_name = query.get('last_name', [''])[0], query.get('first_name', [''])[0]
+        if not last_name or not first_name:
+            raise RankServiceError('Parameters last_name and first_name are required.')
+        athletes = self.state.athletes.get((normalize_name(last_name), normalize_name(first_name)), [])
+        if 'year' in query:
+            athletes = [athlete for athlete in athletes if str(athlete['Г.р.']) == query['year'][0]]
+        return get_json(athletes)
+
+
+class RankRequestHandler(BaseHTTPRequestHandler):
+    # GET /rank[?sex=М|Ж], GET /athlete?last_name=...&first_name=...[&year=...], GET /status,
+    # PUT /protocols/<файл> (тело - файл протокола), POST /protocols {"path": "..."} (протокол с диска),
+    # POST /recompute - пересчет ранга с новыми протоколами (и измененными конфигураторами),
+    # POST /reload - перечитать конфигураторы без пересчета
+    server_version = 'RankService'
+
+    @property
+    def service(self) -> RankService:
+        return self.server.service
+
+    def _send(self, status: HTTPStatus, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _handle(self, route):
+        try:
+            status, body = route(urlparse(self.path))
+        except RankServiceError as e:
+            status, body = HTTPStatus.BAD_REQUEST, get_json({'error': str(e)})
+        except Error as e:
+            logging.error(e)
+            status, body = HTTPStatus.INTERNAL_SERVER_ERROR, get_json({'error': str(e)})
+        except Exception as e:
+            # непредвиденная ошибка (например, при разборе недописанного протокола) не должна оставлять запрос
+            # без ответа
+            logging.exception(e)
+            status, body = HTTPStatus.INTERNAL_SERVER_ERROR, get_json({'error': '{}: {}'.format(type(e).__name__, e)})
+        self._send(status, body)
+
+    def _get(self, url) -> tuple:
+        query = parse_qs(url.query)
+        if url.path == '/rank':
+            if 'sex' in query:
+                return HTTPStatus.OK, self.service.state.rank_by_sex.get(query['sex'][0].upper(), b'[]')
+            return HTTPStatus.OK, self.service.state.rank
+        if url.path == '/athlete':
+            return HTTPStatus.OK, self.service.get_athlete(query)
+        if url.path == '/status':
+            return HTTPStatus.OK, get_json({'Ранг': self.service.application_config.rank_to_calculate,
+                                            'Сезон': self.service.application_config.season,
+                                            'Участников': self.service.state.participants})
+        return HTTPStatus.NOT_FOUND, get_json({'error': 'Not found'})
+
+    def _put(self, url) -> tuple:
+        if not url.path.startswith('/protocols/'):
+            return HTTPStatus.NOT_FOUND, get_json({'error': 'Not found'})
+        body = self._read_body()
+        return HTTPStatus.CREATED, get_json(self.service.add_protocol(
+            unquote(url.path[len('/protocols/'):]), lambda file: file.write_bytes(body)))
+
+    def _post(self, url) -> tuple:
+        if url.path == '/recompute':
+            return HTTPStatus.OK, get_json(self.service.recompute())
+        if url.path == '/reload':
+            return HTTPStatus.OK, get_json(self.service.reload_configs())
+        if url.path == '/protocols':
+            try:
+                source = Path(json.loads(self._read_body() or b'{}')['path'])
+            except (ValueError, KeyError, TypeError):
+                raise RankServiceError('Body must be JSON with the protocol "path".')
+            if not source.is_file():
+                raise RankServiceError('Protocol file "{}" was not found.'.format(source))
+            return HTTPStatus.CREATED, get_json(self.service.add_protocol(
+                source.name, lambda file: shutil.copyfile(source, file)))
+        return HTTPStatus.NOT_FOUND, get_json({'error': 'Not found'})
+
+    def do_GET(self):
+        self._handle(self._get)
+
+    def do_PUT(self):
+        self._handle(self._put)
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - ' + format, self.address_string(), *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальный сервис текущего ранга (HTTP/JSON)')
+    parser.add_argument('--host', default='127.0.0.1', help='адрес (по умолчанию 127.0.0.1 - только локально)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='порт (по умолчанию {})'.format(DEFAULT_PORT))
+    args = parser.parse_args()
+
+    service = RankService()
+    logging.info(service.application_config.rank_to_calculate)
+    service.recompute()
+
+    server = ThreadingHTTPServer((args.host, args.port), RankRequestHandler)
+    server.service = service
+    logging.info('Сервис ранга: http://{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    setup_logging()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            main()
+    except Error as e:
+        logging.error(e)
@@ -5,6 +5,41 @@ from decimal import *
 from datetime import datetime
 
 from app_config import ApplicationConfig
+from output_writer import output_writer
+
+# заливка строк совмещенного ранга (pink и lightblue), шрифт не меняется
+FEMALE_FILL = ('FFC0CB', None)
+MALE_FILL = ('ADD8E6', None)
+
+
+def get_empty_styles(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame(np.full(df.shape, None, dtype=object), index=df.index, columns=df.columns)
+
+
+def get_relative_luminance(rgba) -> float:
+    # относительная яркость цвета по W3C, как в pandas
+    r, g, b = (x / 12.92 if x <= 0.04045 else ((x + 0.055) / 1.055) ** 2.4 for x in rgba[:3])
+    return 0.2126 * r + 0.7152 * g + 0.0722 * b
+
+
+def get_gradient_styles(df: pd.DataFrame, columns: list, cmap: str) -> pd.DataFrame:
+    # раскраска колонок градиентом так же, как Styler.background_gradient: шкала цветов по каждой колонке
+    # от минимума до максимума, на темной заливке - светлый шрифт. Styler не используется, так как он импортирует
+    # matplotlib.pyplot и jinja2, что заметно замедляет запуск программы
+    import matplotlib
+    from matplotlib import colors
+
+    styles = get_empty_styles(df)
+    if len(df) == 0:
+        return styles
+    colormap = matplotlib.colormaps[cmap]
+    for column in columns:
+        gmap = df[column].to_numpy(dtype=float)
+        norm = colors.Normalize(np.nanmin(gmap), np.nanmax(gmap))
+        styles[column] = [(colors.rgb2hex(rgba)[1:].upper(),
+                           'F1F1F1' if get_relative_luminance(rgba) < 0.408 else '000000')
+                          for rgba in colormap(norm(gmap))]
+    return styles
 
 
 def save_current_rank(application_config: ApplicationConfig, current_rank_df: pd.DataFrame):
@@ -47,18 +82,13 @@ def save_current_rank(application_config: ApplicationConfig, current_rank_df: pd
 
 
     # Совмещенный ранг спортсменов (М+Ж)
-    def highlight_col(x):
-        df = x.copy()
-        female_mask = df['Пол'] == 'Ж'
-        df.loc[female_mask, :] = 'background-color: pink'
-        df.loc[~female_mask, :] = 'background-color: lightblue'
-        return df
-
-    current_rank_df_mix = current_rank_df.copy()
-    current_rank_df_mix = current_rank_df_mix.style.apply(highlight_col, axis=None,
-                                                          subset=['Участник', 'Г.р.', 'Пол', rank_name])
-    current_rank_df_mix.to_excel(
-        application_config.rank_dir / (rank_name + " цветной_{}.xlsx".format(application_config.season)))
+    styles = get_empty_styles(current_rank_df)
+    row_styles = [FEMALE_FILL if female else MALE_FILL for female in current_rank_df['Пол'] == 'Ж']
+    for column in ['Участник', 'Г.р.', 'Пол', rank_name]:
+        styles[column] = row_styles
+    output_writer.write(
+        application_config.rank_dir / (rank_name + " цветной_{}.xlsx".format(application_config.season)),
+        current_rank_df, styles=styles)
 
 
     # Ранги спортсменов отдельно: Мужчины, Женщины
@@ -67,10 +97,10 @@ def save_current_rank(application_config: ApplicationConfig, current_rank_df: pd
         current_rank_df_gender.index += 1
         current_rank_df_gender.index.name = '№'
         current_rank_df_gender.drop(labels='Пол', axis=1, inplace=True)
-        current_rank_df_gender = current_rank_df_gender.style.background_gradient(cmap=application_config.rank_color,
-                                                                          subset=fields_to_highlight)
-        current_rank_df_gender.to_excel(
-            application_config.rank_dir / (rank_name + " " + gender +"_{}.xlsx".format(application_config.season)))
+        output_writer.write(
+            application_config.rank_dir / (rank_name + " " + gender +"_{}.xlsx".format(application_config.season)),
+            current_rank_df_gender,
+            styles=get_gradient_styles(current_rank_df_gender, fields_to_highlight, application_config.rank_color))
         pass
 
 
@@ -78,9 +108,9 @@ def save_current_rank(application_config: ApplicationConfig, current_rank_df: pd
     format_and_save_rank(current_rank_df[current_rank_df['Пол'] == 'Ж'].copy(), 'женщины')
 
     # Совмещенный ранг спортсменов (М+Ж) БЕЗ раскраски
-    current_rank_df = current_rank_df.style.background_gradient(cmap=application_config.rank_color,
-                                                                subset=fields_to_highlight)
-    current_rank_df.to_excel(application_config.rank_dir / (rank_name + "_{}.xlsx".format(application_config.season)))
+    output_writer.write(application_config.rank_dir / (rank_name + "_{}.xlsx".format(application_config.season)),
+                        current_rank_df,
+                        styles=get_gradient_styles(current_rank_df, fields_to_highlight, application_config.rank_color))
 
     pass
 
@@ -94,6 +124,6 @@ def transform_and_save_not_started_and_left_race(application_config, left_races_
     df_not_started.sort_values(by='Кол-во стартов', ascending=False, inplace=True)
     today = datetime.date(datetime.now())
     rank_name = 'Не стартовавшие {} на '.format(application_config.rank_to_calculate) + str(today)
-    df_not_started.to_excel(application_config.rank_dir / (rank_name + "_{}.xlsx".format(application_config.season)),
-                            index=False)
+    output_writer.write(application_config.rank_dir / (rank_name + "_{}.xlsx".format(application_config.season)),
+                        df_not_started, index=False)
     pass
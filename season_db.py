@@ -0,0 +1,272 @@
+import math
+import sqlite3
+from contextlib import closing
+from datetime import datetime, time
+from decimal import Decimal
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from app_config import ApplicationConfig
+from participants import PARTICIPANT_FIELDS
+
+# таблицы базы сезона: соревнования, участники, строки протоколов (финишировавшие, снятые, не стартовавшие),
+# ранги соревнований и текущий ранг после каждого соревнования. Колонки рангов без объявленного типа хранят
+# значение как есть: Decimal - строкой (без потери точности), float - числом; при чтении текущего ранга строки
+# снова становятся Decimal. Представление participant_history (история рангов участника по соревнованиям)
+# приводит ранги к числам для запросов
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS competitions (
+    competition_id INTEGER PRIMARY KEY,
+    protocol_file TEXT NOT NULL UNIQUE,
+    name TEXT,
+    competition_date DATE,
+    race_type TEXT,
+    race_type_coefficient,
+    race_level TEXT,
+    race_level_coefficient,
+    competition_number INTEGER,
+    rank_fingerprint TEXT
+);
+CREATE TABLE IF NOT EXISTS participants (
+    participant_id INTEGER PRIMARY KEY,
+    last_name TEXT NOT NULL,
+    first_name TEXT NOT NULL,
+    year_of_birth INTEGER NOT NULL,
+    sex TEXT NOT NULL,
+    UNIQUE (last_name, first_name, year_of_birth, sex)
+);
+CREATE TABLE IF NOT EXISTS protocol_rows (
+    competition_id INTEGER NOT NULL REFERENCES competitions ON DELETE CASCADE,
+    participant_id INTEGER REFERENCES participants,
+    age_group TEXT,
+    group_rank,
+    bib,
+    team TEXT,
+    place INTEGER,
+    result TEXT,
+    result_in_seconds INTEGER,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS protocol_rows_participant ON protocol_rows (participant_id, competition_id);
+CREATE INDEX IF NOT EXISTS protocol_rows_competition ON protocol_rows (competition_id);
+CREATE TABLE IF NOT EXISTS competition_ranks (
+    competition_id INTEGER NOT NULL REFERENCES competitions ON DELETE CASCADE,
+    participant_id INTEGER REFERENCES participants,
+    age_group TEXT,
+    left_race INTEGER NOT NULL,
+    relative_rank,
+    group_rank,
+    rank
+);
+CREATE INDEX IF NOT EXISTS competition_ranks_participant ON competition_ranks (participant_id, competition_id);
+CREATE INDEX IF NOT EXISTS competition_ranks_competition ON competition_ranks (competition_id);
+CREATE TABLE IF NOT EXISTS current_ranks (
+    competition_id INTEGER NOT NULL REFERENCES competitions ON DELETE CASCADE,
+    participant_id INTEGER NOT NULL REFERENCES participants,
+    position INTEGER NOT NULL,
+    current_rank,
+    final_rank,
+    races_for_current_rank,
+    races_passed,
+    participant_races,
+    lack_races_share,
+    lack_races_interval,
+    lack_races_penalty,
+    current_race_date DATE,
+    PRIMARY KEY (competition_id, participant_id)
+);
+CREATE INDEX IF NOT EXISTS current_ranks_participant ON current_ranks (participant_id, competition_id);
+CREATE VIEW IF NOT EXISTS current_rank_view AS
+SELECT c.protocol_file, r.position, p.last_name AS "Фамилия", p.first_name AS "Имя", p.year_of_birth AS "Г.р.",
+       p.sex AS "Пол", r.current_rank AS "Текущий ранг", r.final_rank AS "Итоговый ранг",
+       r.races_for_current_rank AS "Кол-во cоревнований для текущего ранга",
+       r.races_passed AS "Кол-во прошедших соревнований",
+       r.participant_races AS "Кол-во соревнований у участника",
+       r.lack_races_share AS "Доля отсутствующих стартов",
+       r.lack_races_interval AS "% интервал отсутствующих стартов",
+       r.lack_races_penalty AS "Штраф за отсутствующие старты",
+       r.current_race_date AS "Дата текущего соревнования"
+FROM current_ranks r
+JOIN competitions c USING (competition_id)
+JOIN participants p USING (participant_id);
+CREATE VIEW IF NOT EXISTS participant_history AS
+SELECT p.participant_id, p.last_name, p.first_name, p.year_of_birth, p.sex,
+       c.competition_number, c.protocol_file, c.name, c.competition_date,
+       (SELECT max(CAST(k.rank AS REAL)) FROM competition_ranks k
+        WHERE k.competition_id = c.competition_id AND k.participant_id = p.participant_id) AS competition_rank,
+       r.position, CAST(r.current_rank AS REAL) AS current_rank, CAST(r.final_rank AS REAL) AS final_rank
+FROM current_ranks r
+JOIN competitions c USING (competition_id)
+JOIN participants p USING (participant_id);
+'''
+
+CURRENT_RANK_COLUMNS = {
+    'Текущий ранг': 'current_rank',
+    'Итоговый ранг': 'final_rank',
+    'Кол-во cоревнований для текущего ранга': 'races_for_current_rank',
+    'Кол-во прошедших соревнований': 'races_passed',
+    'Кол-во соревнований у участника': 'participant_races',
+    'Доля отсутствующих стартов': 'lack_races_share',
+    '% интервал отсутствующих стартов': 'lack_races_interval',
+    'Штраф за отсутствующие старты': 'lack_races_penalty',
+    'Дата текущего соревнования': 'current_race_date',
+}
+
+# колонки текущего ранга, которые при расчете с Decimal содержат Decimal (в базе - строкой)
+DECIMAL_COLUMNS = ['Текущий ранг', 'Итоговый ранг', 'Штраф за отсутствующие старты']
+
+
+def get_db_value(value):
+    # значение ячейки таблицы для SQLite: пропуски - NULL, Decimal и время - строкой, числа NumPy - числами Python
+    if value is None or value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value) or isinstance(value, Decimal) and value.is_nan():
+        return None
+    if isinstance(value, (Decimal, time)):
+        return str(value)
+    if isinstance(value, pd.Timestamp):
+        return value.date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def get_frame_value(value, decimal: bool):
+    # значение из SQLite для таблицы: NULL - пропуск, строка колонки Decimal - Decimal
+    if value is None:
+        return np.nan
+    if decimal and isinstance(value, str):
+        return Decimal(value)
+    return value
+
+
+def get_db_rows(df: pd.DataFrame, columns: list) -> list:
+    return [tuple(get_db_value(value) for value in row) for row in df.reindex(columns=columns).itertuples(index=False)]
+
+
+class SeasonDatabase:
+    # база сезона SQLite (настройка "База данных сезона"): протоколы записываются при обработке протоколов,
+    # ранги соревнований и текущий ранг - после расчета каждого соревнования, каждый раз одной транзакцией.
+    # Файлы текущего ранга по соревнованиям формируются запросом к представлению current_rank_view
+    def __init__(self, application_config: ApplicationConfig):
+        self.file = application_config.rank_dir / 'База сезона {}_{}.sqlite'.format(
+            application_config.rank_to_calculate, application_config.season)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.file, detect_types=sqlite3.PARSE_DECLTYPES)
+        connection.execute('PRAGMA foreign_keys = ON')
+        connection.executescript(SCHEMA)
+        return connection
+
+    @staticmethod
+    def _get_participant_ids(connection: sqlite3.Connection, df: pd.DataFrame) -> list:
+        # ID участников базы (участники, которых еще нет в базе, добавляются); без фамилии, имени или пола - NULL
+        keys = []
+        for last_name, first_name, year_of_birth, sex in df[PARTICIPANT_FIELDS].itertuples(index=False):
+            if any(pd.isna(value) for value in (last_name, first_name, sex)):
+                keys.append(None)
+            else:
+                year_of_birth = 0 if pd.isna(year_of_birth) else int(year_of_birth)
+                keys.append((str(last_name), str(first_name), year_of_birth, str(sex)))
+        connection.executemany(
+            'INSERT OR IGNORE INTO participants (last_name, first_name, year_of_birth, sex) VALUES (?, ?, ?, ?)',
+            sorted({key for key in keys if key is not None}))
+        ids = {tuple(row[1:]): row[0] for row in connection.execute(
+            'SELECT participant_id, last_name, first_name, year_of_birth, sex FROM participants')}
+        return [ids.get(key) for key in keys]
+
+    @staticmethod
+    def _get_competition_ids(connection: sqlite3.Connection) -> dict:
+        return dict(connection.execute('SELECT protocol_file, competition_id FROM competitions'))
+
+    def save_protocols(self, protocols_df: pd.DataFrame, df_not_started: pd.DataFrame, df_left_race: pd.DataFrame):
+        # протоколы сезона заменяют сохраненные ранее; соревнования, которых больше нет в папке протоколов,
+        # удаляются вместе с их рангами
+        parts = [(protocols_df, 'финишировал'), (df_left_race, 'снят'), (df_not_started, 'не стартовал')]
+        parts = [(df, status) for df, status in parts if len(df.columns) > 0]
+        competitions_df = pd.concat([df for df, _ in parts]).drop_duplicates(subset='Файл протокола')
+
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                'INSERT INTO competitions (protocol_file, name, competition_date, race_type, race_type_coefficient, '
+                'race_level, race_level_coefficient) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (protocol_file) DO UPDATE SET name = excluded.name, '
+                'competition_date = excluded.competition_date, race_type = excluded.race_type, '
+                'race_type_coefficient = excluded.race_type_coefficient, race_level = excluded.race_level, '
+                'race_level_coefficient = excluded.race_level_coefficient',
+                get_db_rows(competitions_df, ['Файл протокола', 'Соревнование', 'Дата соревнования', 'Вид старта',
+                                              'Коэффициент вида старта', 'Уровень старта',
+                                              'Коэффициент уровня старта']))
+            competition_ids = self._get_competition_ids(connection)
+            stale = set(competition_ids) - set(competitions_df['Файл протокола'])
+            connection.executemany('DELETE FROM competitions WHERE protocol_file = ?', [(name,) for name in stale])
+
+            connection.execute('DELETE FROM protocol_rows')
+            for df, status in parts:
+                participant_ids = self._get_participant_ids(connection, df)
+                rows = get_db_rows(df, ['Возрастная группа', 'Ранг группы', 'Номер', 'Команда', 'Место', 'Результат',
+                                        'result_in_seconds'])
+                connection.executemany(
+                    'INSERT INTO protocol_rows (competition_id, participant_id, age_group, group_rank, bib, team, '
+                    'place, result, result_in_seconds, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(competition_ids[name], participant_id) + row + (status,)
+                     for name, participant_id, row in zip(df['Файл протокола'], participant_ids, rows)])
+
+    def get_saved_competitions_count(self, competitions: list, fingerprints: list) -> int:
+        # кол-во первых соревнований, ранги которых сохранены в базе с тем же отпечатком контрольной точки
+        if not self.file.exists():
+            return 0
+        with closing(self._connect()) as connection:
+            saved = dict(connection.execute('SELECT protocol_file, rank_fingerprint FROM competitions'))
+        count = 0
+        for competition, fingerprint in zip(competitions, fingerprints):
+            if saved.get(competition) != fingerprint:
+                break
+            count += 1
+        return count
+
+    def save_competition_rank(self, competition: str, competition_number: int, fingerprint: Optional[str],
+                              protocol_df: pd.DataFrame, current_rank_df: pd.DataFrame):
+        # ранги соревнования и текущий ранг после него (строки в порядке файла текущего ранга)
+        with closing(self._connect()) as connection, connection:
+            competition_id = self._get_competition_ids(connection)[competition]
+            connection.execute('UPDATE competitions SET competition_number = ?, rank_fingerprint = ? '
+                               'WHERE competition_id = ?', (competition_number, fingerprint, competition_id))
+
+            connection.execute('DELETE FROM competition_ranks WHERE competition_id = ?', (competition_id,))
+            participant_ids = self._get_participant_ids(connection, protocol_df)
+            rows = get_db_rows(protocol_df, ['Возрастная группа', 'Сравнит. ранг соревнований', 'Ранг по группе',
+                                             'Ранг'])
+            connection.executemany(
+                'INSERT INTO competition_ranks (competition_id, participant_id, age_group, left_race, relative_rank, '
+                'group_rank, rank) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(competition_id, participant_id, row[0], int(left_race == 'yes')) + row[1:]
+                 for participant_id, left_race, row in zip(participant_ids, protocol_df['left_race'], rows)])
+
+            connection.execute('DELETE FROM current_ranks WHERE competition_id = ?', (competition_id,))
+            participant_ids = self._get_participant_ids(connection, current_rank_df)
+            rows = get_db_rows(current_rank_df, list(CURRENT_RANK_COLUMNS))
+            connection.executemany(
+                'INSERT INTO current_ranks (competition_id, participant_id, position, {}) VALUES (?, ?, ?, {})'
+                .format(', '.join(CURRENT_RANK_COLUMNS.values()), ', '.join('?' * len(CURRENT_RANK_COLUMNS))),
+                [(competition_id, participant_id, int(position)) + row
+                 for participant_id, position, row in zip(participant_ids, current_rank_df.index, rows)])
+
+    def get_current_rank(self, competition: str) -> pd.DataFrame:
+        # текущий ранг после соревнования в виде файла текущего ранга, с теми же типами значений, что и при расчете:
+        # колонка из чисел (и пропусков) - float64, колонка с Decimal - object
+        columns = PARTICIPANT_FIELDS + list(CURRENT_RANK_COLUMNS)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                'SELECT position, {} FROM current_rank_view WHERE protocol_file = ? ORDER BY position'
+                .format(', '.join('"{}"'.format(column) for column in columns)), (competition,)).fetchall()
+        df = pd.DataFrame.from_records([row[1:] for row in rows], columns=columns)
+        for column in CURRENT_RANK_COLUMNS:
+            decimal = column in DECIMAL_COLUMNS
+            df[column] = pd.Series([get_frame_value(value, decimal) for value in df[column]], index=df.index)
+        df.index = [row[0] for row in rows]
+        return df
@@ -0,0 +1,68 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# начальная емкость колонок SeasonTable (в строках)
+SEASON_TABLE_CAPACITY = 1024
+
+
+class SeasonStore:
+    # накопитель таблиц сезона: протоколы добавляются частями без копирования уже накопленного
+    # (как при DataFrame.append в цикле), а объединение выполняется один раз в finalize()
+    def __init__(self, df: Optional[pd.DataFrame] = None, ignore_index: bool = False):
+        self._chunks = [] if df is None else [df]
+        self._ignore_index = ignore_index
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def append(self, df: pd.DataFrame):
+        self._chunks.append(df)
+
+    def finalize(self) -> pd.DataFrame:
+        # объединенная таблица сохраняется как единственная часть, поэтому повторный вызов ничего не копирует
+        if not self._chunks:
+            return pd.DataFrame()
+        if len(self._chunks) > 1:
+            self._chunks = [pd.concat(self._chunks, ignore_index=self._ignore_index)]
+        return self._chunks[0]
+
+
+class SeasonTable:
+    # таблица сезона, которая нужна целиком после каждого добавления (ранги соревнований в цикле расчета):
+    # колонки хранятся в массивах с запасом емкости (при нехватке емкость удваивается), поэтому добавление копирует
+    # только новые строки, а table() строит таблицу поверх накопленной части массивов без копирования
+    def __init__(self, df: Optional[pd.DataFrame] = None):
+        self._columns = {}
+        self._size = 0
+        if df is not None:
+            self.append(df)
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        # в контрольную точку сохраняется только заполненная часть колонок
+        return {'_columns': {column: values[:self._size] for column, values in self._columns.items()},
+                '_size': self._size}
+
+    def append(self, df: pd.DataFrame):
+        if not self._columns:
+            self._columns = {column: np.empty(max(len(df), SEASON_TABLE_CAPACITY), dtype=df[column].to_numpy().dtype)
+                             for column in df.columns}
+        size = self._size + len(df)
+        capacity = len(next(iter(self._columns.values()), []))
+        if size > capacity:
+            capacity = max(size, capacity * 2)
+            for column, values in self._columns.items():
+                grown = np.empty(capacity, dtype=values.dtype)
+                grown[:self._size] = values[:self._size]
+                self._columns[column] = grown
+        for column, values in self._columns.items():
+            values[self._size:size] = df[column].to_numpy(dtype=values.dtype)
+        self._size = size
+
+    def table(self) -> pd.DataFrame:
+        # таблица только читается: новые колонки добавляются к ней без изменения накопленных массивов
+        return pd.DataFrame({column: values[:self._size] for column, values in self._columns.items()}, copy=False)
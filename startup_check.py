@@ -0,0 +1,62 @@
+import argparse
+import logging
+import subprocess
+import sys
+from pathlib import Path
+
+from logger import setup_logging
+
+# библиотеки, которые загружаются только там, где они нужны: загрузка протоколов по ссылкам (requests),
+# разбор HTML (lxml), чтение и запись Excel (openpyxl), раскраска рангов (matplotlib)
+LAZY_MODULES = ['requests', 'urllib3', 'lxml', 'bs4', 'openpyxl', 'matplotlib', 'jinja2', 'scipy']
+DEFAULT_BUDGET = 1.0
+
+
+def measure_import(module: str) -> tuple[float, set]:
+    # время импорта модуля в новом процессе по -X importtime и список загруженных при этом модулей верхнего уровня
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                            cwd=Path(__file__).parent, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('Could not import {}:\n{}'.format(module, result.stderr))
+
+    seconds = None
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        modules.add(name.strip().split('.')[0])
+        if name.strip() == module:
+            seconds = int(cumulative) / 10 ** 6
+    return seconds, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Проверка времени запуска программы перед сборкой')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='допустимое время импорта main, с (по умолчанию {})'.format(DEFAULT_BUDGET))
+    parser.add_argument('--repeat', type=int, default=5, help='кол-во замеров, берется лучший')
+    args = parser.parse_args()
+
+    # первый запуск может компилировать байт-код, поэтому берется лучшее время из нескольких замеров
+    measures = [measure_import('main') for _ in range(args.repeat)]
+    seconds = min(seconds for seconds, _ in measures)
+    lazy_modules = sorted(set(LAZY_MODULES) & set.union(*(modules for _, modules in measures)))
+
+    logging.info('Время импорта main: {:.3f} с (допустимо {:.3f} с)'.format(seconds, args.budget))
+    errors = []
+    if lazy_modules:
+        errors.append('При запуске загружаются библиотеки, которые должны загружаться по требованию: ' +
+                      ', '.join(lazy_modules))
+    if seconds > args.budget:
+        errors.append('Время запуска превышает допустимое: {:.3f} с > {:.3f} с'.format(seconds, args.budget))
+    for error in errors:
+        logging.error(error)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    setup_logging()
+    sys.exit(main())
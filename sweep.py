@@ -0,0 +1,255 @@
+import argparse
+import copy
+import itertools
+import logging
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from app_config import ApplicationConfig
+from config_loader import load_configs
+from errors import Error, SweepConfigError
+from logger import setup_logging, setup_process_logging, start_log_listener
+from main import calculate_current_rank, get_previous_year_final_rank, get_race_numbers
+from output_writer import output_writer
+from participants import PARTICIPANT_FIELDS
+from prepare_protocols import prepare_protocols
+from rank_engine import RankEngine, get_float_values
+from rank_formula_config import RankFormulaConfig, get_decimals
+
+BASELINE = 'Базовый'
+
+# параметры листа "Общие настройки", которые можно менять в вариантах
+SCALAR_PARAMETERS = ('race_percentage_for_final_rank', 'race_number_to_start_apply_rules',
+                     'race_number_to_start_apply_rules_forest_rank', 'race_number_to_start_apply_rules_sprint_rank',
+                     'race_number_to_start_apply_relative_rank', 'race_number_to_start_apply_relative_rank_forest',
+                     'race_number_to_start_apply_relative_rank_sprint', 'race_percentage_to_reset_final_rank')
+
+# таблицы формулы ранга: колонка строки (ключ в варианте) и колонка значения
+TABLE_PARAMETERS = {'race_type_df': ('Вид старта', 'Коэффициент вида старта'),
+                    'race_level_df': ('Уровень старта', 'Коэффициент уровня старта'),
+                    'group_rank_df': ('Возрастная группа', 'Ранг группы'),
+                    'penalty_lack_races_df': ('% интервал отсутствующих стартов', 'Штраф за отсутствующие старты')}
+
+
+def get_overrides(parameters: dict) -> list:
+    # изменения формулы ранга: (параметр, строка таблицы или None, значение)
+    overrides = []
+    for parameter, value in parameters.items():
+        if parameter in SCALAR_PARAMETERS:
+            overrides.append((parameter, None, value))
+        elif parameter in TABLE_PARAMETERS:
+            if not isinstance(value, dict):
+                raise SweepConfigError(f'Parameter "{parameter}" must map table rows to values.')
+            overrides.extend((parameter, str(row), row_value) for row, row_value in value.items())
+        else:
+            raise SweepConfigError(f'Unknown rank formula parameter: "{parameter}".')
+    return overrides
+
+
+def get_variant_name(overrides: list) -> str:
+    return ', '.join('{}={}'.format(parameter if row is None else '{}[{}]'.format(parameter, row), value)
+                     for parameter, row, value in overrides)
+
+
+def get_default_name(variants: list) -> str:
+    # короткое имя для колонок таблицы сравнения, сами изменения перечисляются в сводке вариантов
+    return 'Вариант {}'.format(len(variants) + 1)
+
+
+def get_variants(sweep_config: dict) -> list:
+    # варианты задаются списком (variants) и/или сеткой значений (grid) - тогда берутся все их сочетания
+    variants = []
+    for parameters in sweep_config.get('variants') or []:
+        parameters = dict(parameters)
+        name = parameters.pop('name', None)
+        overrides = get_overrides(parameters)
+        variants.append((str(name) if name is not None else get_default_name(variants), overrides))
+
+    grid = get_overrides(sweep_config.get('grid') or {})
+    grid_values = [value if isinstance(value, list) else [value] for _, _, value in grid]
+    for values in itertools.product(*grid_values) if grid else []:
+        overrides = [(parameter, row, value) for (parameter, row, _), value in zip(grid, values)]
+        variants.append((get_default_name(variants), overrides))
+
+    names = [name for name, _ in variants]
+    duplicates = sorted({name for name in names if names.count(name) > 1} | ({BASELINE} & set(names)))
+    if duplicates:
+        raise SweepConfigError('Variant names must be unique and differ from "{}": {}.'.format(
+            BASELINE, ', '.join(duplicates)))
+    return variants
+
+
+def apply_overrides(rank_formula_config: RankFormulaConfig, overrides: list) -> RankFormulaConfig:
+    rank_formula_config = copy.deepcopy(rank_formula_config)
+    for parameter, row, value in overrides:
+        if row is None:
+            setattr(rank_formula_config, parameter, value)
+            continue
+
+        key_column, value_column = TABLE_PARAMETERS[parameter]
+        df = getattr(rank_formula_config, parameter).copy()
+        keys = df[key_column].astype(str)
+        # возрастная группа без пола (как на листе конфигуратора) меняет ранг группы и у мужчин, и у женщин
+        mask = (keys == row) | (keys.str[1:] == row) if parameter == 'group_rank_df' else keys == row
+        if not mask.any():
+            raise SweepConfigError(f'Row "{row}" was not found in parameter "{parameter}".')
+        # коэффициенты и штрафы приводятся к Decimal так же, как при загрузке конфигуратора
+        value = int(value) if parameter == 'group_rank_df' else get_decimals(value * 100) / 100
+        df.loc[mask.to_numpy(), value_column] = value
+        setattr(rank_formula_config, parameter, df)
+    return rank_formula_config
+
+
+def apply_formula_tables(df: pd.DataFrame, rank_formula_config: RankFormulaConfig) -> pd.DataFrame:
+    # коэффициенты и ранги групп уже обработанных протоколов пересчитываются по таблицам варианта
+    # так же, как их проставляет prepare_protocols, поэтому протоколы разбираются один раз на все варианты
+    race_type = rank_formula_config.race_type_df.set_index('Вид старта')['Коэффициент вида старта']
+    race_level = rank_formula_config.race_level_df.set_index('Уровень старта')['Коэффициент уровня старта']
+    group_rank = rank_formula_config.group_rank_df.set_index('Возрастная группа')['Ранг группы']
+
+    df = df.copy()
+    df['Коэффициент вида старта'] = df['Вид старта'].map(race_type)
+    df['Коэффициент уровня старта'] = 1 + df['Уровень старта'].map(race_level).fillna(0)
+    df['Ранг группы'] = df['Возрастная группа'].map(group_rank)
+    return df
+
+
+def evaluate_variant(application_config: ApplicationConfig, rank_formula_config: RankFormulaConfig,
+                     protocols_df: pd.DataFrame, left_races_df: pd.DataFrame,
+                     df_previous_year_final_rank: pd.DataFrame) -> pd.DataFrame:
+    race_number_to_start_apply_rules, race_number_to_start_apply_relative_rank = get_race_numbers(
+        application_config, rank_formula_config)
+    current_rank_df = calculate_current_rank(application_config, rank_formula_config,
+                                             RankEngine(application_config.rank_engine),
+                                             apply_formula_tables(protocols_df, rank_formula_config),
+                                             apply_formula_tables(left_races_df, rank_formula_config),
+                                             df_previous_year_final_rank, race_number_to_start_apply_rules,
+                                             race_number_to_start_apply_relative_rank, write_results=False)
+
+    # после последнего соревнования сезона сравнивается итоговый ранг, иначе - текущий
+    rank_column = 'Итоговый ранг' if application_config.last_race_flag == 'да' else 'Текущий ранг'
+    current_rank_df = current_rank_df[current_rank_df['Текущий ранг'].notna()]
+    result_df = current_rank_df[PARTICIPANT_FIELDS].reset_index(drop=True)
+    result_df['Ранг'] = get_float_values(current_rank_df[rank_column])
+    return result_df
+
+
+def init_sweep_process(log_queue: multiprocessing.Queue):
+    # расчет каждого варианта не выводит ход расчета по соревнованиям, только ошибки - через очередь в лог
+    # основного процесса
+    setup_process_logging(log_queue)
+    logging.disable(logging.INFO)
+
+
+def run_variants(application_config: ApplicationConfig, rank_formula_configs: dict, protocols_df: pd.DataFrame,
+                 left_races_df: pd.DataFrame, df_previous_year_final_rank: pd.DataFrame, workers: int) -> dict:
+    results = {}
+    log_queue = multiprocessing.Queue()
+    log_listener = start_log_listener(log_queue)
+    try:
+        with ProcessPoolExecutor(max_workers=min(len(rank_formula_configs), workers or os.cpu_count()),
+                                 initializer=init_sweep_process, initargs=(log_queue,)) as executor:
+            futures = {name: executor.submit(evaluate_variant, application_config, rank_formula_config, protocols_df,
+                                             left_races_df, df_previous_year_final_rank)
+                       for name, rank_formula_config in rank_formula_configs.items()}
+            for name, future in futures.items():
+                results[name] = future.result()
+                logging.info('Вариант "{}": рассчитан'.format(name))
+    finally:
+        log_listener.stop()
+    return results
+
+
+def get_places(df: pd.DataFrame) -> pd.Series:
+    # место в ранге своего пола, как в файлах ранга мужчин и женщин
+    return df.groupby('Пол')['Ранг'].rank(method='min', ascending=False)
+
+
+def compare_variants(results: dict, variants: list) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # таблица изменений ранга и места каждого участника по вариантам и сводка вариантов относительно базового
+    baseline_df = results[BASELINE].copy()
+    baseline_df['Место'] = get_places(baseline_df)
+    baseline_df = baseline_df.sort_values(by='Ранг', ascending=False, kind='mergesort')
+
+    comparison_df = pd.DataFrame({'Участник': baseline_df['Фамилия'] + ' ' + baseline_df['Имя'],
+                                  'Г.р.': baseline_df['Г.р.'],
+                                  'Пол': baseline_df['Пол'],
+                                  'Базовый ранг': baseline_df['Ранг'].round(2),
+                                  'Место': baseline_df['Место']})
+    summary = []
+    for name, overrides in variants:
+        variant_df = results[name].copy()
+        variant_df['Место'] = get_places(variant_df)
+        df = baseline_df.merge(variant_df, how='left', on=PARTICIPANT_FIELDS, suffixes=(None, '_variant'))
+        rank_change = (df['Ранг_variant'] - df['Ранг']).to_numpy()
+        place_change = (df['Место'] - df['Место_variant']).to_numpy()
+        # DataFrame.corr считает корреляцию Спирмена без scipy, в отличие от Series.corr
+        correlation = df[['Ранг', 'Ранг_variant']].corr(method='spearman').iloc[0, 1]
+        comparison_df['{}: Δ ранга'.format(name)] = np.round(rank_change, 2)
+        comparison_df['{}: Δ места'.format(name)] = place_change
+
+        summary.append({'Вариант': name,
+                        'Изменения': get_variant_name(overrides),
+                        'Корреляция рангов с базовым (Спирмен)': round(correlation, 4),
+                        'Средн. |Δ ранга|': round(np.nanmean(np.abs(rank_change)), 2),
+                        'Макс. |Δ ранга|': round(np.nanmax(np.abs(rank_change)), 2),
+                        'Изменили место': int((np.nan_to_num(place_change) != 0).sum()),
+                        'Участников': len(variant_df)})
+    return comparison_df.astype({'Место': 'Int64'}), pd.DataFrame(summary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение вариантов формулы ранга на одном наборе протоколов')
+    parser.add_argument('variants', type=Path,
+                        help='YAML-файл с вариантами: список variants и/или сетка значений grid')
+    parser.add_argument('--workers', type=int, default=0, help='кол-во процессов (по умолчанию - по числу ядер)')
+    args = parser.parse_args()
+
+    application_config, rank_formula_config = load_configs()
+    with open(args.variants, encoding='utf-8') as f:
+        sweep_config = yaml.safe_load(f) or {}
+    variants = get_variants(sweep_config)
+    if not variants:
+        raise SweepConfigError('No variants were found in "{}".'.format(args.variants))
+    rank_formula_configs = {BASELINE: rank_formula_config}
+    rank_formula_configs.update((name, apply_overrides(rank_formula_config, overrides)) for name, overrides in variants)
+
+    logging.info('{}: {} вариантов формулы ранга'.format(application_config.rank_to_calculate, len(variants)))
+    if application_config.protocol_source_type == 'Ссылка':
+        from downloader import download_protocols
+        download_protocols(application_config)
+    # сравнение вариантов ничего не меняет в папке ранга, кроме собственных файлов: сводные файлы протоколов и
+    # база сезона не перезаписываются
+    protocols_df, left_races_df, _ = prepare_protocols(application_config, rank_formula_config, write_results=False)
+    df_previous_year_final_rank = get_previous_year_final_rank(application_config, update_store=False)
+
+    # варианты считаются с нуля, без контрольных точек расчета
+    application_config.incremental_calculation = 'нет'
+    results = run_variants(application_config, rank_formula_configs, protocols_df, left_races_df,
+                           df_previous_year_final_rank, args.workers)
+
+    comparison_df, summary_df = compare_variants(results, variants)
+    logging.info('Сравнение с базовым вариантом:\n' + summary_df.drop(columns='Изменения').to_string(index=False))
+    output_writer.write(application_config.rank_dir / 'Сравнение вариантов формулы ранга_{}.xlsx'.format(
+        application_config.season), comparison_df, index=False)
+    output_writer.write(application_config.rank_dir / 'Варианты формулы ранга_{}.xlsx'.format(
+        application_config.season), summary_df, index=False)
+    output_writer.flush()
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    setup_logging()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            main()
+    except Error as e:
+        logging.error(e)
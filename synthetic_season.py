@@ -0,0 +1,177 @@
+import random
+import re
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from rank_formula_config import RankFormulaConfig
+
+SURNAME_ROOTS = ['Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов', 'Михайлов', 'Новиков',
+                 'Федоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семенов', 'Егоров', 'Павлов', 'Козлов',
+                 'Степанов', 'Николаев', 'Орлов', 'Андреев', 'Макаров', 'Никитин', 'Захаров', 'Зайцев', 'Соловьев',
+                 'Борисов', 'Яковлев', 'Григорьев', 'Романов', 'Воробьев', 'Сергеев', 'Кузьмин', 'Фролов',
+                 'Александров', 'Дмитриев', 'Королев', 'Гусев', 'Киселев', 'Ильин', 'Максимов', 'Поляков',
+                 'Сорокин', 'Виноградов', 'Ковалев', 'Белов', 'Медведев', 'Антонов', 'Тарасов', 'Жуков', 'Баранов',
+                 'Филиппов', 'Комаров', 'Давыдов', 'Беляев', 'Герасимов', 'Богданов', 'Осипов', 'Сидоров']
+SURNAME_SUFFIXES = {'': 'а', 'ский': 'ская'}
+MALE_NAMES = ['АЛЕКСАНДР', 'АЛЕКСЕЙ', 'АНДРЕЙ', 'АНТОН', 'АРТЕМ', 'ВИКТОР', 'ВЛАДИМИР', 'ДЕНИС', 'ДМИТРИЙ',
+              'ЕВГЕНИЙ', 'ИВАН', 'ИГОРЬ', 'ИЛЬЯ', 'КИРИЛЛ', 'МАКСИМ', 'МИХАИЛ', 'НИКИТА', 'НИКОЛАЙ', 'ОЛЕГ',
+              'ПАВЕЛ', 'РОМАН', 'СЕРГЕЙ', 'ЮРИЙ', 'ЯРОСЛАВ']
+FEMALE_NAMES = ['АЛЕКСАНДРА', 'АЛИНА', 'АННА', 'ВАРВАРА', 'ВЕРА', 'ВИКТОРИЯ', 'ДАРЬЯ', 'ЕВГЕНИЯ', 'ЕКАТЕРИНА',
+                'ЕЛЕНА', 'ИРИНА', 'КСЕНИЯ', 'ЛЮДМИЛА', 'МАРИНА', 'МАРИЯ', 'НАДЕЖДА', 'НАТАЛЬЯ', 'ОКСАНА', 'ОЛЬГА',
+                'ПОЛИНА', 'СВЕТЛАНА', 'СОФИЯ', 'ТАТЬЯНА', 'ЮЛИЯ']
+TEAMS = ['ФСО РК', 'КСО Прионежье', 'Бегущий лось', 'СДЮСШОР-2', 'О-Клуб', 'Лично']
+QUALIFICATIONS = ['МС', 'КМС', 'I', 'II', 'III', 'Iю', 'IIю', 'IIIю', '']
+
+# названия распознаются тем же сопоставлением уровня старта, что и в реальных протоколах
+COMPETITION_NAMES = ['Чемпионат и первенство г.Петрозаводска', 'Клубный кубок Карелии (ККК)',
+                     'Первенство Республики Карелия, общий старт', 'Вечерний старт', 'Онежская весна',
+                     'Клубный кубок Карелии (ККК), общий старт', 'Всероссийские соревнования Северная тропа',
+                     'Кросс-классика']
+
+PROTOCOL_COLUMNS = ['№ п/п', 'Номер', 'Фамилия, Имя', 'Г.р.', 'Разр.', 'Команда', 'Результат', 'Место',
+                    'Отставание']
+
+
+def get_group_age(group: str, rnd: random.Random) -> int:
+    # возраст участника по номеру группы: младшие группы - не старше номера группы, остальные - не младше
+    numbers = re.findall('[0-9]+', group)
+    if not numbers:
+        return rnd.randint(21, 40)
+    age = int(numbers[0])
+    if age < 21:
+        return age - rnd.randint(0, 1)
+    return age + rnd.randint(0, 4)
+
+
+def generate_participants(rank_formula_config: RankFormulaConfig, season: int, participants_number: int,
+                          seed: int = 0) -> pd.DataFrame:
+    # участники равномерно распределены по возрастным группам листа "Ранг группы" конфигуратора формулы ранга
+    rnd = random.Random(seed)
+    groups = rank_formula_config.group_rank_df['Возрастная группа'].astype(str).to_list()
+
+    participants = {}
+    while len(participants) < participants_number:
+        group = rnd.choice(groups)
+        sex = group[:1]
+        suffix = rnd.choice(list(SURNAME_SUFFIXES))
+        if sex == 'Ж':
+            surname = rnd.choice(SURNAME_ROOTS) + SURNAME_SUFFIXES[suffix]
+            name = rnd.choice(FEMALE_NAMES)
+        else:
+            surname = rnd.choice(SURNAME_ROOTS) + suffix
+            name = rnd.choice(MALE_NAMES)
+        yob = season - get_group_age(group, rnd)
+        participants.setdefault((surname.upper(), name, yob, sex), group)
+
+    df = pd.DataFrame([key + (group,) for key, group in participants.items()],
+                      columns=['Фамилия', 'Имя', 'Г.р.', 'Пол', 'Возрастная группа'])
+    df['Команда'] = [rnd.choice(TEAMS) for _ in range(len(df))]
+    df['Разр.'] = [rnd.choice(QUALIFICATIONS) for _ in range(len(df))]
+    # уровень участника: чем меньше, тем быстрее он бежит
+    df['Уровень'] = [rnd.lognormvariate(0, 0.15) for _ in range(len(df))]
+    return df
+
+
+def format_time(seconds: int) -> str:
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def get_protocol_html(competition: str, competition_date: date, groups: dict) -> str:
+    html = ['<html><head><meta http-equiv="Content-Type" content="text/html; charset=utf-8">'
+            '<title>Протокол результатов</title></head><body>',
+            '<h1>Протокол результатов {}\n{}, г. Петрозаводск</h1>'.format(competition,
+                                                                         competition_date.strftime('%d.%m.%Y'))]
+    for group, rows in groups.items():
+        html.append('<h2>{}</h2>'.format(group))
+        html.append('<table><tr>{}</tr>'.format(''.join('<th>{}</th>'.format(column) for column in PROTOCOL_COLUMNS)))
+        for row in rows:
+            html.append('<tr>{}</tr>'.format(''.join('<td>{}</td>'.format(value) for value in row)))
+        html.append('</table>')
+    html.append('</body></html>')
+    return '\n'.join(html)
+
+
+def get_group_rows(participants_df: pd.DataFrame, left_race_share: float, not_started_share: float,
+                   rnd: random.Random) -> list:
+    # строки протокола одной группы: сначала финишировавшие по месту, затем снятые и не стартовавшие
+    base_time = rnd.randint(1800, 4200)
+    finished = []
+    not_finished = []
+    for participant in participants_df.itertuples(index=False):
+        number = rnd.randint(100, 999)
+        draw = rnd.random()
+        if draw < not_started_share:
+            not_finished.append((number, participant, 'н/с'))
+        elif draw < not_started_share + left_race_share:
+            not_finished.append((number, participant, rnd.choice(['cнят', 'cнят (запр.)', 'п.п. 4'])))
+        else:
+            finished.append((int(base_time * participant.Уровень * rnd.gauss(1, 0.08)), number, participant))
+    finished.sort(key=lambda result: result[0])
+
+    rows = []
+    for place, (seconds, number, participant) in enumerate(finished, start=1):
+        rows.append((place, number, participant.Фамилия + ' ' + participant.Имя, participant.Гр, participant.Разр,
+                     participant.Команда, format_time(seconds), place,
+                     '+' + format_time(seconds - finished[0][0])))
+    for number, participant, result in not_finished:
+        rows.append(('', number, participant.Фамилия + ' ' + participant.Имя, participant.Гр, participant.Разр,
+                     participant.Команда, result, '', ''))
+    return rows
+
+
+def generate_protocols(participants_df: pd.DataFrame, protocols_dir: Path, season: int, competitions_number: int,
+                       attendance: float = 0.4, left_race_share: float = 0.03, not_started_share: float = 0.05,
+                       seed: int = 0) -> int:
+    # протоколы сезона в формате, который читает prepare_protocols; возвращает кол-во строк во всех протоколах
+    rnd = random.Random(seed)
+    protocols_dir = Path(protocols_dir)
+    protocols_dir.mkdir(parents=True, exist_ok=True)
+    participants_df = participants_df.rename(columns={'Г.р.': 'Гр', 'Разр.': 'Разр'})
+
+    # соревнования распределены по сезону с мая по октябрь
+    season_start = date(season, 5, 1)
+    rows_number = 0
+    for competition_number in range(competitions_number):
+        competition_date = season_start + timedelta(days=competition_number * 180 // max(competitions_number, 1))
+        competition = '{} {}'.format(COMPETITION_NAMES[competition_number % len(COMPETITION_NAMES)],
+                                     competition_number + 1)
+
+        field_df = participants_df.sample(frac=attendance, random_state=rnd.randrange(2 ** 32))
+        groups = {}
+        for group, group_df in field_df.groupby('Возрастная группа', sort=True):
+            groups[group] = get_group_rows(group_df, left_race_share, not_started_share, rnd)
+            rows_number += len(groups[group])
+
+        name = '{}_{:03d}_ResultList.htm'.format(competition_date.strftime('%Y%m%d'), competition_number + 1)
+        (protocols_dir / name).write_text(get_protocol_html(competition, competition_date, groups), encoding='utf-8')
+    return rows_number
+
+
+def generate_previous_year_final_rank(participants_df: pd.DataFrame, previous_year_final_rank_dir: Path,
+                                      rank_to_calculate: str, season: int, share: float = 0.5, seed: int = 0):
+    # итоговый ранг прошлого сезона для части участников в формате файла текущего ранга
+    rnd = random.Random(seed)
+    previous_year_final_rank_dir = Path(previous_year_final_rank_dir)
+    previous_year_final_rank_dir.mkdir(parents=True, exist_ok=True)
+
+    df = participants_df.sample(frac=share, random_state=rnd.randrange(2 ** 32))
+    rank_df = pd.DataFrame({'Участник': df['Фамилия'] + ' ' + df['Имя'],
+                            'Г.р.': df['Г.р.'],
+                            'Пол': df['Пол'],
+                            'Итоговый ранг сезона {}'.format(season - 1): (100 / df['Уровень']).round(2)})
+    rank_df.to_excel(previous_year_final_rank_dir / '{} на {}-10-01_{}.xlsx'.format(rank_to_calculate, season - 1,
+                                                                                  season - 1), index=False)
+
+
+def generate_season(rank_formula_config: RankFormulaConfig, protocols_dir: Path, previous_year_final_rank_dir: Path,
+                    rank_to_calculate: str, season: int, participants_number: int, competitions_number: int,
+                    attendance: float = 0.4, left_race_share: float = 0.03, not_started_share: float = 0.05,
+                    previous_year_share: float = 0.5, seed: int = 0) -> int:
+    participants_df = generate_participants(rank_formula_config, season, participants_number, seed)
+    if previous_year_share > 0:
+        generate_previous_year_final_rank(participants_df, previous_year_final_rank_dir, rank_to_calculate, season,
+                                          previous_year_share, seed)
+    return generate_protocols(participants_df, protocols_dir, season, competitions_number, attendance,
+                              left_race_share, not_started_share, seed)
@@ -0,0 +1,198 @@
+import cProfile
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from constants import TELEMETRY_DIR, VERSION
+
+if sys.platform == 'win32':
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    ctypes.windll.kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+    ctypes.windll.psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters),
+                                                         wintypes.DWORD]
+else:
+    import resource
+
+
+def get_peak_rss() -> float:
+    # пиковый объем памяти процесса с момента запуска, МБ (ru_maxrss в Linux - в КБ, в macOS - в байтах)
+    if sys.platform == 'win32':
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                                 counters.cb)
+        return counters.PeakWorkingSetSize / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class Span:
+    # один замер этапа: время, процессорное время потока, кол-во строк и пиковая память процесса
+    def __init__(self, telemetry: 'Telemetry', stage: str, fields: dict, detached: bool = False):
+        self._telemetry = telemetry
+        self._detached = detached
+        self.stage = stage
+        self.fields = fields
+        self.rows = None
+        self.record = None
+
+    def __enter__(self):
+        self._parent = self._telemetry.push(self.stage)
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        self._telemetry.pop()
+        self.record = self._telemetry.get_record(self.stage, self._parent, self._wall, wall, cpu, self.rows,
+                                                 exc_type.__name__ if exc_type is not None else None, self.fields)
+        if not self._detached:
+            self._telemetry.add(self.record)
+
+
+class NullSpan:
+    # при выключенной телеметрии замеры не делаются, а установка кол-ва строк ни на что не влияет
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Laps:
+    # замеры последовательных частей одной итерации цикла без выделения их в блоки with:
+    # каждый замер - от предыдущего (или от начала итерации)
+    def __init__(self, telemetry: 'Telemetry', fields: dict):
+        self._telemetry = telemetry
+        self._fields = fields
+        self._parent = telemetry.get_stage()
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+
+    def lap(self, stage: str, rows: Optional[int] = None):
+        wall = time.perf_counter() - self._wall
+        cpu = time.thread_time() - self._cpu
+        self._telemetry.add(self._telemetry.get_record(stage, self._parent, self._wall, wall, cpu, rows, None,
+                                                       self._fields))
+        # время записи замера не входит в следующий замер
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+
+
+class NullLaps:
+    def lap(self, stage: str, rows: Optional[int] = None):
+        pass
+
+
+NULL_LAPS = NullLaps()
+
+
+class Telemetry:
+    def __init__(self):
+        self.enabled = False
+        # начало отсчета времени замеров - загрузка модуля, т.е. запуск приложения
+        self.started = time.perf_counter()
+        self._records = []
+        self._fields = {}
+        self._local = threading.local()
+        self._profiler: Optional[cProfile.Profile] = None
+
+    def start(self, profile: bool = False, **fields):
+        # поля (например, тип ранга) добавляются к каждому замеру
+        self.enabled = True
+        self._records = []
+        self._fields = fields
+        if profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stage(self, stage: str, **fields):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage, fields)
+
+    def laps(self, **fields):
+        if not self.enabled:
+            return NULL_LAPS
+        return Laps(self, fields)
+
+    def measure(self, stage: str, **fields) -> Span:
+        # замер до включения телеметрии (например, загрузки конфигураторов, в которых она включается),
+        # в трассировку попадает только после add(span.record)
+        return Span(self, stage, fields, detached=True)
+
+    def push(self, stage: str) -> Optional[str]:
+        # у каждого потока свой стек вложенных этапов
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(stage)
+        return stack[-2] if len(stack) > 1 else None
+
+    def pop(self):
+        self._local.stack.pop()
+
+    def get_stage(self) -> Optional[str]:
+        stack = self._local.__dict__.get('stack')
+        return stack[-1] if stack else None
+
+    def get_record(self, stage: str, parent: Optional[str], start: float, wall: float, cpu: float,
+                   rows: Optional[int], error: Optional[str], fields: dict) -> dict:
+        return {'stage': stage,
+                'parent': parent,
+                'thread': threading.current_thread().name,
+                'start': round(start - self.started, 6),
+                'wall': round(wall, 6),
+                'cpu': round(cpu, 6),
+                'rows': rows,
+                'peak_rss_mb': round(get_peak_rss(), 1),
+                'error': error,
+                **fields}
+
+    def add(self, record: dict):
+        if self.enabled:
+            self._records.append({**record, **self._fields})
+
+    def stop(self, name: str):
+        # трассировка в JSON и, если включено профилирование, дамп cProfile (смотреть через pstats или snakeviz)
+        if not self.enabled:
+            return
+        self.enabled = False
+        telemetry_dir = Path(TELEMETRY_DIR)
+        telemetry_dir.mkdir(parents=True, exist_ok=True)
+        file_name = '{}_{}'.format(name, datetime.now().strftime('%Y%m%d_%H%M%S'))
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(telemetry_dir / (file_name + '.prof'))
+            self._profiler = None
+
+        # замеры записываются при завершении этапа, поэтому вложенные этапы идут раньше внешних
+        records = sorted(self._records, key=lambda record: record['start'])
+        trace_file = telemetry_dir / (file_name + '.json')
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION, 'name': name, 'spans': records}, f, ensure_ascii=False, indent=2,
+                      default=str)
+        logging.info('Телеметрия сохранена: {}'.format(trace_file))
+
+
+telemetry = Telemetry()
@@ -0,0 +1,102 @@
+import tempfile
+import threading
+import unittest
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+from downloader import create_session, download_protocol
+
+PROTOCOL = '<html><body><h1>Протокол</h1></body></html>'.encode('utf-8')
+
+
+class ProtocolHandler(BaseHTTPRequestHandler):
+    # сервер отдает server.body с ETag; при совпадении If-None-Match отвечает 304,
+    # при server.broken обрывает передачу после части содержимого
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == self.server.etag:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.end_headers()
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('ETag', self.server.etag)
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        if self.server.broken:
+            self.wfile.write(self.server.body[:len(self.server.body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(self.server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ProtocolHandler)
+        self.server.body = PROTOCOL
+        self.server.etag = '"1"'
+        self.server.broken = False
+        self.server.requests = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/protocol.htm'.format(self.server.server_address[1])
+        self.session = create_session(1)
+
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.protocol_file = Path(tmp_dir.name) / 'protocol.htm'
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def download(self, validators: dict) -> tuple[str, dict]:
+        return download_protocol(self.session, self.url, [self.protocol_file], validators)
+
+    def test_new_protocol_is_written(self):
+        status, validators = self.download({})
+        self.assertEqual(status, 'загружен')
+        self.assertEqual(validators, {'ETag': '"1"'})
+        self.assertEqual(self.protocol_file.read_bytes(), PROTOCOL)
+
+    def test_not_modified_protocol_is_skipped(self):
+        self.protocol_file.write_bytes(PROTOCOL)
+        mtime = self.protocol_file.stat().st_mtime_ns
+
+        status, validators = self.download({'ETag': '"1"'})
+        self.assertEqual(status, 'не изменился')
+        self.assertEqual(validators, {'ETag': '"1"'})
+        self.assertEqual(self.server.requests[-1].get('If-None-Match'), '"1"')
+        self.assertEqual(self.protocol_file.stat().st_mtime_ns, mtime)
+
+    def test_same_content_is_not_rewritten(self):
+        # сервер не поддерживает условный запрос (новый ETag), но содержимое то же
+        self.protocol_file.write_bytes(PROTOCOL)
+        mtime = self.protocol_file.stat().st_mtime_ns
+        self.server.etag = '"2"'
+
+        status, validators = self.download({'ETag': '"1"'})
+        self.assertEqual(status, 'не изменился')
+        self.assertEqual(validators, {'ETag': '"2"'})
+        self.assertEqual(self.protocol_file.stat().st_mtime_ns, mtime)
+
+    def test_failed_transfer_keeps_existing_protocol(self):
+        self.protocol_file.write_bytes(PROTOCOL)
+        self.server.body = PROTOCOL * 2
+        self.server.etag = '"2"'
+        self.server.broken = True
+
+        with self.assertRaises(requests.RequestException):
+            self.download({'ETag': '"1"'})
+        self.assertEqual(self.protocol_file.read_bytes(), PROTOCOL)
+        self.assertEqual(list(self.protocol_file.parent.iterdir()), [self.protocol_file])
+
+
+if __name__ == '__main__':
+    unittest.main()
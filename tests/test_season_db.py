@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from participants import PARTICIPANT_FIELDS
+from season_db import CURRENT_RANK_COLUMNS, SeasonDatabase
+
+COMPETITION = '20230506_ResultList.htm'
+
+
+def get_current_rank_df(rank_values: list, penalty_values: list, final_rank_values: list) -> pd.DataFrame:
+    # текущий ранг в том виде, в каком он пишется в файл текущего ранга
+    df = pd.DataFrame({
+        'Фамилия': ['ИВАНОВА', 'ПЕТРОВ'],
+        'Имя': ['АРИНА', 'ДЕНИС'],
+        'Г.р.': [2004, 1990],
+        'Пол': ['Ж', 'М'],
+        'Текущий ранг': rank_values,
+        'Итоговый ранг': final_rank_values,
+        'Кол-во cоревнований для текущего ранга': [1.0, 1.0],
+        'Кол-во прошедших соревнований': [1.0, 1.0],
+        'Кол-во соревнований у участника': [1.0, 1.0],
+        'Доля отсутствующих стартов': [0.0, 0.0],
+        '% интервал отсутствующих стартов': ['-', '-'],
+        'Штраф за отсутствующие старты': penalty_values,
+        'Дата текущего соревнования': [date(2023, 5, 6), date(2023, 5, 6)],
+    }, columns=PARTICIPANT_FIELDS + list(CURRENT_RANK_COLUMNS))
+    df.index += 1
+    return df
+
+
+class CurrentRankTest(unittest.TestCase):
+    # файл текущего ранга, сформированный из базы сезона, должен совпадать с рассчитанным, в том числе по типам
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.season_db = SeasonDatabase(SimpleNamespace(rank_dir=Path(tmp_dir.name), rank_to_calculate='Лесной ранг',
+                                                        season=2023))
+
+    def save_and_load(self, current_rank_df: pd.DataFrame) -> pd.DataFrame:
+        protocol_df = current_rank_df[PARTICIPANT_FIELDS].assign(**{
+            'Файл протокола': COMPETITION, 'Соревнование': 'Первенство', 'Дата соревнования': date(2023, 5, 6),
+            'left_race': 'no', 'Ранг': current_rank_df['Текущий ранг']})
+        self.season_db.save_protocols(protocol_df, pd.DataFrame(), pd.DataFrame())
+        self.season_db.save_competition_rank(COMPETITION, 1, None, protocol_df, current_rank_df)
+        return self.season_db.get_current_rank(COMPETITION)
+
+    def test_decimal_rank(self):
+        current_rank_df = get_current_rank_df([Decimal('75.33999999999999519495474945'), Decimal('60.5')],
+                                              [Decimal(1), Decimal('0.95')], [np.nan, np.nan])
+        df = self.save_and_load(current_rank_df)
+        pd.testing.assert_frame_equal(df, current_rank_df)
+        self.assertIsInstance(df['Текущий ранг'].iloc[0], Decimal)
+        self.assertIsInstance(df['Штраф за отсутствующие старты'].iloc[0], Decimal)
+
+    def test_float_rank(self):
+        current_rank_df = get_current_rank_df([75.34, 60.5], [Decimal(1), Decimal('0.95')], [80.1, np.nan])
+        pd.testing.assert_frame_equal(self.save_and_load(current_rank_df), current_rank_df)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,29 @@
 from pathlib import Path
-from typing import Generator
+from typing import Generator, TYPE_CHECKING
 
 import pandas as pd
-from openpyxl import load_workbook, Workbook
 
 from constants import APP_CONFIG_FILE, APP_CONFIG_MAIN_SETTINGS_SHEET, APP_CONFIG_URLS_TO_PROTOCOLS_SHEET, \
-    CONFIG_VERSION_SHEET, APP_CONFIG_VERSION
+    CONFIG_VERSION_SHEET, APP_CONFIG_VERSION, RANK_ENGINES, RANKS
 from errors import Error, AppConfigValidationError
 
+if TYPE_CHECKING:
+    from openpyxl import Workbook
+
 
 def check_app_config():
     check_app_config_exists()
-    wb: Workbook = load_workbook(APP_CONFIG_FILE, read_only=True, keep_vba=False)
+    from openpyxl import load_workbook
+    wb: 'Workbook' = load_workbook(APP_CONFIG_FILE, read_only=True, keep_vba=False)
     check_workbook(wb)
 
 
-def check_app_config_exists():
-    if not Path(APP_CONFIG_FILE).exists():
+def check_app_config_exists(excel_file: str = APP_CONFIG_FILE):
+    if not Path(excel_file).exists():
         raise Error('Excel file with application configuration was not found.')
 
 
-def check_workbook(wb: Workbook):
+def check_workbook(wb: 'Workbook'):
     if CONFIG_VERSION_SHEET not in wb.sheetnames:
         raise AppConfigValidationError('Sheet with version was not found.')
     else:
@@ -41,6 +44,39 @@ def check_workbook(wb: Workbook):
     if protocol_source_type not in ('Файл', 'Ссылка'):
         raise AppConfigValidationError(f'Unsupported protocol source type: "{protocol_source_type}".')
 
+    check_protocols_dirs(main_settings)
+
+    rank_engine = main_settings.get('Движок расчета ранга', 'Decimal')
+    if rank_engine not in RANK_ENGINES:
+        raise AppConfigValidationError(f'Unsupported rank engine: "{rank_engine}". Supported engines: {RANK_ENGINES}.')
+
+    protocols_workers = main_settings.get('Кол-во процессов для обработки протоколов', 1)
+    if not isinstance(protocols_workers, int) or protocols_workers < 0:
+        raise AppConfigValidationError(
+            f'Field "Кол-во процессов для обработки протоколов" must be a non-negative integer: "{protocols_workers}".')
+
+    download_workers = main_settings.get('Кол-во потоков загрузки протоколов', 4)
+    if not isinstance(download_workers, int) or download_workers < 1:
+        raise AppConfigValidationError(
+            f'Field "Кол-во потоков загрузки протоколов" must be a positive integer: "{download_workers}".')
+
+    ranks_to_calculate = main_settings.get('Ранги для расчета')
+    if ranks_to_calculate and ranks_to_calculate != 'все':
+        for rank in ranks_to_calculate.split(','):
+            if rank.strip() and rank.strip() not in RANKS:
+                raise AppConfigValidationError(
+                    f'Unsupported rank in "Ранги для расчета": "{rank.strip()}". Supported ranks: {RANKS}.')
+
+    if protocol_source_type == 'Ссылка':
+        check_urls_to_protocols(wb)
+
+    # TODO: Check 'Путь к файлу с финальным рангом предыдущего года'
+    # TODO: Check 'Путь к папке с результатами'
+
+
+def check_protocols_dirs(main_settings: dict):
+    # проверяется и при загрузке настроек из снимка конфигуратора, так как папки могли удалить без изменения файла
+    protocol_source_type = main_settings['Тип источника протоколов']
     for rank_name in (
             'Общего летнего ранга', 'Общего зимнего ранга', 'Лесного ранга', 'Спринт ранга', 'гонки сильнейших'):
         protocols_dir = f'Путь к папке со всеми протоколами для {rank_name}'
@@ -54,14 +90,8 @@ def check_workbook(wb: Workbook):
             #     raise AppConfigValidationError(
             #         f'Directory "{protocols_dir}" does not contain any protocols (.htm files).')
 
-    if protocol_source_type == 'Ссылка':
-        check_urls_to_protocols(wb)
-
-    # TODO: Check 'Путь к файлу с финальным рангом предыдущего года'
-    # TODO: Check 'Путь к папке с результатами'
-
 
-def check_urls_to_protocols(wb: Workbook):
+def check_urls_to_protocols(wb: 'Workbook'):
     if APP_CONFIG_URLS_TO_PROTOCOLS_SHEET not in wb.sheetnames:
         raise AppConfigValidationError(
             f'Sheet "{APP_CONFIG_URLS_TO_PROTOCOLS_SHEET}" was not found.')
@@ -1,26 +1,31 @@
+import re
 from pathlib import Path
-
-from openpyxl import load_workbook, Workbook
+from typing import TYPE_CHECKING
 
 from constants import RANK_CONFIG_FILE, RANK_CONFIG_MAIN_SETTINGS_SHEET, RANK_CONFIG_RACE_TYPE_SHEET, \
     RANK_CONFIG_RACE_LEVEL_SHEET, RANK_CONFIG_GROUP_RANK_SHEET, RANK_CONFIG_PENALTY_LACK_RACES_SHEET, \
     RANK_CONFIG_PENALTY_NOT_STARTED_SHEET, RANK_CONFIG_PENALTY_LEFT_RACE_SHEET, CONFIG_VERSION_SHEET, \
     RANK_CONFIG_VERSION
 from errors import Error, RankConfigValidationError
+from race_level import RACE_LEVEL_PATTERN_COLUMN
+
+if TYPE_CHECKING:
+    from openpyxl import Workbook
 
 
 def check_rank_config():
     check_rank_config_exists()
-    wb: Workbook = load_workbook(RANK_CONFIG_FILE, read_only=True, keep_vba=False)
+    from openpyxl import load_workbook
+    wb: 'Workbook' = load_workbook(RANK_CONFIG_FILE, read_only=True, keep_vba=False)
     check_workbook(wb)
 
 
-def check_rank_config_exists():
-    if not Path(RANK_CONFIG_FILE).exists():
+def check_rank_config_exists(excel_file: str = RANK_CONFIG_FILE):
+    if not Path(excel_file).exists():
         raise Error('Excel file with rank configuration was not found.')
 
 
-def check_workbook(wb: Workbook):
+def check_workbook(wb: 'Workbook'):
     if CONFIG_VERSION_SHEET not in wb.sheetnames:
         raise RankConfigValidationError('Sheet with version was not found.')
     else:
@@ -39,3 +44,22 @@ def check_workbook(wb: Workbook):
                   RANK_CONFIG_PENALTY_LEFT_RACE_SHEET):
         if sheet not in wb.sheetnames:
             raise RankConfigValidationError(f'Sheet "{sheet}" was not found.')
+
+    check_race_level_patterns(wb)
+
+
+def check_race_level_patterns(wb: 'Workbook'):
+    values = wb[RANK_CONFIG_RACE_LEVEL_SHEET].values
+    header = next(values, ())
+    if RACE_LEVEL_PATTERN_COLUMN not in header:
+        return None
+    pattern_column = header.index(RACE_LEVEL_PATTERN_COLUMN)
+    for row in values:
+        pattern = row[pattern_column] if len(row) > pattern_column else None
+        if pattern is None or not str(pattern).strip():
+            continue
+        try:
+            re.compile(str(pattern).strip())
+        except re.error as e:
+            raise RankConfigValidationError(
+                f'Invalid pattern "{pattern}" in sheet "{RANK_CONFIG_RACE_LEVEL_SHEET}": {e}.')
@@ -0,0 +1,102 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+import warnings
+
+from errors import Error
+from logger import setup_logging
+from rank_service import CONFIG_FILES, RankService, get_file_state
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_DEBOUNCE = 5.0
+
+
+def get_watched_files(service: RankService) -> dict:
+    # протоколы (временные и скрытые файлы, которые еще дописываются, не учитываются) и оба конфигуратора
+    protocols_dir = service.application_config.protocols_dir
+    files = {}
+    if protocols_dir.is_dir():
+        for name in os.listdir(protocols_dir):
+            if not name.startswith('.') and not name.endswith('.tmp'):
+                state = get_file_state(protocols_dir / name)
+                if state is not None:
+                    files[protocols_dir / name] = state
+    for config_file in CONFIG_FILES:
+        files[config_file] = get_file_state(config_file)
+    return files
+
+
+def get_changed_files(files: dict, new_files: dict) -> list:
+    return sorted((str(file) for file in set(files) | set(new_files) if files.get(file) != new_files.get(file)))
+
+
+def wait_for_changes(service: RankService, files: dict, interval: float, debounce: float) -> dict:
+    # в день старта протоколы приходят сериями и перезаписываются по несколько раз, поэтому пересчет начинается
+    # только после того, как файлы не менялись debounce секунд
+    new_files = files
+    while new_files == files:
+        time.sleep(interval)
+        new_files = get_watched_files(service)
+    last_change = time.monotonic()
+    while time.monotonic() - last_change < debounce:
+        time.sleep(interval)
+        latest_files = get_watched_files(service)
+        if latest_files != new_files:
+            new_files = latest_files
+            last_change = time.monotonic()
+    return new_files
+
+
+def watch(service: RankService, interval: float, debounce: float):
+    # пересчитывается только то, что затронули изменения: измененный протокол разбирается заново (остальные
+    # берутся из памяти), а расчет продолжается из контрольной точки перед первым соревнованием, протокол
+    # или исправленные маппингами строки которого изменились; маппинги применяются к уже разобранным протоколам
+    files = get_watched_files(service)
+    while True:
+        new_files = wait_for_changes(service, files, interval, debounce)
+        changed_files = get_changed_files(files, new_files)
+        logging.info('--Изменены файлы: {}'.format(', '.join(os.path.basename(file) for file in changed_files)))
+        files = new_files
+        try:
+            # измененные конфигураторы перечитывает сам пересчет
+            service.recompute()
+        except Error as e:
+            # конфигуратор может быть сохранен с ошибкой или протокол - не полностью: ждем следующего изменения
+            logging.error(e)
+        except Exception as e:
+            # непредвиденная ошибка (например, pandas на недописанном протоколе) тоже не останавливает наблюдение
+            logging.exception(e)
+        # файлы, измененные во время пересчета, будут обработаны следующим пересчетом
+        logging.info('Ожидание изменений в {}'.format(service.application_config.protocols_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пересчет ранга при изменении протоколов и конфигураторов')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help='период проверки файлов в секундах (по умолчанию {})'.format(DEFAULT_INTERVAL))
+    parser.add_argument('--debounce', type=float, default=DEFAULT_DEBOUNCE,
+                        help='пересчет после того, как файлы не менялись столько секунд (по умолчанию {})'
+                        .format(DEFAULT_DEBOUNCE))
+    args = parser.parse_args()
+
+    service = RankService()
+    logging.info(service.application_config.rank_to_calculate)
+    service.recompute()
+    logging.info('Ожидание изменений в {}'.format(service.application_config.protocols_dir))
+    try:
+        watch(service, args.interval, args.debounce)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    setup_logging()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            main()
+    except Error as e:
+        logging.error(e)